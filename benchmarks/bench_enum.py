@@ -0,0 +1,65 @@
+"""
+Compare the metaclass based `enum` that `to_enumable` used to build with FrozenEnum.
+
+    python -m benchmarks.bench_enum
+"""
+import gc
+import random
+import timeit
+import tracemalloc
+
+from jirabuddy.common.enum import enum, get_path_from_dict, to_enumable
+
+SIZES = (100, 1000, 10000)
+
+
+def legacy_to_enumable(name, key, value, iterable, clean_values=False):
+    # to_enumable as it was, going through enum() and its json copy
+    iterable_dict = [item.__dict__ if not isinstance(item, dict) else item for item in iterable]
+    tuples = []
+    for idx, i in enumerate(iterable_dict):
+        k = get_path_from_dict(i, key)
+        v = iterable[idx] if value is None else get_path_from_dict(i, value)
+        tuples.append((k, v))
+    return enum(name, clean_variables=True, **dict(tuples))
+
+
+def make_fields(count: int):
+    return [{"id": "customfield_%d" % idx, "name": "Custom Field %d" % idx, "custom": True,
+             "schema": {"type": "string", "customId": idx}} for idx in range(count)]
+
+
+def retained(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    print("%8s %14s %14s %12s %12s %12s %12s" % ("members", "legacy (ms)", "frozen (ms)", "legacy (KB)",
+                                                 "frozen (KB)", "legacy get", "frozen get"))
+    for count in SIZES:
+        fields = make_fields(count)
+        build_legacy = lambda: legacy_to_enumable("Fields", "name", None, fields)
+        build_frozen = lambda: to_enumable("Fields", "name", None, fields)
+
+        legacy, frozen = build_legacy(), build_frozen()
+        names = random.Random(count).choices([f["name"].replace(" ", "_") for f in fields], k=1000)
+        assert all(legacy[n] is frozen[n] for n in names)
+
+        repeat = max(1, 20000 // count)
+        legacy_time = timeit.timeit(build_legacy, number=repeat) * 1e3 / repeat
+        frozen_time = timeit.timeit(build_frozen, number=repeat) * 1e3 / repeat
+        legacy_get = timeit.timeit(lambda: [legacy.get(n) for n in names], number=10) * 1e5 / len(names)
+        frozen_get = timeit.timeit(lambda: [frozen.get(n) for n in names], number=10) * 1e5 / len(names)
+        print("%8d %14.2f %14.2f %12.1f %12.1f %10.3fus %10.3fus" % (
+            count, legacy_time, frozen_time, retained(build_legacy) / 1024, retained(build_frozen) / 1024,
+            legacy_get, frozen_get))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Replay an RTM event stream through the Dispatcher against local Jira and GitLab fakes, fully offline.
+
+    python -m benchmarks.bench_replay --messages 2000 --rate 200 --jira-latency 0.02
+    python -m benchmarks.bench_replay --events recorded.jsonl --rate 0
+
+Events are JSON objects, one per line, as received from rtm_read (type, channel, user, text...). Without
+--events a synthetic stream is generated (--record saves it). Reports throughput and the latency from an event to
+the bot's reply, then replays the events again under tracemalloc to report the memory the bot keeps growing
+(allocated by jirabuddy's code, the fakes run in the same process). The replies to generated commands are checked
+against what the replay plugins answer given the fakes' data, the run exits with 1 if any is wrong or missing.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from typing import List, Pattern
+
+import jirabuddy
+from benchmarks import replay_plugins
+from benchmarks.fakes import FakeGitLab, FakeJira, ReplaySlackClient
+from jirabuddy.bot.dispatcher import Dispatcher
+from jirabuddy.bot.outbox import Outbox
+from jirabuddy.bot.plugins_manager import PluginsManager
+from jirabuddy.clients import GitLabClient, JiraClient
+from jirabuddy.common import FreeTextParser
+
+BOT_ID = "UBOT"
+# allocations the memory report is made of
+BOT_ALLOCATIONS = tracemalloc.Filter(True, os.path.join(os.path.dirname(jirabuddy.__file__), "*"))
+COMMANDS = ("ticket ABC-{ticket}",
+            "tickets 20",
+            "who is user{user}",
+            "parse bug in Alpha for user{user} High",
+            "what is the meaning of life")
+CHATTER = ("good morning", "ABC-{ticket} is blocked again", "lunch?", "deploy of ABC-{ticket} is done")
+
+
+def generate_events(count: int, commands_ratio: float = 0.5, seed: int = 0) -> List[dict]:
+    """Commands to the bot, each in a channel of its own so replies are timed exactly, among channel chatter"""
+    rnd = random.Random(seed)
+    events = []
+    for idx in range(count):
+        values = {"ticket": rnd.randrange(1000), "user": rnd.randrange(500)}
+        user = "U%03d" % rnd.randrange(50)
+        if rnd.random() < commands_ratio:
+            text = "<@%s> %s" % (BOT_ID, rnd.choice(COMMANDS).format(**values))
+            channel = "C%06d" % idx
+        else:
+            text = rnd.choice(CHATTER).format(**values)
+            channel = "CGENERAL"
+        events.append({"type": "message", "channel": channel, "user": user, "text": text,
+                       "ts": "%d.%06d" % (1600000000 + idx, idx)})
+    return events
+
+
+def expected_reply(event: dict) -> Pattern:
+    """What the replay plugins answer to a generated command, given the fakes' tickets and users"""
+    command = event["text"].split("> ", 1)[-1]
+    # msg.reply mentions the author
+    reply = "<@%s>: " % event["user"]
+    match = re.match(r"ticket ABC-(\d+)$", command)
+    if match:
+        number = int(match.group(1))
+        status = FakeJira.STATUSES[number % len(FakeJira.STATUSES)]
+        return _exactly(reply + "ABC-%d: ticket %d (%s)" % (number, number, status))
+    match = re.match(r"tickets (\d+)$", command)
+    if match:
+        return _exactly(reply + ", ".join("ABC-%d" % number for number in range(int(match.group(1)))))
+    match = re.match(r"who is user(\d+)$", command)
+    if match:
+        return _exactly(reply + "user%s is User %s" % (match.group(1), match.group(1)))
+    if command.startswith("parse "):
+        return _exactly(reply + "found ['gitlab_user', 'jira_priority', 'jira_project', 'jira_ticket_type'], left []")
+    # followed by the plugins' help
+    return re.compile(re.escape('Bad command "%s".' % command) + ".*", re.S)
+
+
+def _exactly(text: str) -> Pattern:
+    return re.compile(re.escape(text))
+
+
+def load_events(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def build_dispatcher(client: ReplaySlackClient, args) -> Dispatcher:
+    jira = JiraClient(args.jira_url, "bench", "bench", lazy=True, default_project="ABC")
+    gitlab = GitLabClient(args.gitlab_url, "token")
+    parser = FreeTextParser()
+    parser.ignore("on", "for", "to", "in")
+    parser.register_enum(lambda: jira.Projects, name="jira_project")
+    parser.register_enum(lambda: jira.TicketTypes, name="jira_ticket_type")
+    parser.register_enum(lambda: jira.Priorities, name="jira_priority")
+    parser.register("gitlab_user", gitlab.usernames.get)
+
+    # no rate limit nor coalescing, every reply is sent (and timed) on its own
+    outbox = Outbox(rate=0, coalesce_window=0, max_message_size=0)
+    dispatcher = Dispatcher(client, PluginsManager(), "errors", workers=args.workers, queue_size=args.queue_size,
+                            outbox=outbox)
+    parser.register_batch("slack_user", dispatcher.directory.find_users)
+    dispatcher.register("jira", jira)
+    dispatcher.register("gitlab", gitlab)
+    dispatcher.register("text_parser", parser)
+    return dispatcher
+
+
+def replay(client: ReplaySlackClient, timeout: float) -> float:
+    """Replay the events until every command was answered (or `timeout` passed since the last event)"""
+    start = time.perf_counter()
+    client.start()
+    deadline = None
+    while client.unanswered or not client.finished_replay:
+        if client.finished_replay:
+            deadline = deadline or time.perf_counter() + timeout
+            if time.perf_counter() > deadline:
+                break
+        time.sleep(0.01)
+    return (client.last_reply or time.perf_counter()) - (client.first_release or start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", help="JSONL file of RTM events to replay")
+    parser.add_argument("--messages", type=int, default=2000, help="synthetic events to generate")
+    parser.add_argument("--record", help="save the generated events to this JSONL file")
+    parser.add_argument("--rate", type=float, default=0, help="events per second, 0 releases them all at once")
+    parser.add_argument("--jira-latency", type=float, default=0.01, help="seconds per Jira request")
+    parser.add_argument("--gitlab-latency", type=float, default=0.01, help="seconds per GitLab request")
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--filler-plugins", type=int, default=100, help="extra plugins the commands don't match")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for replies after the replay")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows the bot down)")
+    parser.add_argument("--log-level", default="ERROR", help="the bot's logging level, e.g. WARNING to see rejections")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+
+    events = load_events(args.events) if args.events else generate_events(args.messages)
+    if args.record:
+        with open(args.record, "w") as f:
+            f.writelines(json.dumps(event) + "\n" for event in events)
+
+    jira_server = FakeJira(latency=args.jira_latency).start()
+    gitlab_server = FakeGitLab(latency=args.gitlab_latency).start()
+    args.jira_url, args.gitlab_url = jira_server.url, gitlab_server.url
+    replay_plugins.register_filler_plugins(args.filler_plugins)
+
+    # generated commands are alone in their channel, their replies are checked
+    expected = {} if args.events else {event["channel"]: expected_reply(event) for event in events
+                                       if event["channel"] != "CGENERAL"}
+    client = ReplaySlackClient(events, rate=args.rate, bot_id=BOT_ID, expected=expected)
+    dispatcher = build_dispatcher(client, args)
+    loop = threading.Thread(target=dispatcher.loop, name="rtm-loop", daemon=True)
+    dispatcher.start()
+    loop.start()
+
+    elapsed = replay(client, args.timeout)
+    latencies, released, unanswered = client.latencies, client.released, client.unanswered
+    replies, busy = client.replies, client.busy_replies
+    wrong, wrong_samples, commands = client.wrong_replies, client.wrong_samples, client.commands
+    if not args.no_memory:
+        # tracing slows the bot down, so memory is measured on a second (warm) replay of the same events
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot().filter_traces([BOT_ALLOCATIONS])
+        replay(client, args.timeout)
+        growth = tracemalloc.take_snapshot().filter_traces([BOT_ALLOCATIONS]).compare_to(baseline, "lineno")
+        tracemalloc.stop()
+    dispatcher.shutdown = True
+    dispatcher._wakeup()
+    loop.join()
+
+    print("replayed %d events (%d commands) in %.2fs, %d workers, %d plugins" % (
+        released, commands, elapsed, args.workers,
+        sum(len(dispatcher._plugins_manager.get_plugins_category(c)) for c in ("respond_to", "listen_to"))))
+    print("throughput     %10.1f msgs/s" % (released / elapsed if elapsed else 0))
+    print("reply latency  p50 %.1fms  p99 %.1fms  max %.1fms" % (
+        percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3, max(latencies or [0]) * 1e3))
+    print("replies        %d (%d busy), %d commands unanswered" % (replies, busy, unanswered))
+    print("requests       jira %d, gitlab %d" % (jira_server.requests, gitlab_server.requests))
+    if expected:
+        print("wrong replies  %d" % wrong)
+        for channel, text in wrong_samples:
+            print("  %s: %.200r" % (channel, text))
+    if not args.no_memory:
+        total = sum(stat.size_diff for stat in growth)
+        print("memory growth  %.1f KB over a second replay (%.2f KB per event), largest:" % (
+            total / 1024, total / 1024 / max(1, released)))
+        for stat in growth[:5]:
+            frame = stat.traceback[0]
+            print("  %+9.1f KB  %s:%d" % (stat.size_diff / 1024, frame.filename, frame.lineno))
+
+    jira_server.stop()
+    gitlab_server.stop()
+    # a benchmark of a bot giving wrong answers (or none, or too many) doesn't count
+    if expected and (wrong or unanswered or replies != commands):
+        print("replay FAILED: %d wrong replies, %d unanswered, %d replies to %d commands" % (
+            wrong, unanswered, replies, commands))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compare PluginsManager's linear regex scan with RegexRouter.
+
+    python -m benchmarks.bench_router
+"""
+import random
+import timeit
+
+from jirabuddy.bot.plugins import RegexPlugin
+from jirabuddy.bot.router import RegexRouter
+
+PLUGIN_COUNTS = (10, 100, 1000)
+TEMPLATES = ("^cmd{0}$",
+             "show ticket{0} (\\w+-\\d+)",
+             "create{0} (.*) in (\\w+)",
+             "(?i)remind{0} me (.*)",
+             "(\\d+) plus{0} (\\d+)",
+             ".*deploy{0}.*")
+
+
+def _handler(_, msg):
+    pass
+
+
+def make_plugins(count: int):
+    return [RegexPlugin(_handler, TEMPLATES[idx % len(TEMPLATES)].format(idx), name="plugin%d" % idx)
+            for idx in range(count)]
+
+
+def make_messages(count: int, size: int = 200):
+    rnd = random.Random(count)
+    hits = ["cmd%d" % rnd.randrange(count),
+            "show ticket%d ABC-12" % rnd.randrange(count),
+            "REMIND%d me to review" % rnd.randrange(count)]
+    misses = ["good morning everyone", "can someone look at the build?", "lunch?", "ABC-1234 is blocked"]
+    return [rnd.choice(hits if rnd.random() < 0.3 else misses) for _ in range(size)]
+
+
+def linear(plugins, text):
+    return [(plugin, args) for plugin in plugins for match, args in (plugin.match(text),) if match]
+
+
+def main():
+    print("%8s %14s %14s %8s" % ("plugins", "linear (us)", "router (us)", "speedup"))
+    for count in PLUGIN_COUNTS:
+        plugins = make_plugins(count)
+        router = RegexRouter(plugins)
+        messages = make_messages(count)
+        assert all(linear(plugins, m) == list(router.route(m)) for m in messages)
+
+        repeat = max(1, 2000 // count)
+        linear_time = timeit.timeit(lambda: [linear(plugins, m) for m in messages], number=repeat)
+        router_time = timeit.timeit(lambda: [list(router.route(m)) for m in messages], number=repeat)
+        per_message = 1e6 / (repeat * len(messages))
+        print("%8d %14.2f %14.2f %7.1fx" % (count, linear_time * per_message, router_time * per_message,
+                                             linear_time / router_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+Offline stand-ins for Slack's RTM api, Jira and GitLab, used by the replay benchmark.
+"""
+import json
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Deque, Dict, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from jirabuddy.bot.dispatcher import BUSY_REPLY
+
+Route = Tuple[str, "re.Pattern", Callable]
+# wrong replies kept by ReplaySlackClient
+WRONG_SAMPLES = 5
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is python 3.7+
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """Local json api answering every request after `latency` seconds"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency: float = latency
+        self.requests: int = 0
+        self._routes: List[Route] = []
+        self._lock = threading.Lock()
+        self._server: Optional[_Server] = None
+
+    def route(self, method: str, pattern: str, handler: Callable) -> None:
+        """`handler(query, body, *groups)` returns the json payload, or a (payload, headers) tuple"""
+        self._routes.append((method, re.compile(pattern + "$"), handler))
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d" % self._server.server_port
+
+    def start(self) -> "FakeServer":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"null") if length else None
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                url = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                for method, pattern, handler in fake._routes:
+                    match = pattern.match(url.path)
+                    if method == self.command and match:
+                        result = handler(query, body, *match.groups())
+                        payload, headers = result if isinstance(result, tuple) else (result, {})
+                        return self._send(200 if method == "GET" else 201, payload, headers)
+                return self._send(404, {"errorMessages": ["no route for %s %s" % (self.command, url.path)]})
+
+            def _send(self, status: int, payload, headers: Dict[str, str]):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, name="fake-server", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class FakeJira(FakeServer):
+    """Jira REST api v2 with `tickets` tickets ABC-0..ABC-n, each with a short changelog"""
+
+    STATUSES = ("Open", "In Progress", "Done")
+
+    def __init__(self, tickets: int = 1000, latency: float = 0.0):
+        super().__init__(latency)
+        self.tickets: int = tickets
+        api = "/rest/api/2"
+        self.route("GET", api + "/serverInfo", lambda q, b: {"baseUrl": self.url, "version": "8.0.0",
+                                                             "versionNumbers": [8, 0, 0], "deploymentType": "Server"})
+        self.route("GET", api + "/field", lambda q, b: [{"id": "summary", "name": "Summary", "custom": False},
+                                                        {"id": "customfield_10001", "name": "Epic Link",
+                                                         "custom": True}])
+        self.route("GET", api + "/issuetype", lambda q, b: [{"id": str(i), "name": name, "self": self.url}
+                                                            for i, name in enumerate(("Bug", "Task", "Story"))])
+        self.route("GET", api + "/priority", lambda q, b: [{"id": str(i), "name": name, "self": self.url}
+                                                           for i, name in enumerate(("High", "Medium", "Low"))])
+        self.route("GET", api + "/project", lambda q, b: [{"id": "1", "key": "ABC", "name": "Alpha",
+                                                           "self": self.url}])
+        self.route("GET", api + "/status", lambda q, b: [{"id": str(i), "name": name, "self": self.url}
+                                                         for i, name in enumerate(self.STATUSES)])
+        self.route("GET", api + r"/project/\w+/(?:components|versions)", lambda q, b: [])
+        self.route("GET", api + "/search", lambda q, b: self._search(q))
+        self.route("POST", api + "/search", lambda q, b: self._search(b))
+        self.route("GET", api + r"/issue/([A-Z]+-\d+)", lambda q, b, key: self.issue(key, "changelog" in
+                                                                                     q.get("expand", "")))
+        self.route("GET", api + r"/issue/[A-Z]+-\d+/comment", lambda q, b: {"comments": []})
+        self.route("POST", api + r"/issue/[A-Z]+-\d+/comment", lambda q, b: {"id": "1", "body": b["body"]})
+        self.route("POST", api + "/issue", lambda q, b: {"id": "1", "key": "ABC-%d" % self.tickets,
+                                                         "self": self.url})
+
+    def issue(self, key: str, changelog: bool = False) -> dict:
+        number = int(key.split("-")[1])
+        issue = {"id": str(10000 + number), "key": key, "self": "%s/rest/api/2/issue/%s" % (self.url, key),
+                 "fields": {"summary": "ticket %d" % number,
+                            "created": "2021-01-01T10:00:00.000+0000",
+                            "status": {"name": self.STATUSES[number % len(self.STATUSES)]},
+                            "assignee": {"key": "user%d" % (number % 7), "name": "user%d" % (number % 7)}}}
+        if changelog:
+            issue["changelog"] = {"histories": [
+                {"id": "1", "created": "2021-01-02T10:00:00.000+0000", "author": {"key": "user1"},
+                 "items": [{"field": "status", "fromString": "Open", "toString": "In Progress"}]}]}
+        return issue
+
+    def _search(self, query: dict) -> dict:
+        start = int(query.get("startAt", 0))
+        size = int(query.get("maxResults", 50))
+        expand = str(query.get("expand") or "")
+        issues = [self.issue("ABC-%d" % number, "changelog" in expand)
+                  for number in range(start, min(self.tickets, start + size))]
+        return {"startAt": start, "maxResults": size, "total": self.tickets, "issues": issues}
+
+
+class FakeGitLab(FakeServer):
+    """GitLab api v4 with `users` users and `projects` projects"""
+
+    def __init__(self, users: int = 500, projects: int = 200, latency: float = 0.0):
+        super().__init__(latency)
+        self.users: List[dict] = [{"id": idx, "name": "User %d" % idx, "username": "user%d" % idx,
+                                   "state": "active", "web_url": "http://gitlab/user%d" % idx}
+                                  for idx in range(users)]
+        self.projects: List[dict] = [{"id": idx, "name": "project%d" % idx,
+                                      "path_with_namespace": "group/project%d" % idx,
+                                      "default_branch": "master", "web_url": "http://gitlab/group/project%d" % idx}
+                                     for idx in range(projects)]
+        self.route("GET", "/api/v4/users", lambda q, b: self._page(self._filter(self.users, q), q))
+        self.route("GET", "/api/v4/projects", lambda q, b: self._page(self._filter(self.projects, q), q))
+        self.route("GET", r"/api/v4/projects/([^/]+)", lambda q, b, id_: self._project(id_))
+        self.route("GET", r"/api/v4/projects/[^/]+/merge_requests", lambda q, b: [])
+
+    @staticmethod
+    def _filter(items: List[dict], query: dict) -> List[dict]:
+        if "username" in query:
+            return [item for item in items if item["username"] == query["username"]]
+        if "search" in query:
+            return [item for item in items if query["search"].lower() in item["name"].lower()]
+        return items
+
+    @staticmethod
+    def _page(items: List[dict], query: dict):
+        page, size = int(query.get("page", 1)), int(query.get("per_page", 20))
+        return items[(page - 1) * size:page * size], {"X-Total": str(len(items)), "X-Page": str(page)}
+
+    def _project(self, project_id: str) -> dict:
+        project_id = project_id.replace("%2F", "/")
+        for project in self.projects:
+            if str(project["id"]) == project_id or project["path_with_namespace"] == project_id:
+                return project
+        return {}
+
+
+class ReplaySlackClient(object):
+    """
+    slackbot's SlackClient as seen by the Dispatcher, replaying recorded RTM events instead of connecting.
+
+    Events are released `rate` per second (all at once when 0) on every `start()`. Commands to the bot are timed until
+    the first reply to their channel, so replies to one channel are attributed in order. Replies to a channel of
+    `expected` must match its pattern (busy replies aside), the others are counted as wrong.
+    """
+
+    def __init__(self, events: List[dict], rate: float = 0, bot_id: str = "UBOT", bot_name: str = "jirabuddy",
+                 expected: Optional[Dict[str, Pattern]] = None):
+        self.events: List[dict] = events
+        self.rate: float = rate
+        self.expected: Dict[str, Pattern] = expected or {}
+        self.login_data: dict = {"self": {"id": bot_id, "name": bot_name}, "team": {"domain": "replay"}}
+        self.users: Dict[str, dict] = {bot_id: {"id": bot_id, "name": bot_name}}
+        self.channels: Dict[str, dict] = {}
+        self.token: str = "xoxb-replay"
+        self.connected: bool = True
+        for event in events:
+            user, channel = event.get("user"), event.get("channel")
+            if isinstance(user, str) and user not in self.users:
+                self.users[user] = {"id": user, "name": user.lower()}
+            if isinstance(channel, str) and channel not in self.channels:
+                self.channels[channel] = {"id": channel, "name": channel.lower()}
+        self.channels.setdefault("CERRORS", {"id": "CERRORS", "name": "errors"})
+
+        self.released: int = 0
+        # counted rather than kept, so they don't show up as the bot's memory growth
+        self.replies: int = 0
+        self.busy_replies: int = 0
+        self.wrong_replies: int = 0
+        # the first few, to show what went wrong
+        self.wrong_samples: List[Tuple[str, str]] = []
+        self.latencies: List[float] = []
+        self.first_release: Optional[float] = None
+        self.last_reply: Optional[float] = None
+        self._ready: Deque[dict] = deque()
+        self._pending: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+        # the dispatcher selects on websocket.sock to wait for events
+        self.websocket = type("ReplayWebSocket", (object,), {"sock": self._reader})()
+
+    def is_command(self, event: dict) -> bool:
+        text = event.get("text") or ""
+        channel = event.get("channel") or ""
+        bot_id = self.login_data["self"]["id"]
+        return (event.get("type") == "message" and event.get("user") != bot_id and not event.get("subtype") and
+                (channel.startswith("D") or text.startswith("<@%s>" % bot_id)))
+
+    @property
+    def commands(self) -> int:
+        return sum(1 for event in self.events if self.is_command(event))
+
+    def start(self) -> None:
+        """Replay the events (again), resetting the measurements"""
+        with self._lock:
+            self.released = 0
+            self.replies = self.busy_replies = self.wrong_replies = 0
+            self.wrong_samples = []
+            self.latencies = []
+            self.first_release = self.last_reply = None
+            self._done.clear()
+        threading.Thread(target=self._feed, name="rtm-replay", daemon=True).start()
+
+    def _feed(self) -> None:
+        start = time.perf_counter()
+        for idx, event in enumerate(self.events):
+            if self.rate:
+                delay = start + idx / self.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            with self._lock:
+                self._ready.append(event)
+            try:
+                self._writer.send(b"\0")
+            except OSError:
+                pass
+        self._done.set()
+
+    @property
+    def finished_replay(self) -> bool:
+        return self._done.is_set() and not self._ready
+
+    @property
+    def unanswered(self) -> int:
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def rtm_read(self) -> List[dict]:
+        try:
+            while self._reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        now = time.perf_counter()
+        with self._lock:
+            events, self._ready = list(self._ready), deque()
+            if events and self.first_release is None:
+                self.first_release = now
+            for event in events:
+                if self.is_command(event):
+                    self._pending.setdefault(event["channel"], deque()).append(now)
+            self.released += len(events)
+        # the dispatcher rewrites the text of commands, replay copies
+        return [dict(event) for event in events]
+
+    def _record_reply(self, channel: str, text: str) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self.replies += 1
+            busy = BUSY_REPLY in text
+            self.busy_replies += busy
+            pattern = self.expected.get(channel)
+            if pattern is not None and not busy and not pattern.fullmatch(text):
+                self.wrong_replies += 1
+                if len(self.wrong_samples) < WRONG_SAMPLES:
+                    self.wrong_samples.append((channel, text))
+            pending = self._pending.get(channel)
+            if pending:
+                self.latencies.append(now - pending.popleft())
+                self.last_reply = now
+
+    def rtm_send_message(self, channel, message, attachments=None, thread_ts=None) -> None:
+        self._record_reply(channel, message)
+
+    def send_message(self, channel, message, attachments=None, as_user=True, thread_ts=None) -> None:
+        self._record_reply(channel, message)
+
+    def find_channel_by_name(self, channel_name: str) -> Optional[str]:
+        for channel_id, channel in self.channels.items():
+            if channel.get("name") == channel_name:
+                return channel_id
+        return "CERRORS"
+
+    def parse_channel_data(self, channel_data) -> None:
+        self.channels.update({channel["id"]: channel for channel in channel_data if isinstance(channel, dict)})
+
+    def parse_user_data(self, user_data) -> None:
+        self.users.update({user["id"]: user for user in user_data})
+
+    def rtm_connect(self) -> None:
+        pass
+
+    def reconnect(self) -> None:
+        pass
+
+    def ping(self) -> None:
+        pass
@@ -0,0 +1,47 @@
+"""
+Plugins the replay benchmark runs: Jira and GitLab lookups, free text parsing and routing through many plugins.
+"""
+from itertools import islice
+
+from jirabuddy.bot import listen_to, respond_to, RegexPlugin
+from jirabuddy.bot.plugins_manager import PluginsManager
+
+
+@respond_to(r"^ticket (\w+-\d+)$")
+def show_ticket(_, msg, key, jira):
+    ticket = jira.get_ticket(key)
+    msg.reply("%s: %s (%s)" % (ticket.key, ticket.fields.summary, ticket.fields.status.name))
+
+
+@respond_to(r"^tickets (\d+)$")
+def list_tickets(_, msg, count, jira):
+    tickets = islice(jira.search_tickets("project = ABC", maxResults=int(count)), int(count))
+    msg.reply(", ".join(ticket.key for ticket in tickets))
+
+
+@respond_to(r"^who is (\w+)$")
+def who_is(_, msg, username, gitlab):
+    user = gitlab.usernames.get(username)
+    msg.reply("%s is %s" % (username, user.name) if user else "I don't know %s" % username)
+
+
+@respond_to(r"^parse (.+)$")
+def parse(_, msg, text, text_parser):
+    found, rest = text_parser.parse(text)
+    msg.reply("found %s, left %s" % (sorted(found), rest))
+
+
+@listen_to(r".*\b([A-Z]+-\d+)\b.*")
+def count_mentions(plugin, _, key):
+    plugin.state.increment(key)
+
+
+def _never(_, msg):
+    pass
+
+
+def register_filler_plugins(count: int) -> None:
+    """`count` more respond_to plugins the replayed commands don't match, for the router to skip"""
+    for idx in range(count):
+        PluginsManager.register_plugin(RegexPlugin(_never, r"^filler%d (\w+) (\d+)$" % idx, name="filler%d" % idx,
+                                                   plugin_type="respond_to"))
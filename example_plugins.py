@@ -38,6 +38,8 @@ def remember(plugin: RegexPlugin, msg, what_to_remember):
     stored_dict["what_to_remember"] = what_to_remember
     stored_dict["when"] = datetime.utcnow()
     plugin.store(stored_dict)  # update plugin cache with dict values
+    # plugin.state is the live handle, no copy is made: changed keys are persisted after every invocation
+    plugin.state.increment("times")  # counters, state.bounded(key, max_size, ttl) gives an LRU collection
 
 
 @every(timedelta(minutes=10))
@@ -0,0 +1,649 @@
+"""
+Asyncio runtime: the Slack socket and web api go through aiohttp, `async def` handlers run as tasks on the event
+loop and sync ones on a thread executor, so waiting handlers don't hold a thread each.
+
+Requires aiohttp (`pip install aiohttp`), only imported when this runtime is used (bot.runtime: asyncio). Requests
+made by concurrent `async def` handlers are told apart in the metrics with contextvars (python 3.7+), on older
+pythons they're attributed per thread, as with the threads runtime.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
+
+from slackbot.slackclient import Channel
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+try:
+    import contextvars
+except ImportError:  # pragma: no cover, python 3.6
+    contextvars = None
+
+from .bot import ERRORS_CHANNEL
+from .dispatcher import Dispatcher, MAX_IDLE_SECONDS
+from .errors import Shutdown
+from .message import MessageWrapper
+from .metrics import Metrics, NO_PLUGIN
+from .outbox import Outbox
+from .plugins import Plugin
+from .plugins_manager import PluginsManager
+from .profiler import SlowInvocationProfiler
+from ..common.iterables import IterUntil
+
+logger = logging.getLogger(__name__)
+
+SLACK_API = "https://slack.com/api/"
+TIMEOUT = 100
+# websocket pings, replacing SlackBot's keep alive thread
+HEARTBEAT_SECONDS = 30
+RECONNECT_DELAY = 5
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError('the asyncio runtime requires aiohttp, install it or set bot.runtime to "threads"')
+
+
+class SlackApiError(Exception):
+    """A web api call answered with ok=false, `retry_after` is set on rate limits (see outbox.retry_after)"""
+
+    def __init__(self, method: str, error: str, retry_after: Optional[float] = None):
+        super().__init__(error)
+        self.method: str = method
+        self.error: str = error
+        self.retry_after: Optional[float] = retry_after
+
+
+class AsyncSlackClient(object):
+    """
+    RTM and web api client on aiohttp, with slackbot's SlackClient attributes (login_data, users, channels...).
+
+    Coroutines are used on the event loop, the sync methods slackbot's Message calls (`rtm_send_message`,
+    `send_message`, `open_dm_channel`, `react_to_message`) are for other threads: they run the call on the loop
+    and wait for it.
+    """
+
+    def __init__(self, token: str, timeout: float = TIMEOUT, connections: int = 100):
+        _require_aiohttp()
+        self.token: str = token
+        self.timeout: float = timeout
+        self.connections: int = connections
+        self.login_data: Optional[dict] = None
+        self.username: Optional[str] = None
+        self.domain: Optional[str] = None
+        self.users: Dict[str, dict] = {}
+        self.channels: Dict[str, dict] = {}
+        self.connected: bool = False
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._ws: Optional["aiohttp.ClientWebSocketResponse"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._message_ids = itertools.count(1)
+
+    async def api_call(self, method: str, **params) -> dict:
+        params = {name: value for name, value in params.items() if value is not None}
+        headers = {"Authorization": "Bearer %s" % self.token}
+        async with self._session.post(SLACK_API + method, data=params, headers=headers) as response:
+            if response.status == 429:
+                raise SlackApiError(method, "ratelimited", float(response.headers.get("Retry-After", 1)))
+            response.raise_for_status()
+            body = await response.json()
+        if not body.get("ok"):
+            raise SlackApiError(method, body.get("error", "unknown_error"))
+        return body
+
+    async def rtm_connect(self) -> None:
+        if self._session is None:
+            self._loop = asyncio.get_event_loop()
+            self._loop_thread = threading.get_ident()
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                  connector=aiohttp.TCPConnector(limit=self.connections))
+        login_data = await self.api_call("rtm.start")
+        self.parse_slack_login_data(login_data)
+        self._ws = await self._session.ws_connect(login_data["url"], heartbeat=HEARTBEAT_SECONDS)
+        self.connected = True
+        logger.info("connected to slack RTM api")
+
+    def parse_slack_login_data(self, login_data: dict) -> None:
+        self.login_data = login_data
+        self.domain = login_data["team"]["domain"]
+        self.username = login_data["self"]["name"]
+        self.parse_user_data(login_data["users"])
+        self.parse_channel_data(login_data["channels"])
+        self.parse_channel_data(login_data["groups"])
+        self.parse_channel_data(login_data["ims"])
+
+    def parse_user_data(self, user_data) -> None:
+        self.users.update({user["id"]: user for user in user_data})
+
+    def parse_channel_data(self, channel_data) -> None:
+        self.channels.update({channel["id"]: channel for channel in channel_data})
+
+    def find_channel_by_name(self, channel_name: str) -> Optional[str]:
+        for channel_id, channel in self.channels.items():
+            name = channel.get("name") or self.users.get(channel.get("user"), {}).get("name")
+            if name == channel_name:
+                return channel_id
+        return None
+
+    def find_user_by_name(self, username: str) -> Optional[str]:
+        for user_id, user in self.users.items():
+            if user["name"] == username:
+                return user_id
+        return None
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        return self.users.get(user_id)
+
+    def get_channel(self, channel_id: str) -> Channel:
+        return Channel(self, self.channels[channel_id])
+
+    async def events(self) -> AsyncIterator[dict]:
+        """RTM events, reconnecting whenever the socket closes"""
+        while True:
+            if self._ws is None or self._ws.closed:
+                await self._reconnect()
+            async for message in self._ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    yield message.json()
+                elif message.type == aiohttp.WSMsgType.ERROR:
+                    logger.warning("slack websocket error: %s", self._ws.exception())
+                    break
+            self.connected = False
+            logger.warning("lost the slack websocket, reconnecting")
+
+    async def _reconnect(self) -> None:
+        while True:
+            try:
+                await self.rtm_connect()
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError, SlackApiError) as ex:
+                logger.warning("failed to connect to slack (%s), retrying in %ds", ex, RECONNECT_DELAY)
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def send_to_websocket(self, data: dict) -> None:
+        data.setdefault("id", next(self._message_ids))
+        await self._ws.send_str(json.dumps(data))
+
+    async def post_message(self, channel: str, message: str, attachments=None, as_user=True,
+                           thread_ts=None) -> dict:
+        return await self.api_call("chat.postMessage", channel=channel, text=message, as_user=str(as_user).lower(),
+                                   attachments=json.dumps(attachments) if attachments else None,
+                                   thread_ts=thread_ts)
+
+    async def open_dm(self, user_id: str) -> str:
+        body = await self.api_call("im.open", user=user_id)
+        return body["channel"]["id"]
+
+    async def add_reaction(self, emojiname: str, channel: str, timestamp: str) -> None:
+        await self.api_call("reactions.add", name=emojiname, channel=channel, timestamp=timestamp)
+
+    def _wait(self, coroutine) -> Any:
+        if threading.get_ident() == self._loop_thread:
+            coroutine.close()
+            raise RuntimeError("blocking slack call on the event loop, await the client's coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(self.timeout)
+
+    def open_dm_channel(self, user_id: str) -> str:
+        return self._wait(self.open_dm(user_id))
+
+    def react_to_message(self, emojiname: str, channel: str, timestamp: str) -> None:
+        self._wait(self.add_reaction(emojiname, channel, timestamp))
+
+    def rtm_send_message(self, channel: str, message: str, attachments=None, thread_ts=None) -> None:
+        data = {"type": "message", "channel": channel, "text": message}
+        if attachments:
+            data["attachments"] = attachments
+        if thread_ts:
+            data["thread_ts"] = thread_ts
+        self._wait(self.send_to_websocket(data))
+
+    def send_message(self, channel: str, message: str, attachments=None, as_user=True, thread_ts=None) -> None:
+        self._wait(self.post_message(channel, message, attachments=attachments, as_user=as_user,
+                                     thread_ts=thread_ts))
+
+    async def close(self) -> None:
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+        self.connected = False
+
+
+class AsyncMessageWrapper(MessageWrapper):
+    """
+    Message given to `async def` handlers, which run on the loop's thread: the calls MessageWrapper makes in the
+    caller's thread are scheduled here and return a future, awaited by handlers needing the outcome. Failures of
+    the futures nobody awaits are logged.
+    """
+
+    def __init__(self, slack_client: AsyncSlackClient, body: dict, outbox: Outbox,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        super(AsyncMessageWrapper, self).__init__(slack_client, body, outbox=outbox)
+        self._executor: Optional[ThreadPoolExecutor] = executor
+
+    @staticmethod
+    def _schedule(future) -> asyncio.Future:
+        future = asyncio.ensure_future(future)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def reply(self, text: str, attachment_path: str = None, attachment_name: str = None,
+              compress: bool = False) -> Optional[asyncio.Future]:
+        """Replies with an attachment are uploaded on the executor, the returned future ends with the upload"""
+        if not attachment_path:
+            return super(AsyncMessageWrapper, self).reply(text)
+        upload = functools.partial(super(AsyncMessageWrapper, self).reply, text, attachment_path=attachment_path,
+                                   attachment_name=attachment_name, compress=compress)
+        return self._schedule(asyncio.get_event_loop().run_in_executor(self._executor, upload))
+
+    def direct_reply(self, text: str) -> asyncio.Future:
+        return self._schedule(self._direct_reply(text))
+
+    async def _direct_reply(self, text: str) -> None:
+        channel = await self._client.open_dm(self._get_user_id())
+        self._outbox.post(channel, text, self._client.rtm_send_message)
+
+    def react(self, emojiname: str) -> asyncio.Future:
+        return self._schedule(self._client.add_reaction(emojiname, self._body['channel'], self._body['ts']))
+
+
+def _log_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("failed to reply to a message", exc_info=future.exception())
+
+
+class ContextMetrics(Metrics):
+    """Metrics attributing requests to the plugin of the running task, which may share its thread with others"""
+
+    def __init__(self, *args, **kwargs):
+        super(ContextMetrics, self).__init__(*args, **kwargs)
+        self._plugin = contextvars.ContextVar("metrics_plugin", default=NO_PLUGIN)
+
+    @property
+    def current_plugin(self) -> str:
+        return self._plugin.get()
+
+    def _enter_plugin(self, name: str):
+        return self._plugin.set(name)
+
+    def _exit_plugin(self, previous) -> None:
+        self._plugin.reset(previous)
+
+
+# items read per executor call from an iterator without pages (a generator...)
+ITER_CHUNK = 50
+
+
+class AsyncPages(object):
+    """
+    Async iterator over a lazy result of an ExecutorProxy call (an iterator, IterUntil pages): items are read on the
+    executor a page (or ITER_CHUNK items) at a time, when the handler gets to them. Stopping early doesn't fetch the
+    remaining pages, `to_list(limit)` reads at most `limit` items.
+    """
+
+    def __init__(self, proxy: "ExecutorProxy", iterator: Iterator, chunk: int):
+        self._proxy = proxy
+        self._iterator = iterator
+        self._chunk = chunk
+        self._buffer: List[Any] = []
+        self._done = False
+
+    def __aiter__(self) -> "AsyncPages":
+        return self
+
+    async def __anext__(self) -> Any:
+        if not self._buffer and not self._done:
+            self._buffer = await self._proxy.in_executor(_read, self._iterator, self._chunk)
+            self._buffer.reverse()
+            self._done = len(self._buffer) < self._chunk
+        if not self._buffer:
+            raise StopAsyncIteration
+        return self._buffer.pop()
+
+    async def to_list(self, limit: Optional[int] = None) -> List[Any]:
+        items = []
+        async for item in self:
+            items.append(item)
+            if limit is not None and len(items) >= limit:
+                break
+        return items
+
+
+def _read(iterator: Iterator, count: int) -> List[Any]:
+    return list(itertools.islice(iterator, count))
+
+
+class ExecutorProxy(object):
+    """
+    Awaitable view of a blocking client (JiraClient, GitLabClient...) for `async def` handlers.
+
+    Calling a method returns an awaitable running it on `executor`, attributes are read as is. Lazy results
+    (iterators, IterUntil pages) come back as AsyncPages, to go through with `async for`: their pages are fetched on
+    the executor too, as they're reached, so that paged requests neither run on the loop nor read further than the
+    handler does. Blocking work on other objects (e.g. a returned ticket) goes through `in_executor`.
+    """
+
+    def __init__(self, target, executor: Optional[ThreadPoolExecutor] = None):
+        self._target = target
+        self._executor: Optional[ThreadPoolExecutor] = executor
+
+    async def in_executor(self, func: Callable, *args, **kwargs) -> Any:
+        call = functools.partial(func, *args, **kwargs)
+        if contextvars is not None:
+            # the context carries the plugin the requests are attributed to (see ContextMetrics)
+            call = functools.partial(contextvars.copy_context().run, call)
+        return await asyncio.get_event_loop().run_in_executor(self._executor, call)
+
+    async def _call(self, func: Callable, *args, **kwargs) -> Any:
+        result = await self.in_executor(func, *args, **kwargs)
+        if isinstance(result, IterUntil):
+            return AsyncPages(self, iter(result), result.page_size or ITER_CHUNK)
+        if isinstance(result, Iterator):
+            return AsyncPages(self, result, ITER_CHUNK)
+        return result
+
+    def __getattr__(self, name: str):
+        value = getattr(self._target, name)
+        if not callable(value) or isinstance(value, type):
+            return value
+
+        @functools.wraps(value)
+        async def call(*args, **kwargs):
+            return await self._call(value, *args, **kwargs)
+
+        return call
+
+    def __repr__(self):
+        return "ExecutorProxy(%r)" % (self._target,)
+
+
+class TaskPool(object):
+    """
+    WorkerPool counterpart for the asyncio runtime, called on the event loop.
+
+    `async def` handlers run as tasks, sync ones on `executor`. At most `max_tasks` invocations are in flight, and
+    every plugin has a cap on its own, `submit` returns False beyond them.
+    """
+
+    def __init__(self,
+                 dispatch: Callable[[Any], None],
+                 executor: ThreadPoolExecutor,
+                 max_tasks: int = 1000,
+                 plugin_concurrency: int = 0,
+                 metrics: Optional[Metrics] = None):
+        self.max_tasks: int = max_tasks
+        self.plugin_concurrency: int = plugin_concurrency
+        self.metrics: Metrics = metrics or Metrics()
+        self._dispatch = dispatch
+        self._executor: ThreadPoolExecutor = executor
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._tasks: Set[asyncio.Future] = set()
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    def add_task(self, msg) -> None:
+        self._dispatch(msg)
+
+    def submit(self, plugin: Plugin, func: Callable, *args, **kwargs) -> bool:
+        """`func` is a coroutine function for `async def` plugins, a blocking function otherwise"""
+        limit = plugin.max_concurrency or self.plugin_concurrency
+        if limit and self._in_flight[plugin.id] >= limit:
+            logger.warning('plugin "%s" reached its concurrency limit (%d)', plugin.name, limit)
+            self.metrics.increment("plugin_rejected_total", (plugin.name,))
+            return False
+        if len(self._tasks) >= self.max_tasks:
+            logger.warning('%d handlers are running, rejecting plugin "%s"', len(self._tasks), plugin.name)
+            self.metrics.increment("plugin_rejected_total", (plugin.name,))
+            return False
+
+        loop = asyncio.get_event_loop()
+        queued = time.perf_counter()
+        if plugin.is_async:
+            future = loop.create_task(self._run_async(plugin, queued, func, args, kwargs))
+        else:
+            future = loop.run_in_executor(self._executor, self._run, plugin, queued, func, args, kwargs)
+        self._in_flight[plugin.id] += 1
+        self._tasks.add(future)
+        future.add_done_callback(functools.partial(self._done, plugin))
+        return True
+
+    def _done(self, plugin: Plugin, future: asyncio.Future) -> None:
+        self._tasks.discard(future)
+        self._in_flight[plugin.id] -= 1
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('unhandled error in plugin "%s"', plugin.name, exc_info=future.exception())
+
+    async def _run_async(self, plugin: Plugin, queued: float, func: Callable, args, kwargs) -> None:
+        self.metrics.observe("plugin_queue_wait_seconds", (plugin.name,), time.perf_counter() - queued)
+        await func(*args, **kwargs)
+
+    def _run(self, plugin: Plugin, queued: float, func: Callable, args, kwargs) -> None:
+        self.metrics.observe("plugin_queue_wait_seconds", (plugin.name,), time.perf_counter() - queued)
+        func(*args, **kwargs)
+
+
+class AsyncDispatcher(Dispatcher):
+    """
+    Dispatcher running on an event loop: events are read from an AsyncSlackClient and handlers are run by a
+    TaskPool. `async def` handlers get an ExecutorProxy for keywords registered as blocking, sync ones get the
+    values themselves and run on `workers` threads, as with the threads runtime.
+
+    Replies still go through the Outbox thread. The `slow` command profiles sync handlers only, the sampler can't
+    tell apart coroutines sharing the loop's thread.
+    """
+
+    metrics_class = ContextMetrics if contextvars is not None else Metrics
+
+    def __init__(self,
+                 slack_client: AsyncSlackClient,
+                 plugins: PluginsManager,
+                 errors_channel: str,
+                 debug: bool = False,
+                 workers: int = 10,
+                 max_tasks: int = 1000,
+                 plugin_concurrency: int = 0,
+                 help_page_size: int = 0,
+                 outbox: Outbox = None,
+                 metrics_port: int = 0,
+                 profiler: SlowInvocationProfiler = None):
+        super(AsyncDispatcher, self).__init__(slack_client, plugins, errors_channel, debug=debug, workers=0,
+                                              help_page_size=help_page_size, outbox=outbox,
+                                              metrics_port=metrics_port, profiler=profiler)
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max(1, workers),
+                                                               thread_name_prefix="plugin-worker")
+        self._pool: TaskPool = TaskPool(self.dispatch_msg,
+                                        self.executor,
+                                        max_tasks=max_tasks,
+                                        plugin_concurrency=plugin_concurrency,
+                                        metrics=self.metrics)
+        self._proxies: Dict[str, ExecutorProxy] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+
+    def register(self, keyword: str, value, blocking: bool = False):
+        super(AsyncDispatcher, self).register(keyword, value)
+        if blocking:
+            self._proxies[keyword] = ExecutorProxy(value, self.executor)
+        else:
+            self._proxies.pop(keyword, None)
+
+    def _async_keywords(self, keywords: dict) -> dict:
+        return {name: self._proxies.get(name, value) for name, value in keywords.items()}
+
+    def _profile(self, plugin: Plugin, text: str, args, keywords: dict):
+        if plugin.is_async:
+            return suppress()
+        return super(AsyncDispatcher, self)._profile(plugin, text, args, keywords)
+
+    def _run_plugin(self, plugin: Plugin, msg, text: str, args, keywords: dict):
+        if plugin.is_async:
+            return self._run_async_plugin(plugin, msg, text, args, keywords)
+        return super(AsyncDispatcher, self)._run_plugin(plugin, msg, text, args, keywords)
+
+    def _run_periodic_plugin(self, plugin: Plugin, args, keywords: dict):
+        if plugin.is_async:
+            return self._run_async_periodic_plugin(plugin, args, keywords)
+        return super(AsyncDispatcher, self)._run_periodic_plugin(plugin, args, keywords)
+
+    async def _run_async_plugin(self, plugin: Plugin, msg, text: str, args, keywords: dict) -> None:
+        try:
+            with self.metrics.invocation(plugin):
+                message = AsyncMessageWrapper(self._client, msg, outbox=self.outbox, executor=self.executor)
+                await plugin.run_async(plugin, message, *args, **self._async_keywords(keywords))
+        except Shutdown:
+            self.shutdown = True
+            self._wakeup()
+        except Exception as ex:
+            self._plugin_failed(plugin, ex, msg['channel'], text)
+
+    async def _run_async_periodic_plugin(self, plugin: Plugin, args, keywords: dict) -> None:
+        try:
+            with self.metrics.invocation(plugin):
+                await plugin.run_async(plugin, *args, **self._async_keywords(keywords))
+        except Exception as ex:
+            self._plugin_failed(plugin, ex, self._errors_to)
+
+    def _wakeup(self) -> None:
+        # called from the loop or from executor threads
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _read_events(self) -> None:
+        async for event in self._client.events():
+            self._handle_event(event)
+
+    async def _run_periodic(self) -> None:
+        while True:
+            self._handle_periodical_plugins()
+            timeout = self._plugins_manager.seconds_to_next_periodic(time.time())
+            await asyncio.sleep(MAX_IDLE_SECONDS if timeout is None else min(timeout, MAX_IDLE_SECONDS))
+
+    async def serve(self, drain_timeout: float = 30) -> None:
+        """Handle events until a plugin raises Shutdown, then wait up to `drain_timeout` for running handlers"""
+        self._loop = asyncio.get_event_loop()
+        self._stopped = asyncio.Event()
+        self.start()
+        readers = [self._loop.create_task(self._read_events()), self._loop.create_task(self._run_periodic())]
+        try:
+            await self._stopped.wait()
+        finally:
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+            await self._pool.drain(drain_timeout)
+            # the outbox flushes its messages through the loop, so it is stopped off it
+            await self._loop.run_in_executor(None, self._teardown)
+            self.executor.shutdown(wait=False)
+
+    def loop(self):
+        raise RuntimeError("AsyncDispatcher runs on an event loop, await serve() instead")
+
+
+class AsyncSlackBot(object):
+    """
+    SlackBot on the asyncio runtime, taking the same arguments. `workers` threads run the sync handlers and the
+    blocking clients' calls of `async def` handlers, `queue_size` bounds the handlers in flight.
+    """
+
+    def __init__(self,
+                 token: str,
+                 debug: bool = False,
+                 plugins_cache_path: str = None,
+                 state_flush_interval: float = 0,
+                 workers: int = 10,
+                 queue_size: int = 1000,
+                 plugin_concurrency: int = 0,
+                 help_page_size: int = 0,
+                 outbox_rate: float = 1.0,
+                 outbox_burst: int = 3,
+                 outbox_coalesce_window: float = 0,
+                 errors_dedupe_window: float = 300,
+                 metrics_port: int = 0,
+                 profile_threshold: float = 0,
+                 profile_mode: str = "sampling",
+                 profile_keep: int = 20,
+                 profile_path: str = None):
+        self._client = AsyncSlackClient(token, timeout=TIMEOUT)
+        self._plugins = PluginsManager(plugins_cache_path=plugins_cache_path,
+                                       state_flush_interval=state_flush_interval)
+        profiler = None
+        if profile_threshold:
+            profiler = SlowInvocationProfiler(threshold=profile_threshold, keep=profile_keep, mode=profile_mode,
+                                              path=profile_path)
+        # the dispatcher looks its errors channel up, so it's created once connected
+        self._dispatcher_args = dict(plugins=self._plugins,
+                                     errors_channel=ERRORS_CHANNEL,
+                                     debug=debug,
+                                     workers=workers,
+                                     max_tasks=queue_size,
+                                     plugin_concurrency=plugin_concurrency,
+                                     help_page_size=help_page_size,
+                                     outbox=Outbox(rate=outbox_rate,
+                                                   burst=outbox_burst,
+                                                   coalesce_window=outbox_coalesce_window,
+                                                   dedupe_window=errors_dedupe_window),
+                                     metrics_port=metrics_port,
+                                     profiler=profiler)
+        self._dispatcher: Optional[AsyncDispatcher] = None
+        self._keywords: Dict[str, tuple] = {}
+        self.register("slack_users", self.find_user)
+        self.register("slack_message", self.send_message)
+
+    def send_message(self, channel: str, message: str, attachments=None, as_user=True, thread_ts=None) -> None:
+        """Queue a web api message, see Outbox"""
+        self._dispatcher_args["outbox"].post(channel, message, self._client.send_message,
+                                             attachments=attachments, as_user=as_user, thread_ts=thread_ts)
+
+    def find_user(self, user: str):
+        return self._dispatcher.directory.find_user(user)
+
+    def find_users(self, users: List[str]) -> Dict[str, dict]:
+        return self._dispatcher.directory.find_users(users)
+
+    def find_channel(self, channel: str):
+        return self._dispatcher.directory.find_channel(channel)
+
+    def register(self, keyword: str, value, blocking: bool = False):
+        """`blocking` values (making network calls) are given to `async def` handlers as an ExecutorProxy"""
+        self._keywords[keyword] = (value, blocking)
+        if self._dispatcher is not None:
+            self._dispatcher.register(keyword, value, blocking=blocking)
+
+    async def serve(self) -> None:
+        await self._client.rtm_connect()
+        self._dispatcher = AsyncDispatcher(self._client, **self._dispatcher_args)
+        for keyword, (value, blocking) in self._keywords.items():
+            self._dispatcher.register(keyword, value, blocking=blocking)
+        try:
+            await self._dispatcher.serve()
+        finally:
+            await self._client.close()
+
+    def run(self):
+        # asyncio.run is python 3.7+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.serve())
+        finally:
+            loop.close()
@@ -1,40 +1,87 @@
 import logging
-import re
 import time
+from typing import Dict, List
 
 from six.moves import _thread
+from slacker import Slacker
 from slackbot.slackclient import SlackClient
 
 from .dispatcher import Dispatcher
+from .outbox import Outbox
 from .plugins_manager import PluginsManager
+from .profiler import SlowInvocationProfiler
+from ..common import http
 
 logger = logging.getLogger(__name__)
 
 TIMEOUT = 100
+ERRORS_CHANNEL = "test-colo"
 
 
 class SlackBot(object):
-    def __init__(self, token: str, debug: bool = False, plugins_cache_path: str = None):
-        self._client = SlackClient(token, timeout=TIMEOUT)
-        self._plugins = PluginsManager(plugins_cache_path=plugins_cache_path)
-        self._dispatcher = Dispatcher(slack_client=self._client,
-                                      plugins=self._plugins,
-                                      errors_channel="test-colo",
-                                      debug=debug)
+    dispatcher_class = Dispatcher
+
+    def __init__(self,
+                 token: str,
+                 debug: bool = False,
+                 plugins_cache_path: str = None,
+                 state_flush_interval: float = 0,
+                 workers: int = 10,
+                 queue_size: int = 100,
+                 plugin_concurrency: int = 0,
+                 help_page_size: int = 0,
+                 outbox_rate: float = 1.0,
+                 outbox_burst: int = 3,
+                 outbox_coalesce_window: float = 0,
+                 errors_dedupe_window: float = 300,
+                 metrics_port: int = 0,
+                 profile_threshold: float = 0,
+                 profile_mode: str = "sampling",
+                 profile_keep: int = 20,
+                 profile_path: str = None):
+        # connect only once the web api is on the shared connection pool
+        self._client = SlackClient(token, timeout=TIMEOUT, connect=False)
+        self._client.webapi = Slacker(token, timeout=TIMEOUT, session=http.new_session("slack"))
+        self._client.rtm_connect()
+        self._plugins = PluginsManager(plugins_cache_path=plugins_cache_path,
+                                       state_flush_interval=state_flush_interval)
+        profiler = None
+        if profile_threshold:
+            profiler = SlowInvocationProfiler(threshold=profile_threshold, keep=profile_keep, mode=profile_mode,
+                                              path=profile_path)
+        self._dispatcher = self.dispatcher_class(slack_client=self._client,
+                                                 plugins=self._plugins,
+                                                 errors_channel=ERRORS_CHANNEL,
+                                                 debug=debug,
+                                                 workers=workers,
+                                                 queue_size=queue_size,
+                                                 plugin_concurrency=plugin_concurrency,
+                                                 help_page_size=help_page_size,
+                                                 outbox=Outbox(rate=outbox_rate,
+                                                               burst=outbox_burst,
+                                                               coalesce_window=outbox_coalesce_window,
+                                                               dedupe_window=errors_dedupe_window),
+                                                 metrics_port=metrics_port,
+                                                 profiler=profiler)
         self.register("slack_users", self.find_user)
-        self.register("slack_message", self._client.send_message)
+        self.register("slack_message", self.send_message)
+
+    def send_message(self, channel: str, message: str, attachments=None, as_user=True, thread_ts=None) -> None:
+        """Queue a web api message, see Outbox"""
+        self._dispatcher.outbox.post(channel, message, self._client.send_message,
+                                     attachments=attachments, as_user=as_user, thread_ts=thread_ts)
 
     def find_user(self, user: str):
-        by_id = self._client.get_user(re.sub("<@(.*?)>", "\\1", user))
-        if by_id:
-            return by_id
+        return self._dispatcher.directory.find_user(user)
+
+    def find_users(self, users: List[str]) -> Dict[str, dict]:
+        return self._dispatcher.directory.find_users(users)
 
-        by_name = self._client.find_user_by_name(user)
-        if by_name:
-            return self._client.get_user(by_name)
+    def find_channel(self, channel: str):
+        return self._dispatcher.directory.find_channel(channel)
 
-    def register(self, keyword: str, value):
-        self._dispatcher.register(keyword, value)
+    def register(self, keyword: str, value, blocking: bool = False):
+        self._dispatcher.register(keyword, value, blocking=blocking)
 
     def run(self):
         self._dispatcher.start()
@@ -0,0 +1,126 @@
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from slackbot.slackclient import SlackClient
+
+USER_MENTION = re.compile(r"^<@(\w+)(?:\|[^>]*)?>$")
+CHANNEL_MENTION = re.compile(r"^<#(\w+)(?:\|[^>]*)?>$")
+
+
+class _Index(object):
+    """id -> entity, plus exact and case folded alternative names -> id"""
+
+    def __init__(self):
+        self.entities: Dict[str, dict] = {}
+        self.exact: Dict[str, str] = {}
+        self.folded: Dict[str, str] = {}
+        self.names: Dict[str, List[str]] = {}
+
+    def update(self, entity_id: str, entity: dict, names: Iterable[str]) -> None:
+        self.remove(entity_id)
+        names = [name for name in dict.fromkeys(names) if name]
+        self.entities[entity_id] = entity
+        self.names[entity_id] = names
+        for name in names:
+            self.exact.setdefault(name, entity_id)
+            self.folded.setdefault(name.casefold(), entity_id)
+
+    def remove(self, entity_id: str) -> None:
+        for name in self.names.pop(entity_id, ()):
+            if self.exact.get(name) == entity_id:
+                del self.exact[name]
+            if self.folded.get(name.casefold()) == entity_id:
+                del self.folded[name.casefold()]
+        self.entities.pop(entity_id, None)
+
+    def find(self, key: str) -> Optional[str]:
+        if key in self.entities:
+            return key
+        return self.exact.get(key) or self.folded.get(key.casefold())
+
+
+class SlackDirectory(object):
+    """
+    Users and channels of the slackbot client, indexed by id, name, display name and real name (also case folded).
+
+    The index is rebuilt from the client after every (re)connection and kept up to date with `update_users`
+    and `update_channels` as RTM events arrive.
+    """
+
+    def __init__(self, client: SlackClient):
+        self._client = client
+        self._lock = threading.Lock()
+        self._login_data = None
+        self._users = _Index()
+        self._channels = _Index()
+
+    @staticmethod
+    def _user_names(user: dict) -> List[str]:
+        profile = user.get("profile") or {}
+        return [user.get("name"), profile.get("display_name"), profile.get("real_name"), user.get("real_name")]
+
+    def _channel_names(self, channel: dict) -> List[str]:
+        name = channel.get("name")
+        if not name and channel.get("user"):
+            # direct message channels are named after their user
+            user = self._client.users.get(channel["user"])
+            name = user and user.get("name")
+        return [name, name and "#" + name]
+
+    def _ensure_built(self) -> None:
+        if self._login_data is self._client.login_data:
+            return
+        users, channels = _Index(), _Index()
+        with self._lock:
+            for user_id, user in list(self._client.users.items()):
+                users.update(user_id, user, self._user_names(user))
+            for channel_id, channel in list(self._client.channels.items()):
+                channels.update(channel_id, channel, self._channel_names(channel))
+            self._users, self._channels = users, channels
+            self._login_data = self._client.login_data
+
+    def update_users(self, users: Iterable[dict]) -> None:
+        self._ensure_built()
+        with self._lock:
+            for user in users:
+                self._users.update(user["id"], user, self._user_names(user))
+
+    def update_channels(self, channels: Iterable[dict]) -> None:
+        self._ensure_built()
+        with self._lock:
+            for channel in channels:
+                self._channels.update(channel["id"], channel, self._channel_names(channel))
+
+    def find_user_id(self, user: str) -> Optional[str]:
+        self._ensure_built()
+        user = user.strip()
+        mention = USER_MENTION.match(user)
+        if mention:
+            user = mention.group(1)
+        return self._users.find(user) or (user.startswith("@") and self._users.find(user[1:])) or None
+
+    def find_user(self, user: str) -> Optional[dict]:
+        user_id = self.find_user_id(user)
+        return self._users.entities.get(user_id) if user_id else None
+
+    def find_users(self, users: Iterable[str]) -> Dict[str, dict]:
+        """{name: user} for the `users` names (or mentions) that are found"""
+        found = {}
+        for user in users:
+            entity = self.find_user(user)
+            if entity is not None:
+                found[user] = entity
+        return found
+
+    def find_channel_id(self, channel: str) -> Optional[str]:
+        self._ensure_built()
+        channel = channel.strip()
+        mention = CHANNEL_MENTION.match(channel)
+        if mention:
+            channel = mention.group(1)
+        return self._channels.find(channel)
+
+    def find_channel(self, channel: str) -> Optional[dict]:
+        channel_id = self.find_channel_id(channel)
+        return self._channels.entities.get(channel_id) if channel_id else None
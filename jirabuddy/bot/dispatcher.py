@@ -1,48 +1,96 @@
 import pickle
 import re
+import select
+import socket
 import time
 import traceback
-from typing import cast
+from contextlib import suppress
+from typing import Optional
 
 from slackbot import dispatcher
 from slackbot.dispatcher import MessageDispatcher, logger
 from slackbot.slackclient import SlackClient
 from slackbot.utils import to_utf8
 
+from .directory import SlackDirectory
 from .errors import Shutdown
+from .help import PluginsHelp
 from .message import MessageWrapper
-from .plugins import RegexPlugin
+from .metrics import Metrics, MetricsServer
+from .outbox import Outbox
+from .plugins import Plugin
 from .plugins_manager import PluginsManager
+from .profiler import SlowInvocationProfiler
+from .workers import WorkerPool
+from ..common import http
 
 dispatcher.AT_MESSAGE_MATCHER = re.compile(r'^\<@(\w+)\>:? (.*)$', re.S)
+HELP_MATCHER = re.compile(r'^help(?:\s+(\d+))?$', re.I)
+STATS_MATCHER = re.compile(r'^stats$', re.I)
+SLOW_MATCHER = re.compile(r'^slow(?:\s+(\d+))?$', re.I)
+
+CHANNEL_EVENTS = ('channel_created', 'channel_rename', 'group_joined', 'group_rename', 'im_created')
+USER_EVENTS = ('team_join', 'user_change')
+
+BUSY_REPLY = u"I'm a bit overloaded right now, please try again in a few seconds."
+# upper bound for blocking on the websocket when no periodic plugin is due
+MAX_IDLE_SECONDS = 60
 
 
 class Dispatcher(MessageDispatcher):
+    metrics_class = Metrics
+
     def __init__(self,
                  slack_client: SlackClient,
                  plugins: PluginsManager,
                  errors_channel: str,
-                 debug: bool = False):
+                 debug: bool = False,
+                 workers: int = 10,
+                 queue_size: int = 100,
+                 plugin_concurrency: int = 0,
+                 help_page_size: int = 0,
+                 outbox: Outbox = None,
+                 metrics_port: int = 0,
+                 profiler: SlowInvocationProfiler = None):
 
         super(Dispatcher, self).__init__(slack_client, plugins, errors_channel)
+        self.metrics: Metrics = self.metrics_class()
+        self._metrics_server: Optional[MetricsServer] = None
+        if metrics_port:
+            self._metrics_server = MetricsServer(self.metrics, metrics_port)
+        http.observe(self.metrics.on_response)
+        self._pool: WorkerPool = WorkerPool(self.dispatch_msg,
+                                            workers=workers,
+                                            queue_size=queue_size,
+                                            plugin_concurrency=plugin_concurrency,
+                                            metrics=self.metrics)
         self._plugins_manager: PluginsManager = self._plugins
+        self._help: PluginsHelp = PluginsHelp(self._plugins_manager, page_size=help_page_size)
+        self.directory: SlackDirectory = SlackDirectory(slack_client)
+        self.outbox: Outbox = outbox or Outbox()
+        self.profiler: Optional[SlowInvocationProfiler] = profiler
         self._registered_keywords: dict = {}
         self.debug: bool = debug
         self.shutdown: bool = False
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+
+    def start(self):
+        if self._metrics_server is not None:
+            self._metrics_server.start()
+        self.outbox.start()
+        super(Dispatcher, self).start()
 
-    def _get_plugins_help(self, verbose: bool = True) -> str:
-        helps = [u"You can ask me one of the following questions:"]
-        for plugin in sorted(self._plugins_manager.get_plugins_category("respond_to"), key=lambda p: p.re_pattern):
-            doc = "\n```%s```\n" % plugin.docs if verbose and plugin.docs else ""
-            custom_docs = re.findall(".*?Command: (.*?)(\n|$)", plugin.docs, re.MULTILINE) if plugin.docs else ""
-            pattern = custom_docs[0][0].strip() if custom_docs else cast(RegexPlugin, plugin).re_pattern
-            helps += [u' \u2022 {0}{1}'.format("`%s`" % pattern, doc)]
-        return '\n'.join(to_utf8(helps))
+    def _send(self, channel: str, text: str, dedupe: bool = False) -> None:
+        self.outbox.post(channel, text, self._client.rtm_send_message, dedupe=dedupe)
 
-    def _help_reply(self, msg) -> None:
+    def _get_plugins_help(self, verbose: bool = True, page: int = 1) -> str:
+        return self._help.render(verbose=verbose, page=page)
+
+    def _help_reply(self, msg, page: int = 1) -> None:
         default_reply = u"Hey there, I'm %s." % self._client.login_data['self']['name']
-        txt = '\n'.join(to_utf8([default_reply, self._get_plugins_help()]))
-        self._client.rtm_send_message(msg['channel'], txt)
+        txt = '\n'.join(to_utf8([default_reply, self._get_plugins_help(page=page)]))
+        self._send(msg['channel'], txt)
 
     def _get_default_answer(self, msg) -> str:
         default_reply = u'Bad command "%s".' % msg['text']
@@ -51,7 +99,7 @@ class Dispatcher(MessageDispatcher):
         return '\n'.join(to_utf8(parts))
 
     def _default_reply(self, msg) -> None:
-        self._client.rtm_send_message(msg['channel'], self._get_default_answer(msg))
+        self._send(msg['channel'], self._get_default_answer(msg))
 
     def dispatch_msg(self, msg) -> None:
         category = msg[0]
@@ -63,73 +111,158 @@ class Dispatcher(MessageDispatcher):
         if self.debug and text.startswith("test|"):
             text = text[len("test|"):]
 
-        if text.lower() == "help":
-            self._help_reply(msg)
+        help_match = HELP_MATCHER.match(text)
+        if help_match:
+            self._help_reply(msg, page=int(help_match.group(1) or 1))
+            return
+        if category == 'respond_to' and STATS_MATCHER.match(text):
+            self._stats_reply(msg)
+            return
+        slow_match = SLOW_MATCHER.match(text) if category == 'respond_to' else None
+        if slow_match:
+            self._slow_reply(msg, int(slow_match.group(1)) if slow_match.group(1) else None)
             return
 
+        start = time.perf_counter()
+        matched = list(self._plugins_manager.get_plugins(category, text))
+        self.metrics.observe("match_seconds", (category,), time.perf_counter() - start)
+
         responded = False
-        for plugin, args in self._plugins_manager.get_plugins(category, text):
+        for plugin, args in matched:
             if plugin:
                 responded = True
-                try:
-                    relevant_keywords = {k: v for k, v in self._registered_keywords.items() if k in plugin.args}
-                    plugin.run(plugin, MessageWrapper(self._client, msg), *args, **relevant_keywords)
-                except Shutdown:
-                    self.shutdown = True
-                except Exception as ex:
-                    logger.exception('failed to handle message %s with plugin "%s"', text, plugin.name)
-                    reply = '[%s] I have problem when handling "%s"\n' % (plugin.name, text)
-                    if self.debug:
-                        reply += '```\n%s\n```' % traceback.format_exc()
-                    else:
-                        reply += '```%s```' % ex
-                    self._client.rtm_send_message(msg['channel'], reply)
+                relevant_keywords = {k: v for k, v in self._registered_keywords.items() if k in plugin.args}
+                if not self._pool.submit(plugin, self._run_plugin, plugin, msg, text, args, relevant_keywords):
+                    if category == 'respond_to':
+                        self._send(msg['channel'], BUSY_REPLY, dedupe=True)
 
         if not responded and category == 'respond_to':
             self._default_reply(msg)
 
+    def _send_report(self, channel: str, text: str) -> None:
+        """Replies of the `stats` and `slow` commands, which describe this process only"""
+        self._send(channel, text)
+
+    def _stats_reply(self, msg) -> None:
+        self._send_report(msg['channel'], self.metrics.render_stats())
+
+    def _slow_reply(self, msg, index: Optional[int] = None) -> None:
+        if self.profiler is None:
+            self._send(msg['channel'], u"Slow invocations aren't profiled, set bot.profile_threshold to enable it.")
+            return
+        reply = self.profiler.render(index)
+        self._send_report(msg['channel'], reply if index is None else u"```%s```" % reply)
+
+    def _profile(self, plugin: Plugin, text: str, args, keywords: dict):
+        if self.profiler is None:
+            # a no-op context, contextlib.nullcontext is python 3.7+
+            return suppress()
+        return self.profiler.profile(plugin, text, args, keywords)
+
+    def _run_plugin(self, plugin: Plugin, msg, text: str, args, keywords: dict) -> None:
+        try:
+            with self.metrics.invocation(plugin), self._profile(plugin, text, args, keywords):
+                plugin.run(plugin, MessageWrapper(self._client, msg, outbox=self.outbox), *args, **keywords)
+        except Shutdown:
+            self.shutdown = True
+            self._wakeup()
+        except Exception as ex:
+            self._plugin_failed(plugin, ex, msg['channel'], text)
+
+    def _plugin_failed(self, plugin: Plugin, ex: Exception, channel: str, text: Optional[str] = None) -> None:
+        """Report a plugin that raised `ex`, called from its except block"""
+        self.metrics.increment("plugin_errors_total", (plugin.name,))
+        if text is None:
+            logger.exception('failed to handle plugin "%s"', plugin.name)
+            reply = '[%s] I have problem when handling plugin\n' % plugin.name
+        else:
+            logger.exception('failed to handle message %s with plugin "%s"', text, plugin.name)
+            reply = '[%s] I have problem when handling "%s"\n' % (plugin.name, text)
+        if self.debug:
+            reply += '```\n%s\n```' % traceback.format_exc()
+        else:
+            reply += '```%s```' % ex
+        self._send(channel, reply, dedupe=True)
+
+    def _handle_event(self, event: dict) -> None:
+        event_type = event.get('type')
+        if event_type == 'message':
+            self._on_new_message(event)
+        elif event_type in CHANNEL_EVENTS:
+            channel = [event['channel']]
+            self._client.parse_channel_data(channel)
+            if isinstance(event['channel'], dict):
+                self.directory.update_channels(channel)
+        elif event_type in USER_EVENTS:
+            user = [event['user']]
+            self._client.parse_user_data(user)
+            self.directory.update_users(user)
+
     def _handle_slack_plugins(self):
-        events = self._client.rtm_read()
-        for event in events:
-            event_type = event.get('type')
-            if event_type == 'message':
-                self._on_new_message(event)
-            elif event_type in ['channel_created',
-                                'channel_rename',
-                                'group_joined',
-                                'group_rename',
-                                'im_created']:
-                channel = [event['channel']]
-                self._client.parse_channel_data(channel)
-            elif event_type in ['team_join', 'user_change']:
-                user = [event['user']]
-                self._client.parse_user_data(user)
+        for event in self._client.rtm_read():
+            self._handle_event(event)
 
     def _handle_periodical_plugins(self):
         epoch_sec = int(time.time())
         for plugin, args in self._plugins_manager.get_plugins("periodic", epoch_sec):
             if plugin:
-                try:
-                    relevant_keywords = {k: v for k, v in self._registered_keywords.items() if k in plugin.args}
-                    plugin.run(plugin, *args, **relevant_keywords)
-                except Exception as ex:
-                    logger.exception('failed to handle plugin "%s"', plugin.name)
-                    reply = '[%s] I have problem when handling plugin\n' % plugin.name
-                    if self.debug:
-                        reply += '```\n%s\n```' % traceback.format_exc()
-                    else:
-                        reply += '```%s```' % ex
-                    self._client.rtm_send_message(self._errors_to, reply)
+                relevant_keywords = {k: v for k, v in self._registered_keywords.items() if k in plugin.args}
+                if not self._pool.submit(plugin, self._run_periodic_plugin, plugin, args, relevant_keywords):
+                    logger.warning('skipped periodic plugin "%s", workers are busy', plugin.name)
+
+    def _run_periodic_plugin(self, plugin: Plugin, args, keywords: dict) -> None:
+        try:
+            with self.metrics.invocation(plugin), self._profile(plugin, "", args, keywords):
+                plugin.run(plugin, *args, **keywords)
+        except Exception as ex:
+            self._plugin_failed(plugin, ex, self._errors_to)
+
+    def _wakeup(self) -> None:
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def _wait_for_events(self, timeout: Optional[float]) -> None:
+        timeout = MAX_IDLE_SECONDS if timeout is None else min(timeout, MAX_IDLE_SECONDS)
+        websocket = getattr(self._client, "websocket", None)
+        sock = getattr(websocket, "sock", None)
+        if sock is None:
+            # not connected (or reconnecting), fall back to polling
+            time.sleep(min(timeout, 1))
+            return
+
+        # ssl may already hold decrypted bytes that select can't see
+        if getattr(sock, "pending", None) and sock.pending():
+            return
+
+        try:
+            readable, _, _ = select.select([sock, self._wakeup_reader], [], [], timeout)
+        except (OSError, ValueError):
+            time.sleep(min(timeout, 1))
+            return
+
+        if self._wakeup_reader in readable:
+            try:
+                self._wakeup_reader.recv(1024)
+            except OSError:
+                pass
 
     def loop(self):
-        while True and not self.shutdown:
+        while not self.shutdown:
             self._handle_slack_plugins()
             self._handle_periodical_plugins()
-            time.sleep(1)
+            self._wait_for_events(self._plugins_manager.seconds_to_next_periodic(time.time()))
         self._teardown()
 
-    def register(self, keyword: str, value):
+    def register(self, keyword: str, value, blocking: bool = False):
+        """`blocking` marks values making network calls, only the asyncio runtime (see aio.AsyncDispatcher) uses it"""
         self._registered_keywords[keyword] = value
 
     def _teardown(self):
+        self._pool.stop()
+        self.outbox.stop()
+        http.unobserve(self.metrics.on_response)
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
         self._plugins_manager.teardown()
@@ -0,0 +1,72 @@
+import re
+from typing import Dict, List, Tuple, cast
+
+from slackbot.utils import to_utf8
+
+from .plugins import RegexPlugin
+from .plugins_manager import PluginsManager
+
+HELP_HEADER = u"You can ask me one of the following questions:"
+CUSTOM_DOCS_MATCHER = re.compile(".*?Command: (.*?)(\n|$)", re.MULTILINE)
+
+
+class PluginsHelp(object):
+    """
+    Renders the respond_to plugins list shown on `help` and on unknown commands.
+
+    Renderings are cached per (verbose, page) and dropped whenever the plugins manager revision changes,
+    i.e. when a plugin is registered or (un)suspended.
+    """
+
+    def __init__(self, plugins_manager: PluginsManager, page_size: int = 0):
+        self._plugins_manager: PluginsManager = plugins_manager
+        self.page_size: int = page_size
+        self._revision: int = -1
+        self._entries: List[Tuple[str, str]] = []
+        self._renderings: Dict[Tuple[bool, int], str] = {}
+
+    def _refresh(self) -> None:
+        if self._revision == self._plugins_manager.revision:
+            return
+
+        entries = []
+        plugins = self._plugins_manager.get_plugins_category("respond_to")
+        for plugin in sorted(plugins, key=lambda p: p.re_pattern):
+            if plugin.suspend:
+                continue
+            custom_docs = CUSTOM_DOCS_MATCHER.findall(plugin.docs) if plugin.docs else ""
+            pattern = custom_docs[0][0].strip() if custom_docs else cast(RegexPlugin, plugin).re_pattern
+            entries.append((pattern, plugin.docs or ""))
+
+        self._entries = entries
+        self._renderings = {}
+        self._revision = self._plugins_manager.revision
+
+    @property
+    def pages(self) -> int:
+        self._refresh()
+        if not self.page_size:
+            return 1
+        return max(1, -(-len(self._entries) // self.page_size))
+
+    def render(self, verbose: bool = True, page: int = 1) -> str:
+        self._refresh()
+        page = min(max(page, 1), self.pages)
+        key = (verbose, page)
+        if key not in self._renderings:
+            self._renderings[key] = self._render(verbose, page)
+        return self._renderings[key]
+
+    def _render(self, verbose: bool, page: int) -> str:
+        entries = self._entries
+        if self.page_size:
+            entries = entries[(page - 1) * self.page_size:page * self.page_size]
+
+        helps = [HELP_HEADER]
+        for pattern, docs in entries:
+            doc = "\n```%s```\n" % docs if verbose and docs else ""
+            helps += [u' • {0}{1}'.format("`%s`" % pattern, doc)]
+
+        if self.pages > 1:
+            helps += [u"Page %d of %d, ask me for `help <page>` to see the rest." % (page, self.pages)]
+        return '\n'.join(to_utf8(helps))
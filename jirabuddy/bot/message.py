@@ -1,9 +1,15 @@
+import os
+
 from slackbot.dispatcher import Message
 
+from .outbox import Outbox
+from ..clients.slack.client import stream_upload
+
 
 class MessageWrapper(Message):
-    def __init__(self, slack_client, body):
+    def __init__(self, slack_client, body, outbox: Outbox = None):
         super(MessageWrapper, self).__init__(slack_client, body)
+        self._outbox = outbox
 
     @property
     def sender(self):
@@ -14,10 +20,25 @@ class MessageWrapper(Message):
     def reply_code(self, text: str) -> None:
         return self.reply("```%s```" % text)
 
-    def reply(self, text: str, attachment_path: str = None, attachment_name: str = None) -> None:
+    def reply(self, text: str, attachment_path: str = None, attachment_name: str = None, compress: bool = False) -> None:
+        """:param compress: gzip the attachment while it is uploaded"""
         text = self.gen_reply(text)
         if attachment_path:
-            self._client.upload_file(self._body['channel'], attachment_name or attachment_path, attachment_path, text)
+            with open(attachment_path, "rb") as attachment:
+                stream_upload(self._client.token, 'file', attachment,
+                              {'channels': self._body['channel'], 'initial_comment': text},
+                              filename=attachment_name or os.path.basename(attachment_path), compress=compress)
         else:
             self.send(text)
 
+    def send(self, text: str, thread_ts=None) -> None:
+        if self._outbox is None:
+            return super(MessageWrapper, self).send(text, thread_ts=thread_ts)
+        self._outbox.post(self._body['channel'], text, self._client.rtm_send_message, thread_ts=thread_ts)
+
+    def send_webapi(self, text: str, attachments=None, as_user=True, thread_ts=None) -> None:
+        if self._outbox is None:
+            return super(MessageWrapper, self).send_webapi(text, attachments=attachments, as_user=as_user,
+                                                           thread_ts=thread_ts)
+        self._outbox.post(self._body['channel'], text, self._client.send_message,
+                          attachments=attachments, as_user=as_user, thread_ts=thread_ts)
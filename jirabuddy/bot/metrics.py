@@ -0,0 +1,255 @@
+import bisect
+import logging
+import re
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from .plugins import Plugin
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "jirabuddy"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# label used for requests made outside of a plugin (e.g. by the outbox)
+NO_PLUGIN = "-"
+
+# name -> (type, help, label names)
+METRICS: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {
+    "match_seconds": ("histogram", "Time spent matching an event against the plugins of a category",
+                      ("category",)),
+    "plugin_queue_wait_seconds": ("histogram", "Time a plugin invocation waited for a worker", ("plugin",)),
+    "plugin_run_seconds": ("histogram", "Plugin invocation run time", ("plugin",)),
+    "plugin_invocations_total": ("counter", "Plugin invocations", ("plugin",)),
+    "plugin_errors_total": ("counter", "Plugin invocations that raised", ("plugin",)),
+    "plugin_rejected_total": ("counter", "Plugin invocations rejected since the workers were busy", ("plugin",)),
+    "client_request_seconds": ("histogram", "Jira, GitLab and Slack requests time, by the plugin making them",
+                               ("plugin", "client", "method", "endpoint")),
+    "client_errors_total": ("counter", "Jira, GitLab and Slack requests answered with an error status",
+                            ("plugin", "client", "method", "endpoint", "status")),
+}
+
+# path segments that are ids (123, ABC-123, group%2Fproject), except api versions (/rest/api/2)
+ID_SEGMENT = re.compile(r"^(?:\d+|[A-Z][A-Z0-9_]*-\d+|.*%2F.*)$")
+
+
+def endpoint_of(url: str) -> str:
+    """`url`'s path with ids replaced by ":id", keeping the number of distinct endpoints bounded"""
+    segments = urlsplit(url).path.split("/")
+    for idx in range(1, len(segments)):
+        if ID_SEGMENT.match(segments[idx]) and segments[idx - 1] != "api":
+            segments[idx] = ":id"
+    return "/".join(segments)
+
+
+class Histogram(object):
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimated by interpolating inside the bucket holding it, like prometheus' histogram_quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if idx == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[idx - 1] if idx else 0.0
+                return lower + (self.buckets[idx] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = ['%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Metrics(object):
+    """
+    Per plugin latency and throughput, and the time of the client requests made by each plugin.
+
+    The dispatcher and the worker pool report plugin invocations, client requests are reported by the shared
+    http sessions (see `common.http.observe`) and attributed to the plugin running on the requesting thread.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: Tuple[float, ...] = buckets
+        self.started: float = time.time()
+        self._histograms: Dict[str, Dict[Tuple, Histogram]] = {}
+        self._counters: Dict[str, Dict[Tuple, int]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, name: str, labels: Tuple, value: float) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, labels: Tuple, amount: int = 1) -> None:
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    @property
+    def current_plugin(self) -> str:
+        return getattr(self._local, "plugin", NO_PLUGIN)
+
+    def _enter_plugin(self, name: str):
+        """Attribute the following requests to `name`, returns what `_exit_plugin` restores"""
+        previous = self.current_plugin
+        self._local.plugin = name
+        return previous
+
+    def _exit_plugin(self, previous) -> None:
+        self._local.plugin = previous
+
+    @contextmanager
+    def invocation(self, plugin: Plugin):
+        """Time a plugin invocation, requests made meanwhile on this thread are attributed to it"""
+        previous = self._enter_plugin(plugin.name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._exit_plugin(previous)
+            self.observe("plugin_run_seconds", (plugin.name,), time.perf_counter() - start)
+            self.increment("plugin_invocations_total", (plugin.name,))
+
+    def on_response(self, client: str, response: requests.Response) -> None:
+        request = response.request
+        labels = (self.current_plugin, client, request.method, endpoint_of(request.url))
+        self.observe("client_request_seconds", labels, response.elapsed.total_seconds())
+        if response.status_code >= 400:
+            self.increment("client_errors_total", labels + (response.status_code,))
+
+    def _snapshot(self):
+        with self._lock:
+            histograms = {name: {labels: (list(h.counts), h.sum, h.count) for labels, h in series.items()}
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+        return histograms, counters
+
+    def render_prometheus(self) -> str:
+        histograms, counters = self._snapshot()
+        lines = []
+        for name, (kind, description, label_names) in METRICS.items():
+            series = histograms.get(name) if kind == "histogram" else counters.get(name)
+            if not series:
+                continue
+            full_name = "%s_%s" % (PREFIX, name)
+            lines.append("# HELP %s %s" % (full_name, description))
+            lines.append("# TYPE %s %s" % (full_name, kind))
+            for labels, value in sorted(series.items(), key=lambda item: tuple(map(str, item[0]))):
+                if kind == "counter":
+                    lines.append("%s%s %d" % (full_name, _format_labels(label_names, labels), value))
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(float(bound)))
+                    lines.append("%s_bucket%s %d" % (full_name, _format_labels(label_names, labels, le), cumulative))
+                lines.append("%s_sum%s %f" % (full_name, _format_labels(label_names, labels), total))
+                lines.append("%s_count%s %d" % (full_name, _format_labels(label_names, labels), count))
+        return "\n".join(lines) + "\n"
+
+    def _quantiles(self, name: str) -> Dict[Tuple, Tuple[int, float, float, float]]:
+        """labels -> (count, mean, p50, p99)"""
+        with self._lock:
+            return {labels: (h.count, h.sum / h.count if h.count else 0.0, h.quantile(0.5), h.quantile(0.99))
+                    for labels, h in self._histograms.get(name, {}).items()}
+
+    def render_stats(self, top: int = 10) -> str:
+        """Slowest plugins and client endpoints, for the `stats` command"""
+        _, counters = self._snapshot()
+        errors = counters.get("plugin_errors_total", {})
+        rejected = counters.get("plugin_rejected_total", {})
+        waits = self._quantiles("plugin_queue_wait_seconds")
+
+        lines = ["Stats for the last %d minutes" % ((time.time() - self.started) // 60),
+                 "*Plugins* (calls, errors, rejected, p50 / p99 run time, mean queue wait):"]
+        plugins = sorted(self._quantiles("plugin_run_seconds").items(), key=lambda item: -item[1][1] * item[1][0])
+        for (plugin,), (count, mean, p50, p99) in plugins[:top]:
+            lines.append("• %s: %d, %d, %d, %.3fs / %.3fs, %.3fs" % (
+                plugin, count, errors.get((plugin,), 0), rejected.get((plugin,), 0), p50, p99,
+                waits.get((plugin,), (0, 0.0))[1]))
+        if not plugins:
+            lines.append("• no invocations yet")
+
+        lines.append("*Client requests* by total time (calls, p50 / p99):")
+        requests_time = sorted(self._quantiles("client_request_seconds").items(),
+                               key=lambda item: -item[1][1] * item[1][0])
+        for (plugin, client, method, endpoint), (count, mean, p50, p99) in requests_time[:top]:
+            lines.append("• %s %s %s (%s): %d, %.3fs / %.3fs" % (client, method, endpoint, plugin, count, p50, p99))
+        if not requests_time:
+            lines.append("• no requests yet")
+        return "\n".join(lines)
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is python 3.7+
+    daemon_threads = True
+
+
+class MetricsServer(object):
+    """Serves `Metrics.render_prometheus` at /metrics, on a local port"""
+
+    def __init__(self, metrics: Metrics, port: int, host: str = "127.0.0.1"):
+        self.metrics: Metrics = metrics
+        self.port: int = port
+        self.host: str = host
+        self._server: Optional[_Server] = None
+
+    def start(self) -> None:
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server((self.host, self.port), Handler)
+        self.port = self._server.server_port
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info("serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,202 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from ..common.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# slack cuts longer messages, coalescing stops before reaching it
+MAX_MESSAGE_SIZE = 3500
+# seconds to wait on a rate limit response without a Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class TokenBucket(object):
+    """`rate` tokens per second, holding at most `capacity` of them"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 or not self.rate else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Pending(object):
+    __slots__ = ("channel", "sender", "kwargs", "texts", "size", "due", "attempts")
+
+    def __init__(self, channel: str, sender: Callable, kwargs: dict, text: str, due: float):
+        self.channel: str = channel
+        self.sender: Callable = sender
+        self.kwargs: dict = kwargs
+        self.texts: List[str] = [text]
+        self.size: int = len(text)
+        self.due: float = due
+        self.attempts: int = 0
+
+    def accepts(self, sender: Callable, kwargs: dict, text: str, max_size: int) -> bool:
+        return sender == self.sender and kwargs == self.kwargs and self.size + len(text) + 1 <= max_size
+
+
+def retry_after(ex: Exception) -> Optional[float]:
+    """Seconds to back off if `ex` is a slack rate limit error, None otherwise"""
+    delay = getattr(ex, "retry_after", None)
+    if delay is not None:
+        return delay
+    response = getattr(ex, "response", None)
+    if response is not None and getattr(response, "status_code", None) == 429:
+        try:
+            return float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER
+    if str(ex) == "ratelimited":
+        return DEFAULT_RETRY_AFTER
+    return None
+
+
+class Outbox(object):
+    """
+    Outgoing slack messages, delivered in order per channel by a background thread.
+
+    Each channel gets a token bucket of `rate` messages per second (bursts of `burst`). Messages posted to the same
+    channel, with the same sender and arguments, within `coalesce_window` seconds (or while waiting for a token) are
+    sent as one. Rate limited sends are retried after Retry-After. Messages posted with `dedupe` are dropped if the
+    same text went to the channel in the last `dedupe_window` seconds, the next one mentions how many were dropped.
+    """
+
+    def __init__(self,
+                 rate: float = 1.0,
+                 burst: int = 3,
+                 coalesce_window: float = 0,
+                 dedupe_window: float = 300,
+                 max_retries: int = 3,
+                 max_message_size: int = MAX_MESSAGE_SIZE):
+        self.rate: float = rate
+        self.burst: int = burst
+        self.coalesce_window: float = coalesce_window
+        self.dedupe_window: float = dedupe_window
+        self.max_retries: int = max_retries
+        self.max_message_size: int = max_message_size
+        self._queues: Dict[str, Deque[_Pending]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._paused_until: Dict[str, float] = {}
+        # (channel, text) -> [last sent time, number of dropped duplicates]
+        self._recent: TTLCache = TTLCache(max_size=1024)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping: bool = False
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="slack-outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10) -> None:
+        """Deliver what's queued (without coalescing delays) and stop"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _deduped(self, channel: str, text: str, now: float) -> Optional[str]:
+        recent = self._recent.get((channel, text))
+        if recent is not None and now - recent[0] < self.dedupe_window:
+            recent[1] += 1
+            return None
+        self._recent[(channel, text)] = [now, 0]
+        if recent is not None and recent[1]:
+            text += "\n(repeated %d more times)" % recent[1]
+        return text
+
+    def post(self, channel: str, text: str, sender: Callable, dedupe: bool = False, **kwargs) -> bool:
+        """
+        Queue `sender(channel, text, **kwargs)`.
+        :return: False if the message was dropped as a duplicate
+        """
+        now = time.monotonic()
+        with self._cond:
+            if dedupe:
+                text = self._deduped(channel, text, now)
+                if text is None:
+                    return False
+            queue = self._queues.setdefault(channel, deque())
+            if queue and queue[-1].accepts(sender, kwargs, text, self.max_message_size):
+                queue[-1].texts.append(text)
+                queue[-1].size += len(text) + 1
+            else:
+                queue.append(_Pending(channel, sender, kwargs, text, now + self.coalesce_window))
+            self._cond.notify()
+        if self._thread is None:
+            self._flush_inline()
+        return True
+
+    def _flush_inline(self) -> None:
+        # not started (e.g. in scripts), deliver right away
+        with self._cond:
+            pending = [p for queue in self._queues.values() for p in queue]
+            self._queues.clear()
+        for p in pending:
+            self._deliver(p)
+
+    def _next_ready(self, now: float):
+        """(message to send now, None) or (None, seconds until one is ready)"""
+        wait = None
+        for channel, queue in list(self._queues.items()):
+            if not queue:
+                del self._queues[channel]
+                continue
+            bucket = self._buckets.get(channel)
+            if bucket is None:
+                bucket = self._buckets[channel] = TokenBucket(self.rate, self.burst)
+            ready_at = max(now if self._stopping else queue[0].due,
+                           now + bucket.delay(now),
+                           self._paused_until.get(channel, 0))
+            if ready_at <= now:
+                bucket.take(now)
+                return queue.popleft(), None
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, wait
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                pending, wait = self._next_ready(time.monotonic())
+                if pending is None:
+                    if self._stopping and not self._queues:
+                        return
+                    self._cond.wait(wait)
+                    continue
+            self._deliver(pending)
+
+    def _deliver(self, pending: _Pending) -> None:
+        try:
+            pending.sender(pending.channel, "\n".join(pending.texts), **pending.kwargs)
+        except Exception as ex:
+            delay = retry_after(ex)
+            if delay is None or pending.attempts >= self.max_retries or self._thread is None:
+                logger.exception("failed to send message to %s", pending.channel)
+                return
+            logger.warning("rate limited sending to %s, retrying in %.1f seconds", pending.channel, delay)
+            pending.attempts += 1
+            with self._cond:
+                self._paused_until[pending.channel] = time.monotonic() + delay
+                self._queues.setdefault(pending.channel, deque()).appendleft(pending)
+                self._cond.notify()
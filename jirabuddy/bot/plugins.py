@@ -1,20 +1,30 @@
+import asyncio
+import inspect
 import re
 from abc import ABC, abstractmethod
 from datetime import timedelta
 from types import FunctionType
 from typing import Tuple, Any, Optional
 
+from .state import PluginState
+
 
 class Plugin(ABC):
-    def __init__(self, func: FunctionType, name: str = None, plugin_type: str = None, suspend: bool = False):
+    def __init__(self,
+                 func: FunctionType,
+                 name: str = None,
+                 plugin_type: str = None,
+                 suspend: bool = False,
+                 max_concurrency: int = 0):
         self._id: str = func.__code__.co_name
         self._name: str = name or func.__name__
         self._args: Tuple[str] = func.__code__.co_varnames
         self._docs: str = func.__doc__
         self._plugin_type: str = plugin_type
         self._func: FunctionType = func
-        self.cache = {}
+        self.state: PluginState = PluginState(self._id)
         self.suspend: bool = suspend
+        self.max_concurrency: int = max_concurrency
 
     @property
     def id(self):
@@ -40,21 +50,62 @@ class Plugin(ABC):
     def func(self):
         return self._func
 
+    @property
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self._func)
+
     @abstractmethod
     def match(self, arg: Any) -> Tuple[bool, Optional[Tuple]]:
         pass
 
+    @property
+    def cache(self) -> PluginState:
+        return self.state
+
+    @cache.setter
+    def cache(self, values: dict) -> None:
+        if values is not self.state:
+            self.state.clear()
+            self.state.update(values)
+
     def run(self, *args, **kwargs):
+        """Run the handler, an `async def` one runs on an event loop of its own (see aio for the asyncio runtime)"""
+        if not self.suspend:
+            try:
+                if self.is_async:
+                    # asyncio.run is python 3.7+
+                    loop = asyncio.new_event_loop()
+                    try:
+                        loop.run_until_complete(self.func(*args, **kwargs))
+                    finally:
+                        loop.close()
+                else:
+                    self.func(*args, **kwargs)
+            finally:
+                self.state.flush()
+
+    async def run_async(self, *args, **kwargs):
+        """Await an `async def` handler on the running event loop"""
         if not self.suspend:
-            self.func(*args, **kwargs)
+            try:
+                await self.func(*args, **kwargs)
+            finally:
+                self.state.flush()
 
-    def store(self, store_dict: dict):
-        self.cache.update(**store_dict)
+    def bind_state(self, state) -> None:
+        """Persist the plugin's state to `state` (a StateStore), keys are loaded from it on first access"""
+        self.state.bind(state)
+
+    def store(self, store_dict: [dict, PluginState]):
+        if store_dict is not self.state:
+            self.state.update(store_dict)
+        self.state.flush()
 
     def restore(self, key: [str, None] = None):
+        """The value stored under `key` (None if there's none), or a copy of the whole state without a key"""
         if key is None:
-            return self.cache.copy()
-        return self.cache.get(key, None)
+            return self.state.copy()
+        return self.state.get(key, None)
 
 
 class RegexPlugin(Plugin):
@@ -65,9 +116,11 @@ class RegexPlugin(Plugin):
                  name: str = None,
                  plugin_type: str = None,
                  re_flags: int = 0,
-                 suspend: bool = False):
+                 suspend: bool = False,
+                 max_concurrency: int = 0):
 
-        super().__init__(func=func, name=name, plugin_type=plugin_type, suspend=suspend)
+        super().__init__(func=func, name=name, plugin_type=plugin_type, suspend=suspend,
+                         max_concurrency=max_concurrency)
         self.re_pattern: str = re_pattern
         self.re_flags: int = re_flags
         self.matcher: re.Pattern = re.compile(re_pattern, re_flags)
@@ -86,12 +139,20 @@ class PeriodicPlugin(Plugin):
                  frequency: timedelta,
                  name: str = None,
                  plugin_type: str = None,
-                 suspend: bool = False):
+                 suspend: bool = False,
+                 max_concurrency: int = 0):
 
-        super().__init__(func=func, name=name, plugin_type=plugin_type, suspend=suspend)
+        super().__init__(func=func, name=name, plugin_type=plugin_type, suspend=suspend,
+                         max_concurrency=max_concurrency)
         self.frequency: timedelta = frequency
         self.last_invoked_time = None
 
+    @property
+    def next_invocation_time(self) -> float:
+        if not self.last_invoked_time:
+            return 0
+        return self.last_invoked_time + self.frequency.total_seconds()
+
     def match(self, arg: int) -> Tuple[bool, Optional[Tuple]]:
         # first run, or last run was before now - frequency
         if not self.last_invoked_time or self.last_invoked_time + self.frequency.total_seconds() < arg:
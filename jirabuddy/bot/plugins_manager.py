@@ -1,92 +1,152 @@
+import heapq
+import itertools
 import logging
-import pickle
+import math
 from datetime import timedelta
-from typing import List, Any, Generator, Tuple
+from typing import List, Any, Generator, Tuple, Optional
 
 from slackbot.utils import to_utf8
 
 from .plugins import Plugin, RegexPlugin, PeriodicPlugin
+from .router import RegexRouter
+from .state import StateStore
 
 logger = logging.getLogger(__name__)
 
+# below this many plugins a plain scan is cheaper than routing
+ROUTER_MIN_PLUGINS = 16
 
-class PluginsManager(object):
-    def __init__(self, plugins_cache_path: [str, None] = None):
-        self.__plugins_cache_path = plugins_cache_path
-        self._load_plugins_cache()
 
-    _plugins_cache = {}
+class PluginsManager(object):
+    def __init__(self, plugins_cache_path: [str, None] = None, state_flush_interval: float = 0,
+                 shared_state: bool = False):
+        if plugins_cache_path:
+            PluginsManager._state = StateStore(plugins_cache_path, flush_interval=state_flush_interval,
+                                               shared=shared_state)
+            for plugins in self._store.values():
+                for plugin in plugins:
+                    plugin.bind_state(self._state)
+
+    # persistent plugins state, set when a plugins cache path is configured
+    _state: Optional[StateStore] = None
     _store = {
         'respond_to': [],
         'listen_to': [],
         'periodic': [],
         'default_reply': []
     }
-
-    def _load_plugins_cache(self):
-        if self.__plugins_cache_path:
-            try:
-                PluginsManager._plugins_cache = pickle.load(open(self.__plugins_cache_path, "rb"))
-            except Exception:
-                pass
-
-    def _save_plugins_cache(self):
-        if self.__plugins_cache_path:
-            for category in self._store:
-                for plugin in self._store[category]:
-                    self._plugins_cache[plugin.id] = plugin.cache
-            try:
-                pickle.dump(self._plugins_cache, open(self.__plugins_cache_path, "wb"))
-            except Exception:
-                pass
+    # min-heap of (next invocation time, registration order, plugin)
+    _periodic_schedule = []
+    _periodic_sequence = itertools.count()
+    # RegexRouter per category, rebuilt lazily after registrations
+    _routers = {}
+    # bumped whenever the set of active plugins changes
+    revision = 0
 
     @classmethod
     def register_plugin(cls, plugin: Plugin):
-        if plugin.id in cls._plugins_cache:
-            plugin.cache.update(cls._plugins_cache[plugin.id])
+        if cls._state is not None:
+            plugin.bind_state(cls._state)
         cls._store[plugin.plugin_type].append(plugin)
+        cls._routers.pop(plugin.plugin_type, None)
+        cls.revision += 1
+        if isinstance(plugin, PeriodicPlugin):
+            cls._schedule(plugin, next(cls._periodic_sequence))
+
+    @classmethod
+    def _schedule(cls, plugin: PeriodicPlugin, sequence: int):
+        heapq.heappush(cls._periodic_schedule, (plugin.next_invocation_time, sequence, plugin))
+
+    @classmethod
+    def suspend_plugin(cls, plugin: Plugin, suspend: bool = True):
+        if plugin.suspend != suspend:
+            plugin.suspend = suspend
+            cls.revision += 1
 
     def get_plugins_category(self, category: str) -> List[Plugin]:
         return self._store[category]
 
+    def seconds_to_next_periodic(self, now: float) -> Optional[float]:
+        if not self._periodic_schedule:
+            return None
+        # PeriodicPlugin.match is given whole seconds and is strict, so the earliest hit is the next whole second
+        return max(0.0, math.floor(self._periodic_schedule[0][0]) + 1 - now)
+
+    def _match_periodic_plugins(self, epoch: int) -> List[Tuple[Plugin, Tuple]]:
+        due = []
+        while self._periodic_schedule and self._periodic_schedule[0][0] < epoch:
+            due.append(heapq.heappop(self._periodic_schedule))
+
+        matched = []
+        for _, sequence, plugin in sorted(due, key=lambda entry: entry[1]):
+            match, args = plugin.match(epoch)
+            if match:
+                matched.append((plugin, args))
+            self._schedule(plugin, sequence)
+        return matched
+
+    def _match_plugins(self, category: str, arg: Any) -> Generator[Tuple[Plugin, Tuple], None, None]:
+        if category == "periodic":
+            yield from self._match_periodic_plugins(arg)
+            return
+
+        router = self._get_router(category)
+        if router is not None:
+            yield from router.route(arg)
+            return
+
+        for plugin in self.get_plugins_category(category=category):
+            match, args = plugin.match(arg)
+            if match:
+                yield plugin, args
+
+    def _get_router(self, category: str) -> Optional[RegexRouter]:
+        if category not in self._routers:
+            plugins = self.get_plugins_category(category=category)
+            routable = len(plugins) >= ROUTER_MIN_PLUGINS and all(isinstance(p, RegexPlugin) for p in plugins)
+            self._routers[category] = RegexRouter(plugins) if routable else None
+        return self._routers[category]
+
     def get_plugins(self, category: str, arg: Any) -> Generator[Tuple[Plugin, List[str]], None, None]:
         has_matching_plugin = False
         if arg is None:
             arg = ''
-        for plugin in self.get_plugins_category(category=category):
-            match, args = plugin.match(arg)
-            if match:
-                has_matching_plugin = True
-                yield plugin, to_utf8(args)
+        for plugin, args in self._match_plugins(category, arg):
+            has_matching_plugin = True
+            yield plugin, to_utf8(args)
 
         if not has_matching_plugin:
             yield None, None
 
     def teardown(self):
-        self._save_plugins_cache()
+        if self._state is not None:
+            self._state.close()
 
 
-def respond_to(regex: str, flags=0, suspend=False):
+def respond_to(regex: str, flags=0, suspend=False, max_concurrency=0):
     def wrapper(func):
-        PluginsManager.register_plugin(RegexPlugin(func, regex, re_flags=flags, plugin_type="respond_to", suspend=suspend))
+        PluginsManager.register_plugin(RegexPlugin(func, regex, re_flags=flags, plugin_type="respond_to", suspend=suspend,
+                                                   max_concurrency=max_concurrency))
         logger.info('registered respond_to plugin "%s" to "%s"', func.__name__, regex)
         return func
 
     return wrapper
 
 
-def listen_to(regex: str, flags=0, suspend=False):
+def listen_to(regex: str, flags=0, suspend=False, max_concurrency=0):
     def wrapper(func):
-        PluginsManager.register_plugin(RegexPlugin(func, regex, re_flags=flags, plugin_type="listen_to", suspend=suspend))
+        PluginsManager.register_plugin(RegexPlugin(func, regex, re_flags=flags, plugin_type="listen_to", suspend=suspend,
+                                                   max_concurrency=max_concurrency))
         logger.info('registered listen_to plugin "%s" to "%s"', func.__name__, regex)
         return func
 
     return wrapper
 
 
-def every(period: timedelta, suspend=False):
+def every(period: timedelta, suspend=False, max_concurrency=1):
     def wrapper(func):
-        PluginsManager.register_plugin(PeriodicPlugin(func, period, plugin_type="periodic", suspend=suspend))
+        PluginsManager.register_plugin(PeriodicPlugin(func, period, plugin_type="periodic", suspend=suspend,
+                                                      max_concurrency=max_concurrency))
         logger.info('registered periodic plugin "%s" every "%d" seconds', func.__name__, period.total_seconds())
         return func
 
@@ -0,0 +1,226 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import reprlib
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .plugins import Plugin
+
+logger = logging.getLogger(__name__)
+
+SAMPLING = "sampling"
+CPROFILE = "cprofile"
+# stacks (sampling) or functions (cprofile) shown per trace
+TOP_ENTRIES = 15
+
+_repr = reprlib.Repr()
+_repr.maxstring = 200
+_repr.maxother = 100
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return "%s:%d %s" % (os.path.basename(code.co_filename), frame.f_lineno, code.co_name)
+
+
+class SlowTrace(object):
+    """A plugin invocation that took longer than the threshold, with its profile"""
+
+    __slots__ = ("started", "duration", "plugin_name", "plugin_id", "text", "args", "keywords", "profile")
+
+    def __init__(self, started: float, duration: float, plugin: Plugin, text: str, args: Tuple, keywords: dict,
+                 profile: str):
+        self.started: float = started
+        self.duration: float = duration
+        self.plugin_name: str = plugin.name
+        self.plugin_id: str = plugin.id
+        self.text: str = text
+        self.args: str = _repr.repr(tuple(args))
+        self.keywords: Dict[str, str] = {name: _repr.repr(value) for name, value in keywords.items()}
+        self.profile: str = profile
+
+    @property
+    def summary(self) -> str:
+        return "[%s] %s took %.2fs on \"%s\"" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+                                               self.plugin_name, self.duration, self.text)
+
+    def render(self) -> str:
+        return "\n".join([self.summary,
+                          "plugin: %s (id %s)" % (self.plugin_name, self.plugin_id),
+                          "args: %s" % self.args,
+                          "keywords: %s" % ", ".join("%s=%s" % item for item in self.keywords.items()),
+                          self.profile])
+
+
+class _Invocation(object):
+    """Context profiling one plugin invocation, kept by the profiler if it turned out slow"""
+
+    def __init__(self, profiler: "SlowInvocationProfiler", plugin: Plugin, text: str, args: Tuple, keywords: dict):
+        self.profiler = profiler
+        self.plugin: Plugin = plugin
+        self.text: str = text
+        self.args: Tuple = args
+        self.keywords: dict = keywords
+        self.stacks: Counter = Counter()
+        self.root = None
+        self.thread_id: int = threading.get_ident()
+        self._profile: Optional[cProfile.Profile] = None
+        self._started: float = 0.0
+        self._start: float = 0.0
+
+    def __enter__(self):
+        # samples are cut at the frame entering the invocation
+        self.root = sys._getframe(1)
+        self._started = time.time()
+        self._start = time.perf_counter()
+        if self.profiler.mode == CPROFILE:
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # another invocation is being profiled (python 3.12+ allows a single profiler)
+                self._profile = None
+        else:
+            self.profiler.sampler.add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self._start
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            self.profiler.sampler.remove(self)
+        if duration >= self.profiler.threshold:
+            self.profiler.keep(SlowTrace(self._started, duration, self.plugin, self.text, self.args, self.keywords,
+                                         self._render_profile()))
+        return False
+
+    def sample(self, frame) -> None:
+        stack = []
+        while frame is not None and frame is not self.root:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        if stack:
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def _render_profile(self) -> str:
+        if self._profile is not None:
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(TOP_ENTRIES)
+            return out.getvalue().strip()
+        if self.profiler.mode == CPROFILE:
+            return "(not profiled, another invocation was being profiled)"
+        total = sum(self.stacks.values())
+        if not total:
+            return "(no samples)"
+        lines = ["%d samples every %.0fms, most frequent stacks (outermost first):"
+                 % (total, self.profiler.interval * 1000)]
+        for stack, count in self.stacks.most_common(TOP_ENTRIES):
+            lines.append("%5.1f%% %s" % (100.0 * count / total, stack))
+        return "\n".join(lines)
+
+
+class _Sampler(object):
+    """Samples the stacks of the threads running an invocation every `interval` seconds"""
+
+    def __init__(self, interval: float):
+        self.interval: float = interval
+        self._active: Dict[int, _Invocation] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, invocation: _Invocation) -> None:
+        with self._lock:
+            self._active[invocation.thread_id] = invocation
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-invocations-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def remove(self, invocation: _Invocation) -> None:
+        with self._lock:
+            if self._active.get(invocation.thread_id) is invocation:
+                del self._active[invocation.thread_id]
+
+    def _run(self) -> None:
+        while True:
+            if not self._active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, invocation in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        invocation.sample(frame)
+
+
+class SlowInvocationProfiler(object):
+    """
+    Profiles plugin invocations and keeps the last `keep` ones that took at least `threshold` seconds.
+
+    `mode` is "sampling" (stacks sampled every `interval` seconds, cheap enough to leave on) or "cprofile"
+    (deterministic, slows handlers down and profiles a single invocation at a time on python 3.12+).
+    Slow traces are also appended to `path` when given.
+    """
+
+    def __init__(self, threshold: float = 1.0, keep: int = 20, mode: str = SAMPLING, interval: float = 0.01,
+                 path: Optional[str] = None):
+        if mode not in (SAMPLING, CPROFILE):
+            raise ValueError('unknown profiling mode "%s", expected "%s" or "%s"' % (mode, SAMPLING, CPROFILE))
+        self.threshold: float = threshold
+        self.mode: str = mode
+        self.interval: float = interval
+        self.path: Optional[str] = path
+        self.sampler: _Sampler = _Sampler(interval)
+        self.traces: Deque[SlowTrace] = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def profile(self, plugin: Plugin, text: str = "", args: Tuple = (), keywords: dict = None) -> _Invocation:
+        return _Invocation(self, plugin, text, args, keywords or {})
+
+    def keep(self, trace: SlowTrace) -> None:
+        logger.warning("slow invocation: %s", trace.summary)
+        with self._lock:
+            self.traces.append(trace)
+        if self.path:
+            try:
+                with open(self.path, "a") as f:
+                    f.write(trace.render() + "\n\n")
+            except OSError:
+                logger.exception("failed to write slow invocation trace to %s", self.path)
+
+    def latest(self) -> List[SlowTrace]:
+        """Kept traces, most recent first"""
+        with self._lock:
+            return list(reversed(self.traces))
+
+    def render(self, index: Optional[int] = None) -> str:
+        """The kept traces summaries, or the full trace at `index` (1 is the most recent)"""
+        traces = self.latest()
+        if not traces:
+            return "No invocation took more than %.1fs lately." % self.threshold
+        if index is None:
+            lines = ["%d. %s" % (idx, trace.summary) for idx, trace in enumerate(traces, 1)]
+            lines.append("Ask me for `slow <number>` to see its profile.")
+            return "\n".join(lines)
+        if not 1 <= index <= len(traces):
+            return "There are only %d slow invocations." % len(traces)
+        return traces[index - 1].render()
+
+    def dump(self, path: str) -> int:
+        """Write the kept traces to `path`, oldest first, returns how many were written"""
+        traces = list(reversed(self.latest()))
+        with open(path, "w") as f:
+            for trace in traces:
+                f.write(trace.render() + "\n\n")
+        return len(traces)
@@ -0,0 +1,139 @@
+import re
+import warnings
+from collections import defaultdict
+from typing import Dict, Generator, List, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse  # python 3.11+
+except ImportError:
+    import sre_parse
+
+from .plugins import RegexPlugin
+
+SCOPED_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x"))
+UNSCOPED_FLAGS = re.ASCII | re.LOCALE
+# backreferences and conditionals would point at the wrong groups once patterns are combined
+GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+# patterns per combined alternation, sre resets every capture mark on each branch so huge alternations get slow
+GATE_SIZE = 64
+
+
+def literal_prefix(pattern: str, flags: int = 0) -> str:
+    """
+    :return: the literal text every match of `pattern` must start with (empty if there is none)
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return ""
+
+    prefix = []
+    for op, av in parsed:
+        if op == sre_parse.AT and av in (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING) and not prefix:
+            continue
+        if op == sre_parse.LITERAL:
+            prefix.append(chr(av))
+            continue
+        break
+    return "".join(prefix)
+
+
+def _is_ascii(text: str) -> bool:
+    return all(ord(c) < 128 for c in text)
+
+
+def _is_plain_regex_plugin(plugin: RegexPlugin) -> bool:
+    return type(plugin).match is RegexPlugin.match
+
+
+def _prefix(plugin: RegexPlugin) -> str:
+    if not _is_plain_regex_plugin(plugin):
+        return ""
+    prefix = literal_prefix(plugin.re_pattern, plugin.re_flags)
+    # with re.IGNORECASE a few non-ascii letters match ascii ones (e.g. KELVIN SIGN and "k"),
+    # only ascii prefixes can be compared by lower()
+    if plugin.matcher.flags & re.IGNORECASE:
+        return prefix.lower() if _is_ascii(prefix) else ""
+    return prefix
+
+
+def _fragment(plugin: RegexPlugin) -> Optional[str]:
+    """
+    :return: the plugin's pattern wrapped so it can be embedded in an alternation, or None if it can't be
+    """
+    flags = plugin.matcher.flags
+    if not _is_plain_regex_plugin(plugin) or flags & UNSCOPED_FLAGS:
+        return None
+    if plugin.matcher.groupindex or GROUP_REFERENCE.search(plugin.re_pattern):
+        return None
+
+    scoped = "".join(letter for flag, letter in SCOPED_FLAGS if flags & flag)
+    fragment = "(?%s:%s)" % (scoped, plugin.re_pattern) if scoped else "(?:%s)" % plugin.re_pattern
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            re.compile(fragment)
+    except (re.error, Warning):
+        return None
+    return fragment
+
+
+class RegexRouter(object):
+    """
+    Routing index over a list of RegexPlugins, yielding exactly what matching them one by one would.
+
+    Patterns with a literal prefix are looked up by the message's head, one dict lookup per distinct prefix
+    length. Patterns without one that can be safely embedded are combined into alternations of up to
+    GATE_SIZE patterns, so a miss rules out the whole block in one C-level call. The remaining candidates
+    are matched with the plugin's own `match`, in registration order.
+    """
+
+    def __init__(self, plugins: List[RegexPlugin]):
+        self._positions: Dict[int, int] = {id(plugin): position for position, plugin in enumerate(plugins)}
+        self._ungated: List[RegexPlugin] = []
+        self._gates: List[Tuple[re.Pattern, List[RegexPlugin]]] = []
+        self._by_prefix: Dict[int, Dict[str, List[RegexPlugin]]] = defaultdict(lambda: defaultdict(list))
+        self._by_prefix_ignore_case: Dict[int, Dict[str, List[RegexPlugin]]] = defaultdict(lambda: defaultdict(list))
+
+        fragments = []
+        gated = []
+        for plugin in plugins:
+            prefix = _prefix(plugin)
+            if prefix:
+                index = self._by_prefix_ignore_case if plugin.matcher.flags & re.IGNORECASE else self._by_prefix
+                index[len(prefix)][prefix].append(plugin)
+                continue
+
+            fragment = _fragment(plugin)
+            if fragment:
+                fragments.append(fragment)
+                gated.append(plugin)
+            else:
+                self._ungated.append(plugin)
+
+        for idx in range(0, len(fragments), GATE_SIZE):
+            self._gates.append((re.compile("|".join(fragments[idx:idx + GATE_SIZE])), gated[idx:idx + GATE_SIZE]))
+
+    def _candidates(self, text: str) -> List[RegexPlugin]:
+        candidates = list(self._ungated)
+        for gate, plugins in self._gates:
+            if gate.match(text):
+                candidates += plugins
+
+        for length, plugins_by_prefix in self._by_prefix.items():
+            candidates += plugins_by_prefix.get(text[:length], ())
+
+        for length, plugins_by_prefix in self._by_prefix_ignore_case.items():
+            head = text[:length]
+            if _is_ascii(head):
+                candidates += plugins_by_prefix.get(head.lower(), ())
+            else:
+                candidates += [plugin for plugins in plugins_by_prefix.values() for plugin in plugins]
+
+        return sorted(candidates, key=lambda plugin: self._positions[id(plugin)])
+
+    def route(self, text: str) -> Generator[Tuple[RegexPlugin, Tuple], None, None]:
+        for plugin in self._candidates(text):
+            match, args = plugin.match(text)
+            if match:
+                yield plugin, args
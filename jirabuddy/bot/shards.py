@@ -0,0 +1,309 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from typing import List, Optional
+
+from slackbot.slackclient import SlackClient
+
+from .bot import ERRORS_CHANNEL, SlackBot
+from .dispatcher import BUSY_REPLY, CHANNEL_EVENTS, Dispatcher, USER_EVENTS
+from .outbox import Outbox
+from .plugins_manager import PluginsManager
+from .state import StateStore
+from ..common import http
+
+logger = logging.getLogger(__name__)
+
+# message kinds on the replies queue
+RTM = "rtm"
+WEB = "web"
+SHUTDOWN = "shutdown"
+# seconds between checks of the shards' liveness (and, while idle, of a shard's shutdown flag)
+POLL_SECONDS = 1
+# seconds a shard gets to finish its handlers when the bot stops
+STOP_TIMEOUT = 30
+
+
+def shard_of(channel: str, shards: int) -> int:
+    """Stable across processes and restarts, unlike hash()"""
+    return zlib.crc32(channel.encode("utf-8")) % shards
+
+
+class ShardClient(SlackClient):
+    """
+    Slack client of a shard process: the parent's login data, users and channels as of the fork (kept up to date by
+    the directory events the parent forwards). Messages are handed back to the parent, which sends them.
+    """
+
+    def __init__(self, client: SlackClient, replies: multiprocessing.Queue):
+        self.__dict__.update(client.__dict__)
+        # the parent's socket, inherited by the fork, is not ours to use
+        self.websocket = None
+        self._replies = replies
+
+    def rtm_connect(self):
+        raise RuntimeError("shards don't connect to slack, the parent process does")
+
+    def rtm_send_message(self, channel: str, message: str, attachments=None, thread_ts=None) -> None:
+        self._replies.put((RTM, channel, message, dict(attachments=attachments, thread_ts=thread_ts)))
+
+    def send_message(self, channel: str, message: str, attachments=None, as_user=True, thread_ts=None) -> None:
+        self._replies.put((WEB, channel, message, dict(attachments=attachments, as_user=as_user,
+                                                       thread_ts=thread_ts)))
+
+
+class ShardDispatcher(Dispatcher):
+    """Dispatcher of a shard process, its `stats` and `slow` replies say which shard they describe"""
+
+    def __init__(self, *args, shard: int, shards: int, **kwargs):
+        super(ShardDispatcher, self).__init__(*args, **kwargs)
+        self._scope = u"_Shard %d of %d, the one handling this channel:_" % (shard + 1, shards)
+
+    def _send_report(self, channel: str, text: str) -> None:
+        super(ShardDispatcher, self)._send_report(channel, u"%s\n%s" % (self._scope, text))
+
+
+class ShardRouter(Dispatcher):
+    """
+    Dispatcher of the parent process: message events go to the queue of their channel's shard instead of being
+    handled, directory events are applied and forwarded to every shard. Periodic plugins still run here, and the
+    shards' messages are sent from here.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ShardRouter, self).__init__(*args, **kwargs)
+        self._shards: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._replies: Optional[multiprocessing.Queue] = None
+        self._replies_thread: Optional[threading.Thread] = None
+
+    def route_to(self, shards: List[multiprocessing.Queue], processes: List[multiprocessing.Process],
+                 replies: multiprocessing.Queue) -> None:
+        self._shards = shards
+        self._processes = processes
+        self._replies = replies
+        self._replies_thread = threading.Thread(target=self._deliver_replies, name="shard-replies", daemon=True)
+        self._replies_thread.start()
+
+    def _on_new_message(self, msg):
+        if not self._shards:
+            return super(ShardRouter, self)._on_new_message(msg)
+        if msg.get('user') == self._get_bot_id() or 'channel' not in msg:
+            return
+        shard = shard_of(msg['channel'], len(self._shards))
+        try:
+            self._shards[shard].put_nowait(msg)
+        except queue.Full:
+            logger.warning("shard %d queue is full, dropping a message to %s", shard, msg['channel'])
+            if self.filter_text(msg):
+                self._send(msg['channel'], BUSY_REPLY, dedupe=True)
+
+    def _handle_event(self, event: dict) -> None:
+        super(ShardRouter, self)._handle_event(event)
+        if event.get('type') in CHANNEL_EVENTS + USER_EVENTS:
+            for index, shard in enumerate(self._shards):
+                # a shard that's behind must not hold up the routing of the others' messages
+                try:
+                    shard.put_nowait(event)
+                except queue.Full:
+                    logger.warning("shard %d queue is full, dropping a %s event, its directory is stale until the "
+                                   "next one", index, event['type'])
+
+    def _deliver_replies(self) -> None:
+        """Send the shards' messages until the replies queue is closed, stop the bot if a shard asks to or dies"""
+        next_check = time.monotonic()
+        while True:
+            # checked on time rather than when idle, the other shards may keep the queue busy
+            if time.monotonic() >= next_check:
+                self._check_shards()
+                next_check = time.monotonic() + POLL_SECONDS
+            try:
+                reply = self._replies.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if reply is None:
+                return
+            if reply[0] == SHUTDOWN:
+                self._stop()
+                continue
+            kind, channel, message, kwargs = reply
+            sender = self._client.rtm_send_message if kind == RTM else self._client.send_message
+            self.outbox.post(channel, message, sender, **kwargs)
+
+    def _check_shards(self) -> None:
+        dead = [process.name for process in self._processes if not process.is_alive()]
+        if dead and not self.shutdown:
+            logger.error("shards %s exited, stopping", ", ".join(dead))
+            self._stop()
+
+    def _stop(self) -> None:
+        self.shutdown = True
+        self._wakeup()
+
+    def _stop_shards(self) -> None:
+        for events in self._shards:
+            try:
+                events.put(None, timeout=POLL_SECONDS)
+            except queue.Full:
+                pass
+        for process in self._processes:
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning("shard %s didn't stop in %ds, terminating it", process.name, STOP_TIMEOUT)
+                process.terminate()
+        if self._replies_thread is not None:
+            # the shards' last messages go out before the outbox stops
+            self._replies.put(None)
+            self._replies_thread.join()
+
+    def _teardown(self):
+        self._stop_shards()
+        super(ShardRouter, self)._teardown()
+
+
+class ShardedSlackBot(SlackBot):
+    """
+    SlackBot handling messages in `shards` processes, for plugins (and free text parsing) bound by the CPU.
+
+    The parent process owns the RTM connection, runs the periodic plugins and sends every reply through its outbox,
+    so the rate limits hold across shards. A message goes to the shard of its channel (crc32 of the channel id),
+    keeping each channel's messages in order on a single process. Shards are forked by `run`, once the plugins are
+    imported and the clients created, and share that setup. Each shard has its own workers, metrics (served on
+    `metrics_port` + 1 + shard) and slow invocations: `stats` and `slow` answer for the shard of the channel they're
+    asked in, and say so. `help` is the same on every shard.
+
+    Plugin state goes through the sqlite store, opened by every process after the fork, and is read again on every
+    invocation. `state.increment` is atomic across shards, other read-modify-write of a key written by several
+    shards at once can lose an update. Without `plugins_cache_path` every shard keeps its own in-memory state, which
+    drifts apart from the others'.
+    """
+
+    dispatcher_class = ShardRouter
+
+    def __init__(self,
+                 token: str,
+                 debug: bool = False,
+                 plugins_cache_path: str = None,
+                 state_flush_interval: float = 0,
+                 workers: int = 10,
+                 queue_size: int = 100,
+                 plugin_concurrency: int = 0,
+                 help_page_size: int = 0,
+                 outbox_rate: float = 1.0,
+                 outbox_burst: int = 3,
+                 outbox_coalesce_window: float = 0,
+                 errors_dedupe_window: float = 300,
+                 metrics_port: int = 0,
+                 profile_threshold: float = 0,
+                 profile_mode: str = "sampling",
+                 profile_keep: int = 20,
+                 profile_path: str = None,
+                 shards: int = 2):
+        # registered values, handed to the shards' dispatchers
+        self._keywords: dict = {}
+        # sqlite connections can't cross a fork, the store is opened in run by every process
+        super(ShardedSlackBot, self).__init__(token,
+                                              debug=debug,
+                                              state_flush_interval=state_flush_interval,
+                                              workers=workers,
+                                              queue_size=queue_size,
+                                              plugin_concurrency=plugin_concurrency,
+                                              help_page_size=help_page_size,
+                                              outbox_rate=outbox_rate,
+                                              outbox_burst=outbox_burst,
+                                              outbox_coalesce_window=outbox_coalesce_window,
+                                              errors_dedupe_window=errors_dedupe_window,
+                                              metrics_port=metrics_port,
+                                              profile_threshold=profile_threshold,
+                                              profile_mode=profile_mode,
+                                              profile_keep=profile_keep,
+                                              profile_path=profile_path)
+        self.shards: int = shards
+        self._plugins_cache_path: Optional[str] = plugins_cache_path
+        if not plugins_cache_path:
+            logger.warning("no plugins_cache_path, each of the %d shards keeps its own plugin state, set one to share "
+                           "it", shards)
+        self._state_flush_interval: float = state_flush_interval
+        self._shard_settings = dict(errors_channel=ERRORS_CHANNEL,
+                                    debug=debug,
+                                    workers=workers,
+                                    queue_size=queue_size,
+                                    plugin_concurrency=plugin_concurrency,
+                                    help_page_size=help_page_size,
+                                    errors_dedupe_window=errors_dedupe_window,
+                                    metrics_port=metrics_port)
+
+    def register(self, keyword: str, value, blocking: bool = False):
+        super(ShardedSlackBot, self).register(keyword, value, blocking=blocking)
+        self._keywords[keyword] = value
+
+    def _open_state(self) -> None:
+        if self._plugins_cache_path:
+            PluginsManager(plugins_cache_path=self._plugins_cache_path,
+                           state_flush_interval=self._state_flush_interval,
+                           shared_state=True)
+
+    def run(self):
+        if self._plugins_cache_path:
+            # a legacy pickle is migrated once, before every process opens the store
+            StateStore(self._plugins_cache_path).close()
+        context = multiprocessing.get_context("fork")
+        replies = context.Queue()
+        shards, processes = [], []
+        for index in range(self.shards):
+            events = context.Queue(maxsize=self._shard_settings["queue_size"])
+            process = context.Process(target=self._serve_shard, args=(index, events, replies),
+                                      name="jirabuddy-shard-%d" % index, daemon=True)
+            process.start()
+            shards.append(events)
+            processes.append(process)
+        logger.info("forked %d shards", self.shards)
+
+        self._open_state()
+        self._dispatcher.route_to(shards, processes, replies)
+        super(ShardedSlackBot, self).run()
+
+    def _serve_shard(self, index: int, events: multiprocessing.Queue, replies: multiprocessing.Queue) -> None:
+        """Runs in the shard process, handling the events routed to it until the parent stops it"""
+        http.after_fork()
+        # the parent's dispatcher came along with the fork, it's not the one reporting requests here
+        http.unobserve(self._dispatcher.metrics.on_response)
+        settings = self._shard_settings
+        self._client = ShardClient(self._client, replies)
+        self._open_state()
+        self._dispatcher = ShardDispatcher(slack_client=self._client,
+                                           plugins=self._plugins,
+                                           errors_channel=settings["errors_channel"],
+                                           debug=settings["debug"],
+                                           workers=settings["workers"],
+                                           queue_size=settings["queue_size"],
+                                           plugin_concurrency=settings["plugin_concurrency"],
+                                           help_page_size=settings["help_page_size"],
+                                           # the parent's outbox paces the messages
+                                           outbox=Outbox(rate=0, coalesce_window=0, max_message_size=0,
+                                                         dedupe_window=settings["errors_dedupe_window"]),
+                                           metrics_port=settings["metrics_port"] + 1 + index
+                                           if settings["metrics_port"] else 0,
+                                           profiler=self._dispatcher.profiler,
+                                           shard=index,
+                                           shards=self.shards)
+        for keyword, value in self._keywords.items():
+            self._dispatcher.register(keyword, value)
+
+        self._dispatcher.start()
+        try:
+            while not self._dispatcher.shutdown:
+                try:
+                    event = events.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if event is None:
+                    break
+                self._dispatcher._handle_event(event)
+            if self._dispatcher.shutdown:
+                replies.put((SHUTDOWN,))
+        finally:
+            self._dispatcher._teardown()
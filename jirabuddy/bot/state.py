@@ -0,0 +1,404 @@
+import ast
+import itertools
+import logging
+import math
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from ..common.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# marker for a pending delete in the write-behind buffer
+_DELETED = object()
+_MISSING = object()
+# key types a plugin state can hold besides str, in tuples too
+_LITERAL_KEYS = (str, int, float, bytes, type(None))
+
+
+def _is_literal(key: Any) -> bool:
+    if isinstance(key, tuple):
+        return all(_is_literal(item) for item in key)
+    if isinstance(key, float):
+        return math.isfinite(key)
+    return isinstance(key, _LITERAL_KEYS)
+
+
+def encode_key(key: Any) -> Union[str, bytes]:
+    """
+    Column value of a state key: str keys are stored as text, other literals (int, tuple...) as the blob of their
+    repr, so they come back with their type.
+    """
+    if isinstance(key, str):
+        return key
+    if _is_literal(key):
+        return repr(key).encode("utf-8")
+    raise TypeError("plugin state keys are strings, numbers, bytes or tuples of them, not %s" % type(key).__name__)
+
+
+def decode_key(key: Union[str, bytes]) -> Any:
+    return key if isinstance(key, str) else ast.literal_eval(key.decode("utf-8"))
+
+
+class StateStore(object):
+    """
+    Crash safe (plugin id, key) -> value store backed by sqlite in WAL mode, values are pickled.
+
+    With `flush_interval` 0 every write is committed before it returns. Otherwise writes are buffered and committed
+    in one transaction every `flush_interval` seconds, or as soon as `batch_size` writes are pending.
+    A pickle file left by older versions at `path` is migrated once and kept aside as `<path>.bak`.
+    A `shared` store is written by several processes, its PluginStates read values again on every invocation and
+    increment in the store itself.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0, batch_size: int = 500, shared: bool = False):
+        self.path: str = path
+        self.flush_interval: float = flush_interval
+        self.batch_size: int = batch_size
+        self.shared: bool = shared
+        self._lock = threading.RLock()
+        self._pending: Dict[Tuple[str, str], Any] = {}
+        self._closed = threading.Event()
+
+        legacy = self._read_legacy_pickle()
+        if legacy is not None:
+            self._migrate(legacy)
+        self._db = self._connect(path)
+
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, name="plugin-state", daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS plugin_state ("
+                   "plugin TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                   "PRIMARY KEY (plugin, key)) WITHOUT ROWID")
+        return db
+
+    def _read_legacy_pickle(self) -> Optional[Dict[str, Dict[Any, Any]]]:
+        """The plugins cache pickled by older versions at `path`, None if it holds a sqlite store (or nothing)"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            if f.read(len(SQLITE_HEADER)) == SQLITE_HEADER or not os.path.getsize(self.path):
+                return None
+        try:
+            with open(self.path, "rb") as f:
+                legacy = pickle.load(f)
+        except Exception:
+            logger.exception("failed to read legacy plugins cache %s", self.path)
+            legacy = None
+        return legacy if isinstance(legacy, dict) else {}
+
+    def _migrate(self, legacy: Dict[str, Dict[Any, Any]]) -> None:
+        """
+        Write the legacy cache to a new store in one transaction, which replaces the pickle once committed.
+        The pickle is kept as `<path>.bak`, a migration that didn't complete is started over on the next start.
+        """
+        migrating = self.path + ".migrating"
+        for leftover in (migrating, migrating + "-wal", migrating + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        self._db = self._connect(migrating)
+        try:
+            self._write((plugin_id, key, value)
+                        for plugin_id, cache in legacy.items() if isinstance(cache, dict)
+                        for key, value in cache.items())
+        finally:
+            self._db.close()
+        shutil.copy2(self.path, self.path + ".bak")
+        os.replace(migrating, self.path)
+        logger.info("migrated plugins cache %s (%d plugins)", self.path, len(legacy))
+
+    def _write(self, rows: Iterable[Tuple[str, Any, Any]]) -> None:
+        upserts: List[tuple] = []
+        deletes: List[tuple] = []
+        for plugin_id, key, value in rows:
+            try:
+                if value is _DELETED:
+                    deletes.append((plugin_id, encode_key(key)))
+                else:
+                    upserts.append((plugin_id, encode_key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            except Exception:
+                # retrying can't help, the rest of the batch is written
+                logger.exception("dropping plugin state %s[%r], it can't be stored", plugin_id, key)
+        with self._lock:
+            # take the write lock upfront, waiting on other processes instead of failing to upgrade
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO plugin_state (plugin, key, value) VALUES (?, ?, ?)",
+                                     upserts)
+                self._db.executemany("DELETE FROM plugin_state WHERE plugin = ? AND key = ?", deletes)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _put(self, plugin_id: str, items: Iterable[Tuple[str, Any]]) -> None:
+        if not self.flush_interval:
+            self._write((plugin_id, key, value) for key, value in items)
+            return
+        with self._lock:
+            for key, value in items:
+                self._pending[(plugin_id, key)] = value
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("failed to flush plugin state")
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                self._write((plugin_id, key, value) for (plugin_id, key), value in pending.items())
+            except Exception:
+                pending.update(self._pending)
+                self._pending = pending
+                raise
+
+    def get(self, plugin_id: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if (plugin_id, key) in self._pending:
+                value = self._pending[(plugin_id, key)]
+                return default if value is _DELETED else value
+            row = self._db.execute("SELECT value FROM plugin_state WHERE plugin = ? AND key = ?",
+                                   (plugin_id, encode_key(key))).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def items(self, plugin_id: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._db.execute("SELECT key, value FROM plugin_state WHERE plugin = ?", (plugin_id,)).fetchall()
+            pending = {key: value for (pid, key), value in self._pending.items() if pid == plugin_id}
+        items = {decode_key(key): pickle.loads(value) for key, value in rows}
+        for key, value in pending.items():
+            if value is _DELETED:
+                items.pop(key, None)
+            else:
+                items[key] = value
+        return items
+
+    def increment(self, plugin_id: str, key: str, amount: int = 1, default: int = 0) -> int:
+        """Add `amount` in a single transaction, atomic across the processes sharing the store"""
+        with self._lock:
+            value = self._pending.pop((plugin_id, key), _MISSING)
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if value is _MISSING:
+                    row = self._db.execute("SELECT value FROM plugin_state WHERE plugin = ? AND key = ?",
+                                           (plugin_id, encode_key(key))).fetchone()
+                    value = pickle.loads(row[0]) if row else default
+                elif value is _DELETED:
+                    value = default
+                value += amount
+                self._db.execute("INSERT OR REPLACE INTO plugin_state (plugin, key, value) VALUES (?, ?, ?)",
+                                 (plugin_id, encode_key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return value
+
+    def set(self, plugin_id: str, key: str, value: Any) -> None:
+        self._put(plugin_id, ((key, value),))
+
+    def update(self, plugin_id: str, values: Dict[str, Any], deleted: Iterable[str] = ()) -> None:
+        self._put(plugin_id, itertools.chain(values.items(), ((key, _DELETED) for key in deleted)))
+
+    def delete(self, plugin_id: str, key: str) -> None:
+        self._put(plugin_id, ((key, _DELETED),))
+
+    def close(self) -> None:
+        self._closed.set()
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._db.close()
+
+
+class PluginState(object):
+    """
+    Dict like handle on a plugin's state, values are loaded from the StateStore on first access. Keys are strings,
+    numbers, bytes or tuples of them (see `encode_key`).
+
+    Every key that is set, deleted, incremented or handed out as a bounded collection is marked dirty, and dirty keys
+    are written to the store on `flush`, which runs after every plugin invocation. Values mutated in place
+    (e.g. a list that was read) should be marked with `touch`.
+    """
+
+    def __init__(self, plugin_id: str, store: Optional[StateStore] = None):
+        self.plugin_id: str = plugin_id
+        self._store: Optional[StateStore] = store
+        self._data: Dict[str, Any] = {}
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._loaded: bool = store is None
+        self._lock = threading.RLock()
+
+    def bind(self, store: StateStore) -> None:
+        with self._lock:
+            self._store = store
+            self._loaded = False
+
+    def _load(self, key: str) -> Any:
+        # caller holds the lock
+        if key in self._data:
+            return self._data[key]
+        if self._loaded or key in self._deleted:
+            return _MISSING
+        value = self._store.get(self.plugin_id, key, _MISSING)
+        if value is not _MISSING:
+            self._data[key] = value
+        return value
+
+    def _load_all(self) -> Dict[str, Any]:
+        with self._lock:
+            if not self._loaded:
+                for key, value in self._store.items(self.plugin_id).items():
+                    if key not in self._deleted:
+                        self._data.setdefault(key, value)
+                self._loaded = True
+            return self._data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            value = self._load(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        encode_key(key)
+        with self._lock:
+            self._data[key] = value
+            self._deleted.discard(key)
+            self._dirty.add(key)
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            if self._load(key) is _MISSING:
+                raise KeyError(key)
+            del self._data[key]
+            self._deleted.add(key)
+            self._dirty.add(key)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            value = self._load(key)
+            if value is _MISSING:
+                return default
+            del self[key]
+            return value
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._load(key) is not _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._load_all()))
+
+    def __len__(self) -> int:
+        return len(self._load_all())
+
+    def keys(self):
+        return list(self._load_all())
+
+    def items(self):
+        with self._lock:
+            return list(self._load_all().items())
+
+    def update(self, values: Dict[str, Any]) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self[key] = value
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._load_all()):
+                del self[key]
+
+    def copy(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._load_all())
+
+    def touch(self, *keys: str) -> None:
+        """Mark keys whose values were mutated in place"""
+        with self._lock:
+            self._dirty.update(keys)
+
+    def increment(self, key: str, amount: int = 1, default: int = 0) -> int:
+        encode_key(key)
+        with self._lock:
+            if self._store is not None and self._store.shared:
+                value = self._store.increment(self.plugin_id, key, amount, default)
+                self._data[key] = value
+                self._deleted.discard(key)
+                self._dirty.discard(key)
+                return value
+            value = self.get(key, default) + amount
+            self[key] = value
+            return value
+
+    def bounded(self, key: str, max_size: int = 1024, ttl: Optional[float] = None) -> TTLCache:
+        """
+        LRU collection kept under `key`, holding at most `max_size` entries of at most `ttl` seconds old.
+        The collection is marked dirty every time it is handed out.
+        """
+        encode_key(key)
+        with self._lock:
+            collection = self.get(key)
+            if not isinstance(collection, TTLCache):
+                collection = TTLCache(max_size=max_size, ttl=ttl)
+                self._data[key] = collection
+            collection.max_size, collection.ttl = max_size, ttl
+            self._deleted.discard(key)
+            self._dirty.add(key)
+            return collection
+
+    def __repr__(self):
+        return "<PluginState %s (%d cached, %d dirty)>" % (self.plugin_id, len(self._data), len(self._dirty))
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._dirty:
+                self._write_dirty()
+            if self._store is not None and self._store.shared:
+                # other processes write to the store, clean values are read again on the next access
+                self._data = {key: value for key, value in self._data.items() if key in self._dirty}
+                self._loaded = False
+
+    def _write_dirty(self) -> None:
+        # caller holds the lock
+        dirty, self._dirty = self._dirty, set()
+        if self._store is None:
+            return
+        try:
+            self._store.update(self.plugin_id,
+                               {key: self._data[key] for key in dirty if key in self._data},
+                               deleted=[key for key in dirty if key in self._deleted])
+        except Exception:
+            self._dirty |= dirty
+            raise
+        self._deleted -= dirty
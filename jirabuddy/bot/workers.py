@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import Metrics
+from .plugins import Plugin
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+    """
+    Runs plugin handlers off the RTM loop.
+
+    Drop-in replacement for slackbot's ``WorkerPool``: ``add_task`` still receives the raw (category, msg) tuples,
+    but matching is done on the calling thread and only the matched handlers are queued through ``submit``.
+    The queue is bounded and every plugin has a cap on its in-flight invocations, so ``submit`` returns False
+    instead of blocking when the bot is saturated.
+    """
+
+    def __init__(self,
+                 dispatch: Callable[[Any], None],
+                 workers: int = 10,
+                 queue_size: int = 100,
+                 plugin_concurrency: int = 0,
+                 metrics: Optional[Metrics] = None):
+        self.workers: int = workers
+        self.plugin_concurrency: int = plugin_concurrency
+        self.metrics: Metrics = metrics or Metrics()
+        self._dispatch = dispatch
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._work, name="plugin-worker-%d" % idx, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def add_task(self, msg) -> None:
+        self._dispatch(msg)
+
+    def _limit(self, plugin: Plugin) -> int:
+        return plugin.max_concurrency or self.plugin_concurrency
+
+    def submit(self, plugin: Plugin, func: Callable, *args, **kwargs) -> bool:
+        if not self.workers:
+            self.metrics.observe("plugin_queue_wait_seconds", (plugin.name,), 0.0)
+            func(*args, **kwargs)
+            return True
+
+        limit = self._limit(plugin)
+        with self._lock:
+            if limit and self._in_flight[plugin.id] >= limit:
+                logger.warning('plugin "%s" reached its concurrency limit (%d)', plugin.name, limit)
+                self.metrics.increment("plugin_rejected_total", (plugin.name,))
+                return False
+            try:
+                self._queue.put_nowait((plugin, func, args, kwargs, time.perf_counter()))
+            except queue.Full:
+                logger.warning('workers queue is full, rejecting plugin "%s"', plugin.name)
+                self.metrics.increment("plugin_rejected_total", (plugin.name,))
+                return False
+            self._in_flight[plugin.id] += 1
+        return True
+
+    def _work(self) -> None:
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            plugin, func, args, kwargs, queued = task
+            self.metrics.observe("plugin_queue_wait_seconds", (plugin.name,), time.perf_counter() - queued)
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception('unhandled error in plugin "%s"', plugin.name)
+            finally:
+                with self._lock:
+                    self._in_flight[plugin.id] -= 1
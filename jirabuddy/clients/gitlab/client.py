@@ -1,58 +1,76 @@
+from typing import Iterator, Optional
+
 import gitlab
 import gitlab.v4.objects
 
-from ...common.enum import to_enumable
+from .directory import Directory, DirectoryView, ProjectRecord, UserRecord
+from ...common import http
+from ...common.resilience import Resilience
+from ...common.iterables import IterUntil
 
 
 class GitLabClientWrapper(object):
-    def __init__(self, url: str, token: str, default_project=None):
-        self._client = gitlab.Gitlab(url, private_token=token)
+    def __init__(self, url: str, token: str, default_project=None, directory_refresh_interval: Optional[float] = 3600,
+                 resilience: Resilience = None):
+        self._client = gitlab.Gitlab(url, private_token=token, session=http.new_session("gitlab"))
+        self.resilience: Resilience = resilience or Resilience()
 
-        self._projects = None
-        self._users = None
-        self._usernames = None
+        self._projects = Directory(fetch_all=lambda: self.iter_projects(prefetch=True),
+                                   fetch_one=self._find_projects,
+                                   record=ProjectRecord,
+                                   keys=("name", "path_with_namespace"),
+                                   refresh_interval=directory_refresh_interval)
+        self._users = Directory(fetch_all=lambda: self.iter_users(prefetch=True),
+                                fetch_one=self._find_users,
+                                record=UserRecord,
+                                keys=("name", "username"),
+                                refresh_interval=directory_refresh_interval)
         self._project: [gitlab.v4.objects.projects.Project, None] = None
         self._merge_requests = None
 
         if default_project:
             self.project = default_project
 
+    def call(self, endpoint: str, func, *args, idempotent: bool = True, **kwargs):
+        """Call `func` (e.g. a method of `project`) with the client's retry policy and `endpoint`'s circuit breaker"""
+        return self.resilience.call("gitlab:%s" % endpoint, func, *args, idempotent=idempotent, **kwargs)
+
+    def _iter_pages(self, manager, page_size: int = 100, prefetch: bool = False, **filters) -> Iterator:
+        endpoint = "%s.list" % manager.path
+        return iter(IterUntil(lambda loop: self.call(endpoint, manager.list, page=loop + 1, per_page=page_size,
+                                                     **filters),
+                              page_size=page_size,
+                              prefetch=prefetch))
+
+    def iter_projects(self, page_size: int = 100, prefetch: bool = False, **filters) -> Iterator:
+        """Stream projects page by page, stopping early doesn't fetch the remaining pages"""
+        return self._iter_pages(self._client.projects, page_size, prefetch, **filters)
+
+    def iter_users(self, page_size: int = 100, prefetch: bool = False, **filters) -> Iterator:
+        """Stream users page by page, stopping early doesn't fetch the remaining pages"""
+        return self._iter_pages(self._client.users, page_size, prefetch, **filters)
+
+    def _find_projects(self, key: str, value: str) -> list:
+        if key == "path_with_namespace":
+            return [self.call("/projects.get", self._client.projects.get, value)]
+        return self.call("/projects.list", self._client.projects.list, search=value)
+
+    def _find_users(self, key: str, value: str) -> list:
+        if key == "username":
+            return self.call("/users.list", self._client.users.list, username=value)
+        return self.call("/users.list", self._client.users.list, search=value)
+
     @property
-    def projects(self):
-        if not self._projects:
-            self._projects = to_enumable(name="gitlabProjects",
-                                         key="_attrs.name",
-                                         value=None,
-                                         iterable=self._client.projects.list(all=True))
-        return self._projects
+    def projects(self) -> DirectoryView:
+        return self._projects.view("name")
 
     @property
-    def users(self):
-        if not self._users:
-            users_data = self._client.users.list(all=True)
-            self._users = to_enumable(name="gitlabUsers",
-                                      key="_attrs.name",
-                                      value=None,
-                                      iterable=users_data)
-            self._usernames = to_enumable(name="gitlabUsers",
-                                          key="_attrs.username",
-                                          value=None,
-                                          iterable=users_data)
-        return self._users
+    def users(self) -> DirectoryView:
+        return self._users.view("name")
 
     @property
-    def usernames(self):
-        if not self._usernames:
-            users_data = self._client.users.list(all=True)
-            self._usernames = to_enumable(name="gitlabUsers",
-                                          key="_attrs.username",
-                                          value=None,
-                                          iterable=users_data)
-            self._users = to_enumable(name="gitlabUsers",
-                                      key="_attrs.name",
-                                      value=None,
-                                      iterable=users_data)
-        return self._usernames
+    def usernames(self) -> DirectoryView:
+        return self._users.view("username")
 
     @property
     def project(self) -> gitlab.v4.objects.projects.Project:
@@ -63,8 +81,9 @@ class GitLabClientWrapper(object):
     @project.setter
     def project(self, project: [str, gitlab.v4.objects.projects.Project]):
         if isinstance(project, str):
-            if project in self.projects.enum_names:
-                project: gitlab.v4.objects.projects.Project = self.projects[project]
-            else:
+            record = self.projects.get(project) or self._projects.get("path_with_namespace", project)
+            if record is None:
                 raise RuntimeError("unknown project %s. known projects: %s", project, self.projects.enum_names)
+            project: gitlab.v4.objects.projects.Project = self.call("/projects.get", self._client.projects.get,
+                                                                    record.id)
         self._project = project
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from ...common.enum import to_valid_name
+
+logger = logging.getLogger(__name__)
+
+# seconds before a directory that failed to load is streamed again
+RETRY_SECONDS = 60
+
+
+class Record(object):
+    """Compact copy of the few attributes the bot needs from a GitLab object"""
+    __slots__ = ()
+
+    def __init__(self, attrs: Dict[str, Any]):
+        for slot in self.__slots__:
+            setattr(self, slot, attrs.get(slot))
+
+    @classmethod
+    def from_object(cls, obj) -> "Record":
+        return cls(obj if isinstance(obj, dict) else getattr(obj, "_attrs", obj.__dict__))
+
+    def __repr__(self):
+        return "<%s %s>" % (type(self).__name__, " ".join("%s=%r" % (s, getattr(self, s)) for s in self.__slots__))
+
+
+class UserRecord(Record):
+    __slots__ = ("id", "name", "username", "state", "web_url")
+
+
+class ProjectRecord(Record):
+    __slots__ = ("id", "name", "path_with_namespace", "default_branch", "web_url")
+
+
+class Directory(object):
+    """
+    Records of a GitLab collection indexed by some of their attributes.
+
+    The collection is streamed on a background thread on first use, records become visible as their page arrives
+    and the whole directory is re-streamed every `refresh_interval` seconds, or `RETRY_SECONDS` after a failed
+    load. A lookup that misses falls back to
+    `fetch_one(attribute, value)`, which should query GitLab for matching objects.
+    """
+
+    def __init__(self,
+                 fetch_all: Callable[[], Iterable],
+                 fetch_one: Callable[[str, str], Iterable],
+                 record: type,
+                 keys: Tuple[str, ...],
+                 refresh_interval: Optional[float] = 3600):
+        self._fetch_all = fetch_all
+        self._fetch_one = fetch_one
+        self._record = record
+        self._keys = keys
+        self.refresh_interval: Optional[float] = refresh_interval
+        self._indexes: Dict[str, Dict[str, Record]] = {key: {} for key in keys}
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._loader: Optional[threading.Thread] = None
+        self._loaded_at: Optional[float] = None
+        self._failed_at: Optional[float] = None
+
+    def _add(self, indexes: Dict[str, Dict[str, Record]], record: Record) -> None:
+        for key in self._keys:
+            value = getattr(record, key)
+            if isinstance(value, str):
+                indexes[key].setdefault(value, record)
+                indexes[key].setdefault(to_valid_name(value), record)
+
+    def _populate(self) -> None:
+        fresh = {key: {} for key in self._keys}
+        try:
+            for obj in self._fetch_all():
+                record = self._record.from_object(obj)
+                with self._lock:
+                    self._add(fresh, record)
+                    self._add(self._indexes, record)
+            with self._lock:
+                self._indexes = fresh
+            self._loaded_at = time.monotonic()
+            self._failed_at = None
+        except Exception:
+            logger.exception("failed to load %s directory, retrying in %ds", self._record.__name__, RETRY_SECONDS)
+            self._failed_at = time.monotonic()
+        finally:
+            self._loaded.set()
+
+    def load(self, wait: bool = False) -> None:
+        with self._lock:
+            # checked by liveness, a process forked while loading has no loader thread
+            if self._loader is None or not self._loader.is_alive():
+                self._loader = threading.Thread(target=self._populate, name="gitlab-directory", daemon=True)
+                self._loader.start()
+        if wait:
+            self._loaded.wait()
+
+    def _ensure_loaded(self) -> None:
+        if self._failed_at is not None:
+            if time.monotonic() - self._failed_at > RETRY_SECONDS:
+                self.load()
+        elif self._loaded_at is None:
+            if not self._loaded.is_set():
+                self.load()
+        elif self.refresh_interval and time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.load()
+
+    def get(self, key: str, value: str, default: Any = None) -> Any:
+        self._ensure_loaded()
+        record = self._indexes[key].get(value)
+        if record is not None:
+            return record
+
+        try:
+            for obj in self._fetch_one(key, value):
+                candidate = self._record.from_object(obj)
+                if getattr(candidate, key) in (value, to_valid_name(value)):
+                    with self._lock:
+                        self._add(self._indexes, candidate)
+                    return candidate
+        except Exception:
+            logger.exception("failed to look up %s %s=%s", self._record.__name__, key, value)
+        return default
+
+    def names(self, key: str) -> List[str]:
+        self._ensure_loaded()
+        self._loaded.wait()
+        return [name for name, record in self._indexes[key].items() if getattr(record, key) == name]
+
+    def view(self, key: str) -> "DirectoryView":
+        return DirectoryView(self, key)
+
+
+class DirectoryView(object):
+    """Read only mapping over a Directory index, keeping the enum interface (`enum_names`, `get`, `[]`)"""
+
+    def __init__(self, directory: Directory, key: str):
+        self._directory = directory
+        self._key = key
+
+    def get(self, value: str, default: Any = None) -> Any:
+        return self._directory.get(self._key, value, default)
+
+    def __getitem__(self, value: str) -> Record:
+        record = self.get(value)
+        if record is None:
+            raise KeyError(value)
+        return record
+
+    def __contains__(self, value: str) -> bool:
+        return self.get(value) is not None
+
+    @property
+    def enum_names(self) -> List[str]:
+        return self._directory.names(self._key)
+
+    def __iter__(self):
+        return iter(self.enum_names)
+
+    def __len__(self):
+        return len(self.enum_names)
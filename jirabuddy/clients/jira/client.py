@@ -1,68 +1,230 @@
-import random
-from typing import List, Optional, Union
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import List, Optional, Union, Dict, Callable, Tuple, Iterator
 
 import jira
 import logging
+from jira.resilientsession import ResilientSession
 
-from jira import JIRAError
-from time import sleep
-
+from .history import HISTORY_FIELDS, TicketHistory
+from .metadata import MetadataSnapshot, fetch_concurrently
 from .ticket import Ticket
 from .utils import ObliviousCookieJar
+from ...common import http
 from ...common.enum import to_enumable
+from ...common.iterables import IterUntil
+from ...common.resilience import Resilience
 
 DEV_STATUS_API_PATH = "{server}/rest/dev-status/latest/{path}"
-JIRA_SERVER_ERRORS_TO_RETRY = (500, 504)
+
+# metadata key -> raw json fetcher, "project" keys are fetched per current project
+METADATA_FETCHERS: Dict[str, Callable] = {
+    "issue_types": lambda client: [r.raw for r in client.issue_types()],
+    "priorities": lambda client: [r.raw for r in client.priorities()],
+    "projects": lambda client: [r.raw for r in client.projects()],
+    "fields": lambda client: jira.client.JIRA.fields(client),
+    "statuses": lambda client: [r.raw for r in client.statuses()],
+    "project_components": lambda client: [r.raw for r in client.project_components(client._current_project)],
+    "project_versions": lambda client: [r.raw for r in client.project_versions(client._current_project)],
+}
+PROJECT_METADATA = ("project_components", "project_versions")
+
+# enum attribute -> (metadata key, enum builder)
+METADATA_ENUMS: Dict[str, Tuple[str, Callable]] = {
+    "TicketTypes": ("issue_types", lambda data: to_enumable("TicketTypes", "name", "name", data)),
+    "Priorities": ("priorities", lambda data: to_enumable("Priority", "name", "name", data)),
+    "Projects": ("projects", lambda data: to_enumable("Projects", "name", "key", data)),
+    "FieldsByName": ("fields", lambda data: to_enumable("Fields", "name", "id", data)),
+    "FieldsByKey": ("fields", lambda data: to_enumable("Fields", "id", "name", data, clean_values=True)),
+    "Statuses": ("statuses", lambda data: to_enumable("Statuses", "name", "id", data)),
+    "Components": ("project_components", lambda data: to_enumable("Components", "name", "id", data)),
+    "FixVersions": ("project_versions", lambda data: to_enumable("FixVersions", "name", "name", data)),
+}
+
+
+class MetadataEnum(object):
+    """JiraClient attribute building its enum from the metadata snapshot on first access"""
+
+    def __init__(self, name: str):
+        self.name: str = name
+
+    def __get__(self, client, owner):
+        if client is None:
+            return self
+        return client.get_metadata_enum(self.name)
+
+    def __set__(self, client, value):
+        client._enums[self.name] = value
+
+
+class _Session(ResilientSession):
+    """ResilientSession not retrying on the threads running a call `Resilience` retries already"""
+
+    def __init__(self, timeout=None):
+        self._wrapped = threading.local()
+        super().__init__(timeout=timeout)
+
+    @property
+    def max_retries(self) -> int:
+        return 0 if getattr(self._wrapped, "active", False) else self._max_retries
+
+    @max_retries.setter
+    def max_retries(self, value: int) -> None:
+        self._max_retries = value
+
+    @contextmanager
+    def without_retries(self):
+        previous = getattr(self._wrapped, "active", False)
+        self._wrapped.active = True
+        try:
+            yield
+        finally:
+            self._wrapped.active = previous
 
 
 class JiraClient(jira.client.JIRA):
+    TicketTypes = MetadataEnum("TicketTypes")
+    Priorities = MetadataEnum("Priorities")
+    Projects = MetadataEnum("Projects")
+    FieldsByName = MetadataEnum("FieldsByName")
+    FieldsByKey = MetadataEnum("FieldsByKey")
+    Statuses = MetadataEnum("Statuses")
+    Components = MetadataEnum("Components")
+    FixVersions = MetadataEnum("FixVersions")
+
     def __init__(self, server: str, username: str, password: str, lazy: bool = False, *args, **kwargs):
         self._current_project: [str, None] = kwargs.pop("default_project", None)
+        self._enums: Dict[str, object] = {}
+        self._metadata_lock = threading.RLock()
+        self._metadata_refresher: Optional[threading.Thread] = None
+        self._metadata = MetadataSnapshot(server,
+                                          path=kwargs.pop("metadata_cache_path", None),
+                                          ttl=kwargs.pop("metadata_cache_ttl", None))
+        self.metadata_workers: int = kwargs.pop("metadata_workers", 8)
+        self.search_page_size: int = kwargs.pop("search_page_size", 100)
+        reuse_session_cookies: bool = kwargs.pop("reuse_session_cookies", False)
+        self.resilience: Resilience = kwargs.pop("resilience", None) or Resilience()
+        # seconds each metadata endpoint took on the last fetch
+        self.metadata_timings: Dict[str, float] = {}
         super().__init__(basic_auth=(username, password),
                          options={"server": server,
                                   "verify": kwargs.pop("ca_bundle", True)},
                          *args, **kwargs)
         self.server: str = server
-        self._session.cookies = ObliviousCookieJar()
+        if not reuse_session_cookies:
+            self._session.cookies = ObliviousCookieJar()
         self._current_user: str = username
         self._current_ticket: [Ticket, None] = None
-        self.TicketTypes = None
-        self.Priorities = None
-        self.Components = None
-        self.Projects = None
-        self.FixVersions = None
-        self.FieldsByKey = None
-        self.FieldsByName = None
-        self.Statuses = None
         self.EpicLinks = None
 
         if not lazy:
             self.load()
 
+    def _create_http_basic_session(self, username, password, timeout=None):
+        # as jira's, with a session that lets `_call` turn its retries off
+        self._session = _Session(timeout=timeout)
+        self._session.verify = self._options["verify"]
+        self._session.auth = (username, password)
+        self._session.cert = self._options["client_cert"]
+        http.mount(self._session, client="jira")
+
+    def _call(self, endpoint: str, func: Callable, *args, idempotent: bool = True, **kwargs):
+        """`resilience.call`, jira's session doesn't retry on its own meanwhile (other calls keep its retries)"""
+        def call(*call_args, **call_kwargs):
+            with self._session.without_retries():
+                return func(*call_args, **call_kwargs)
+
+        call.__name__ = getattr(func, "__name__", endpoint)
+        return self.resilience.call(endpoint, call, *args, idempotent=idempotent, **kwargs)
+
+    def _snapshot_key(self, key: str) -> Optional[str]:
+        if key in PROJECT_METADATA:
+            return "%s:%s" % (key, self._current_project) if self._current_project else None
+        return key
+
+    def _get_metadata(self, key: str) -> Optional[list]:
+        snapshot_key = self._snapshot_key(key)
+        if snapshot_key is None:
+            return None
+
+        with self._metadata_lock:
+            data = self._metadata.get(snapshot_key)
+            if data is None:
+                start = time.monotonic()
+                data = self._call("metadata:%s" % key, METADATA_FETCHERS[key], self)
+                self.metadata_timings[key] = time.monotonic() - start
+                self._metadata.update({snapshot_key: data})
+            elif not self._metadata.is_fresh(snapshot_key):
+                self._refresh_metadata_in_background()
+        return data
+
+    def _refresh_metadata_in_background(self) -> None:
+        # checked by liveness, a process forked while refreshing has no refresher thread
+        if self._metadata_refresher is not None and self._metadata_refresher.is_alive():
+            return
+        self._metadata_refresher = threading.Thread(target=self.refresh_metadata, name="jira-metadata-refresh",
+                                                    daemon=True)
+        self._metadata_refresher.start()
+
+    def _fetch_metadata(self, keys: List[str]) -> Dict[str, list]:
+        """Fetch metadata keys concurrently, storing whatever succeeded in the snapshot"""
+        snapshot_keys = {key: self._snapshot_key(key) for key in keys}
+        fetched, errors, timings = fetch_concurrently({key: partial(self._call, "metadata:%s" % key,
+                                                                          METADATA_FETCHERS[key], self)
+                                                                  for key in keys},
+                                                      max_workers=self.metadata_workers)
+        self.metadata_timings.update(timings)
+        for key, ex in errors.items():
+            logging.error("failed to fetch jira metadata %s: %s", key, ex)
+        if timings:
+            logging.info("fetched jira metadata: %s",
+                         ", ".join("%s=%.2fs" % kv for kv in sorted(timings.items(), key=lambda kv: -kv[1])))
+
+        with self._metadata_lock:
+            self._metadata.update({snapshot_keys[key]: data for key, data in fetched.items()})
+        return fetched
+
+    def refresh_metadata(self) -> None:
+        """Re-fetch every stale metadata key and rebuild the enums depending on them"""
+        stale_keys = set(self._metadata.stale_keys())
+        fetched = self._fetch_metadata([key for key in METADATA_FETCHERS if self._snapshot_key(key) in stale_keys])
+        with self._metadata_lock:
+            for name, (key, _) in METADATA_ENUMS.items():
+                if key in fetched:
+                    self._enums.pop(name, None)
+
+    def fields(self):
+        # JIRA.__init__ and both Fields enums share a single (snapshotted) fetch
+        return self._get_metadata("fields")
+
+    def get_metadata_enum(self, name: str):
+        key, build = METADATA_ENUMS[name]
+        if name not in self._enums:
+            data = self._get_metadata(key)
+            if data is None:
+                return None
+            self._enums[name] = build(data)
+        elif not self._metadata.is_fresh(self._snapshot_key(key)):
+            self._refresh_metadata_in_background()
+        return self._enums[name]
+
     def load(self):
-        if not self.TicketTypes:
-            self.TicketTypes = to_enumable("TicketTypes", "name", "name", self.issue_types())
-        if not self.Priorities:
-            self.Priorities = to_enumable("Priority", "name", "name", self.priorities())
-        if not self.Projects:
-            self.Projects = to_enumable("Projects", "name", "key", self.projects())
-        if not self.FieldsByName:
-            self.FieldsByName = to_enumable("Fields", "name", "id", self.fields())
-        if not self.FieldsByKey:
-            self.FieldsByKey = to_enumable("Fields", "id", "name", self.fields(), clean_values=True)
-        if not self.Statuses:
-            self.Statuses = to_enumable("Statuses", "name", "id", self.statuses())
-
-        if self._current_project:
-            if not self.Components:
-                self.Components = to_enumable("Components", "name", "id",
-                                              self.project_components(self._current_project))
-            if not self.FixVersions:
-                self.FixVersions = to_enumable("FixVersions", "name", "name",
-                                               self.project_versions(self._current_project))
+        keys = {key for key, _ in METADATA_ENUMS.values()}
+        missing = [key for key in METADATA_FETCHERS
+                   if key in keys and self._snapshot_key(key) and self._metadata.get(self._snapshot_key(key)) is None]
+        fetched = self._fetch_metadata(missing)
+
+        for name, (key, _) in METADATA_ENUMS.items():
+            # enums of endpoints that failed are left to load (and raise) on first access
+            if key not in missing or key in fetched:
+                self.get_metadata_enum(name)
 
     def set_project(self, project: str) -> None:
         self._current_project = project
+        self._enums.pop("Components", None)
+        self._enums.pop("FixVersions", None)
 
     def set_ticket(self, key: str, **kwargs) -> None:
         self._current_ticket = Ticket(client=self, key=key, **kwargs)
@@ -72,22 +234,60 @@ class JiraClient(jira.client.JIRA):
             key = key.split(r"/")[-1]
             if "|" in key:
                 key = key.split("|")[0]
-        return Ticket(client=self, key=key, **kwargs) if key else self._current_ticket
+        return self._call("get_ticket", Ticket, client=self, key=key, **kwargs) if key else self._current_ticket
 
-    def search_tickets(self, jql: str, fields=None, *args, **kwargs):
-        try:
-            jira_issues = self.search_issues(jql, fields=fields, *args, **kwargs)
-        except JIRAError as e:
-            if e.status_code in JIRA_SERVER_ERRORS_TO_RETRY:  # Jira sometimes returns internal server error, retry once if so
-                logging.error('Retrying: %s' % e.__str__())
-                sleep(random.randint(1, 5))
-                jira_issues = self.search_issues(jql, fields=fields, *args, **kwargs)  # raise if 500 returned again
+    def _search_page(self, jql: str, start: int, page_size: int, fields=None, **kwargs):
+        # Jira sometimes returns internal server errors, resilience retries those with backoff
+        return self._call("search", self.search_issues, jql, startAt=start, maxResults=page_size,
+                                    fields=fields, **kwargs)
+
+    def search_tickets(self, jql: str, fields=None, page_size: int = None, prefetch: bool = False, raw: bool = False,
+                       **kwargs) -> Iterator[Union[Ticket, dict]]:
+        """
+        Lazily page through the tickets matching `jql`, a page is only fetched once the previous one was consumed.
+
+        :param page_size: tickets per request, defaults to the client's `search_page_size`
+        :param prefetch: fetch the next page in the background while the current one is consumed
+        :param raw: yield the issues' json instead of Tickets, much cheaper for bulk processing
+        :param kwargs: passed to `search_issues`, `startAt` and `maxResults` bound the results as they do there
+        """
+        page_size = page_size or self.search_page_size
+        first = kwargs.pop("startAt", 0)
+        limit = kwargs.pop("maxResults", None)
+        end = None if limit is None else first + limit
+        # the server may return fewer issues than asked for (it caps maxResults), pages start where the last one
+        # ended and the search ends on the total it reports. Pages are fetched one after the other, prefetched too
+        start, total = [first], [None]
+
+        def fetch_page(loop: int) -> list:
+            size = page_size if end is None else min(page_size, end - start[0])
+            if size <= 0:
+                return []
+            if raw:
+                page = self._search_page(jql, start[0], size, fields=fields, json_result=True, **kwargs)
+                total[0], issues = page["total"], page["issues"]
             else:
-                raise
-        return [self.get_ticket(issue.key, fields=fields) for issue in jira_issues]
+                page = self._search_page(jql, start[0], size, fields=fields, **kwargs)
+                total[0], issues = page.total, [Ticket(client=self, raw=issue.raw) for issue in page]
+            start[0] += len(issues)
+            return issues
+
+        def last_page(page: list) -> bool:
+            return start[0] >= total[0] or (end is not None and start[0] >= end)
+
+        return iter(IterUntil(fetch_page, page_size=page_size, prefetch=prefetch, last_page=last_page))
+
+    def get_history(self, jql: str, include_comments: bool = False, page_size: int = None,
+                    prefetch: bool = True) -> TicketHistory:
+        """Change history of all the tickets matching `jql`, their changelogs are fetched with the search pages"""
+        fields = HISTORY_FIELDS + ["comment"] if include_comments else HISTORY_FIELDS
+        issues = self.search_tickets(jql, fields=fields, page_size=page_size, prefetch=prefetch, raw=True,
+                                     expand="changelog")
+        return TicketHistory.from_issues(issues, include_comments=include_comments)
 
     def comment(self, message: str, ticket_key: str = None) -> None:
-        self.get_ticket(key=ticket_key).comment(message)
+        ticket = self.get_ticket(key=ticket_key)
+        self._call("comment", ticket.comment, message, idempotent=False)
 
     def create_ticket(self,
                       summary: str,
@@ -125,5 +325,5 @@ class JiraClient(jira.client.JIRA):
             fields_kwargs["components"] = [{"id": cm} for cm in components]
 
         fields_kwargs.update(kwargs)
-        issue = self.create_issue(**fields_kwargs)
-        return self.get_ticket(issue.key)
+        issue = self._call("create_ticket", self.create_issue, idempotent=False, **fields_kwargs)
+        return Ticket(client=self, raw=issue.raw)
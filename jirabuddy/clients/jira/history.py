@@ -0,0 +1,166 @@
+from typing import Iterable, Optional, Sequence
+
+import pandas as pd
+from pandas import DataFrame, Series
+
+JIRA_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
+HISTORY_COLUMNS = ["key", "time", "user", "field", "from", "to", "from_string", "to_string"]
+TICKET_COLUMNS = ["key", "created", "resolved", "status", "assignee"]
+# fields a search has to return for TicketHistory's aggregations
+HISTORY_FIELDS = ["created", "resolutiondate", "status", "assignee"]
+
+DEFAULT_START_STATUSES = ("In Progress",)
+DEFAULT_DONE_STATUSES = ("Done", "Closed", "Resolved")
+
+
+def to_datetime(values) -> Series:
+    """Parse Jira timestamps (e.g. 2021-01-05T12:00:00.000+0200) in one pass, as UTC"""
+    return pd.to_datetime(Series(values, dtype=object), format=JIRA_TIME_FORMAT, utc=True)
+
+
+def _user(user: Optional[dict]) -> Optional[str]:
+    if not user:
+        return None
+    return user.get("key") or user.get("name") or user.get("accountId")
+
+
+def history_frame(issues: Iterable[dict], include_comments: bool = False) -> DataFrame:
+    """
+    One row per changed field (and comment) of the `issues` json, fetched with `expand=changelog`, sorted by
+    ticket and time.
+
+    "from"/"to" are the raw values (ids, usernames) when Jira has them, "from_string"/"to_string" the displayed ones.
+    """
+    columns = {column: [] for column in HISTORY_COLUMNS}
+    key, time, user, field = columns["key"], columns["time"], columns["user"], columns["field"]
+    from_, to, from_string, to_string = columns["from"], columns["to"], columns["from_string"], columns["to_string"]
+    for issue in issues:
+        issue_key = issue["key"]
+        for history in (issue.get("changelog") or {}).get("histories", ()):
+            author = _user(history.get("author"))
+            for item in history["items"]:
+                key.append(issue_key)
+                time.append(history["created"])
+                user.append(author)
+                field.append(item["field"])
+                from_.append(item.get("from") or item.get("fromString"))
+                to.append(item.get("to") or item.get("toString"))
+                from_string.append(item.get("fromString"))
+                to_string.append(item.get("toString"))
+        if include_comments:
+            for comment in ((issue.get("fields") or {}).get("comment") or {}).get("comments", ()):
+                key.append(issue_key)
+                time.append(comment["created"])
+                user.append(_user(comment.get("author")))
+                field.append("comment")
+                from_.append("")
+                to.append(comment["body"])
+                from_string.append("")
+                to_string.append(comment["body"])
+
+    frame = DataFrame(columns)
+    frame["time"] = to_datetime(frame["time"])
+    frame["key"] = frame["key"].astype("category")
+    frame["field"] = frame["field"].astype("category")
+    return frame.sort_values(["key", "time"], kind="mergesort").reset_index(drop=True)
+
+
+def tickets_frame(issues: Iterable[dict]) -> DataFrame:
+    """key, created, resolved, status (name) and assignee of the `issues` json, indexed by key"""
+    columns = {column: [] for column in TICKET_COLUMNS}
+    for issue in issues:
+        fields = issue.get("fields") or {}
+        columns["key"].append(issue["key"])
+        columns["created"].append(fields.get("created"))
+        columns["resolved"].append(fields.get("resolutiondate"))
+        columns["status"].append((fields.get("status") or {}).get("name"))
+        columns["assignee"].append(_user(fields.get("assignee")))
+
+    frame = DataFrame(columns)
+    frame["created"] = to_datetime(frame["created"])
+    frame["resolved"] = to_datetime(frame["resolved"])
+    return frame.set_index("key")
+
+
+class TicketHistory(object):
+    """
+    Change history of many tickets as columnar frames, with the aggregations sprint reports need.
+
+    `changes` is a `history_frame` and `tickets` a `tickets_frame`, build both from the same issues json
+    (see `from_issues` and `JiraClient.get_history`).
+    """
+
+    def __init__(self, changes: DataFrame, tickets: DataFrame):
+        self.changes: DataFrame = changes
+        self.tickets: DataFrame = tickets
+
+    @classmethod
+    def from_issues(cls, issues: Iterable[dict], include_comments: bool = False) -> "TicketHistory":
+        issues = list(issues)
+        return cls(history_frame(issues, include_comments=include_comments), tickets_frame(issues))
+
+    def field_changes(self, field: str) -> DataFrame:
+        return self.changes[self.changes["field"] == field]
+
+    def status_intervals(self, until: Optional[pd.Timestamp] = None) -> DataFrame:
+        """
+        key, status, start and end of every period a ticket spent in a status, the current one ends at `until`
+        (defaults to now).
+        """
+        until = pd.Timestamp.now(tz="UTC") if until is None else pd.Timestamp(until)
+        if until.tzinfo is None:
+            until = until.tz_localize("UTC")
+        created = self.tickets["created"]
+        if self.tickets.empty:
+            return DataFrame({"key": Series(dtype=object),
+                              "status": Series(dtype=object),
+                              "start": Series(dtype=created.dtype),
+                              "end": Series(dtype=created.dtype)})
+        changes = self.field_changes("status")
+        keys = changes["key"].astype(object)
+
+        # periods that ended with a status change, the first one started when the ticket was created
+        previous = changes["time"].groupby(keys, sort=False).shift()
+        first = Series(created.reindex(keys.array).array, index=keys.index)
+        ended = DataFrame({"key": keys,
+                           "status": changes["from_string"],
+                           "start": previous.where(previous.notna(), first),
+                           "end": changes["time"]})
+
+        # the current period, since the last change or creation for tickets that never changed status
+        last = changes.groupby(keys, sort=False).tail(1)
+        last_change = Series(last["time"].array, index=last["key"].astype(object).array)
+        current = DataFrame({"status": self.tickets["status"],
+                             "start": last_change.reindex(self.tickets.index).fillna(created),
+                             "end": until})
+        current = current.rename_axis("key").reset_index()
+
+        return pd.concat([ended, current], ignore_index=True)
+
+    def time_in_status(self, until: Optional[pd.Timestamp] = None) -> DataFrame:
+        """Total time each ticket (rows) spent in each status (columns)"""
+        intervals = self.status_intervals(until)
+        durations = intervals["end"] - intervals["start"]
+        frame = durations.groupby([intervals["key"], intervals["status"]]).sum().unstack(fill_value=pd.Timedelta(0))
+        return frame.reindex(self.tickets.index, fill_value=pd.Timedelta(0))
+
+    def cycle_time(self,
+                   start_statuses: Sequence[str] = DEFAULT_START_STATUSES,
+                   done_statuses: Sequence[str] = DEFAULT_DONE_STATUSES) -> Series:
+        """
+        Time from first entering one of `start_statuses` to last entering one of `done_statuses`, per ticket.
+        NaT for tickets that didn't get through both.
+        """
+        changes = self.field_changes("status")
+        keys = changes["key"].astype(object)
+        started = changes["time"][changes["to_string"].isin(start_statuses)].groupby(keys).min()
+        done = changes["time"][changes["to_string"].isin(done_statuses)].groupby(keys).max()
+        cycle = (done - started.reindex(done.index)).reindex(self.tickets.index)
+        return cycle.where(cycle >= pd.Timedelta(0)).rename("cycle_time")
+
+    def reassignment_counts(self) -> Series:
+        """Times each ticket's assignee was changed from someone to someone else (or nobody)"""
+        changes = self.field_changes("assignee")
+        reassigned = changes[changes["from"].notna()]
+        counts = reassigned["key"].astype(object).value_counts()
+        return counts.reindex(self.tickets.index, fill_value=0).rename("reassignments")
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METADATA_VERSION = 1
+
+
+class MetadataSnapshot(object):
+    """
+    Versioned snapshot of the raw JIRA metadata (issue types, fields, ...) JiraClient builds its enums from.
+
+    Every key is stored with the time it was fetched, and is considered stale `ttl` seconds later.
+    When `path` is given the snapshot is persisted there as json, written atomically on every update,
+    so a restarted bot can build its enums without hitting the server.
+    """
+
+    def __init__(self, server: str, path: Optional[str] = None, ttl: Optional[float] = None):
+        self.server: str = server
+        self.path: Optional[str] = path
+        self.ttl: Optional[float] = ttl
+        self._keys: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                snapshot = json.load(f)
+        except Exception:
+            logger.exception("failed to read jira metadata snapshot %s", self.path)
+            return
+
+        if snapshot.get("version") != METADATA_VERSION or snapshot.get("server") != self.server:
+            logger.info("ignoring jira metadata snapshot %s, it doesn't match this client", self.path)
+            return
+        self._keys = snapshot.get("keys", {})
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        snapshot = {"version": METADATA_VERSION, "server": self.server, "keys": self._keys}
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            logger.exception("failed to write jira metadata snapshot %s", self.path)
+
+    def get(self, key: str) -> Optional[List]:
+        entry = self._keys.get(key)
+        return entry["data"] if entry else None
+
+    def is_fresh(self, key: str) -> bool:
+        entry = self._keys.get(key)
+        if not entry:
+            return False
+        return self.ttl is None or time.time() - entry["fetched_at"] <= self.ttl
+
+    def stale_keys(self) -> List[str]:
+        return [key for key in self._keys if not self.is_fresh(key)]
+
+    def update(self, data: Dict[str, List]) -> None:
+        with self._lock:
+            now = time.time()
+            for key, value in data.items():
+                self._keys[key] = {"fetched_at": now, "data": value}
+            self._save()
+
+
+def fetch_concurrently(fetchers: Dict[str, Callable[[], Any]],
+                       max_workers: int = 8) -> Tuple[Dict[str, Any], Dict[str, Exception], Dict[str, float]]:
+    """
+    Run independent metadata fetchers with at most `max_workers` in flight.
+
+    A failing fetcher doesn't affect the others.
+    :return: (results, errors, seconds each fetcher took) keyed like `fetchers`
+    """
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+    timings: Dict[str, float] = {}
+
+    def timed(key: str):
+        start = time.monotonic()
+        try:
+            results[key] = fetchers[key]()
+        except Exception as ex:
+            errors[key] = ex
+        finally:
+            timings[key] = time.monotonic() - start
+
+    if fetchers:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(fetchers))),
+                                thread_name_prefix="jira-metadata") as executor:
+            list(executor.map(timed, fetchers))
+    return results, errors, timings
@@ -3,14 +3,18 @@ from typing import List
 from jira import Comment, Issue
 from pandas import DataFrame
 
-from .utils import jira_time_format
-from ...common.enum import enum
+from .history import history_frame
+from ...common.enum import FrozenEnum
 
 
 class Ticket(Issue):
-    def __init__(self, client, key: str = None, **kwargs):
-        super(Ticket, self).__init__(client._options, client._session)
-        self.find(key, params=kwargs)
+    def __init__(self, client, key: str = None, raw: dict = None, **kwargs):
+        """
+        :param raw: an already fetched issue payload (e.g. from a search), saves fetching `key` again
+        """
+        super(Ticket, self).__init__(client._options, client._session, raw=raw)
+        if raw is None:
+            self.find(key, params=kwargs)
         self.client = client
         self.key = self.raw['key']
         self.link = f"{self.client.server}/browse/{self.key}"
@@ -22,20 +26,14 @@ class Ticket(Issue):
         return self.client.comments(self.key)
 
     def get_history_dataframe(self, include_comments: bool = True) -> DataFrame:
-        self.find(self, {"expand": "changelog"})
-        hst = []
-        for change_log in self.changelog.histories:
-            for cl in change_log.items:
-                hst.append((jira_time_format(change_log.created), change_log.author.key, cl.field,
-                            cl.__dict__["from"] or cl.fromString, cl.to or cl.toString))
+        self.find(self.key, params={"expand": "changelog"})
+        raw = self.raw
         if include_comments:
-            for c in self.get_comments():
-                hst.append((jira_time_format(c.created), c.author.key, "comment", "", c.body))
-        return DataFrame(hst if hst else None, columns=["time", "user", "field", "from", "to"]).sort("time")
+            raw = dict(raw, fields={"comment": {"comments": [c.raw for c in self.get_comments()]}})
+        return history_frame([raw], include_comments=include_comments)
 
     @property
     def f(self):
-        super_dict = self.fields.__dict__
-        super_fields = {self.client.FieldsByKey.__dict__.get(key, key): value for key, value in super_dict.items() if
-                        not key.startswith("__")}
-        return enum("TicketFields", **super_fields)
+        fields_by_key = self.client.FieldsByKey
+        return FrozenEnum("TicketFields", ((fields_by_key.get(key, key), value)
+                                           for key, value in self.fields.__dict__.items() if not key.startswith("__")))
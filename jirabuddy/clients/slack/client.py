@@ -1,41 +1,123 @@
+import re
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
 import requests
-from slacker import Slacker
+from slacker import Error, Response, Slacker
+
+from ...common import http
+from ...common.multipart import MultipartStream, Source
 
 upload_file_api = 'https://slack.com/api/files.upload'
 
+CHANNEL_ID = re.compile(r'^[CGD][A-Z0-9]{6,}$')
+CHANNEL_TYPES = 'public_channel,private_channel'
+
+
+def stream_upload(token: str, name: str, source: Source, fields: dict, filename: str = None, compress: bool = False,
+                  session: requests.Session = None) -> Response:
+    """
+    files.upload with the `name` part (`file` or `content`) streamed from `source` (readable, bytes/str or an
+    iterable of chunks), optionally gzipped on the fly
+    """
+    stream = MultipartStream(dict(fields, token=token), name, source, filename=filename, compress=compress)
+    response = (session or http.shared_session()).post(upload_file_api, data=stream.body(),
+                                                       headers={'Content-Type': stream.content_type})
+    response.raise_for_status()
+    response = Response(response.text)
+    if not response.successful:
+        raise Error(response.error)
+    return response
+
 
 class SlackClient(Slacker):
-    def __init__(self, default_channel: str, alerts_channel: str, user_name: str, token: str):
+    def __init__(self, default_channel: str, alerts_channel: str, user_name: str, token: str,
+                 channels_ttl: float = 600, channels_page_size: int = 200, channels_min_refresh: float = 30):
+        """
+        :param channels_ttl: seconds the channel directory is used before it is listed again
+        :param channels_min_refresh: minimal seconds between listings triggered by unknown channel names
+        """
         self.default_channel = default_channel
         self.alerts_channel = alerts_channel
         self.username = user_name
         self.token = token
-        super().__init__(self.token)
+        self.channels_ttl: float = channels_ttl
+        self.channels_page_size: int = channels_page_size
+        self.channels_min_refresh: float = channels_min_refresh
+        self._channels_by_name: Dict[str, str] = {}
+        self._channels_listed_at: Optional[float] = None
+        self._channels_lock = threading.Lock()
+        super().__init__(self.token, session=http.new_session("slack"))
+
+    def iter_channels(self) -> Iterator[dict]:
+        """Stream the workspace's channels, following conversations.list cursors"""
+        cursor = None
+        while True:
+            body = self.conversations.list(cursor=cursor, exclude_archived=True, types=CHANNEL_TYPES,
+                                           limit=self.channels_page_size).body
+            yield from body['channels']
+            cursor = (body.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                return
+
+    def refresh_channels(self) -> Dict[str, str]:
+        with self._channels_lock:
+            self._channels_by_name = {c['name']: c['id'] for c in self.iter_channels()}
+            self._channels_listed_at = time.monotonic()
+            return self._channels_by_name
+
+    def channels_by_name(self, refresh: bool = False) -> Dict[str, str]:
+        listed_at = self._channels_listed_at
+        if refresh or listed_at is None or time.monotonic() - listed_at > self.channels_ttl:
+            return self.refresh_channels()
+        return self._channels_by_name
 
-    def channels_by_name(self):
-        return {c['name']: c['id'] for c in self.channels.list().body['channels']}
+    def channel_id(self, channel: str) -> Optional[str]:
+        """Id of a channel given by id, name or #name, the directory is listed again (at most every
+        `channels_min_refresh` seconds) when the name isn't known"""
+        if CHANNEL_ID.match(channel):
+            return channel
+        name = channel[1:] if channel[0] in ['@', '#'] else channel
+        channel_id = self.channels_by_name().get(name)
+        if channel_id is None and time.monotonic() - self._channels_listed_at > self.channels_min_refresh:
+            channel_id = self.channels_by_name(refresh=True).get(name)
+        return channel_id
 
     @property
     def default_channel_id(self):
-        return self.channels_by_name()[self.default_channel[1:]]
+        channel_id = self.channel_id(self.default_channel)
+        if channel_id is None:
+            raise KeyError(self.default_channel)
+        return channel_id
 
     @property
     def alerts_channel_id(self):
-        return self.channels_by_name()[self.alerts_channel[1:]]
+        channel_id = self.channel_id(self.alerts_channel)
+        if channel_id is None:
+            raise KeyError(self.alerts_channel)
+        return channel_id
 
     def send_to_slack(self, response, channel_id=None, channel=None):
-        channel_id = channel_id or channel or self.default_channel_id
+        if not channel_id and channel:
+            # unknown names (e.g. @user) are left for slack to resolve
+            channel_id = channel if channel[0] == '@' else self.channel_id(channel) or channel
+        channel_id = channel_id or self.default_channel_id
         return self.chat.post_message(channel_id, response, self.username, True)
 
-    def post_file_to_slack(self, descriptor, filename='file', channel_id=None, channel=None, filetype='png', read=True):
-        if channel:
-            channel = channel[1:] if channel[0] in ['@', '#'] else channel
-        channel_id = channel_id or self.channels_by_name().get(channel, None) or self.default_channel_id
-        payload = {'channels': channel_id, 'token': self.token, 'filename': filename, 'filetype': filetype}
-        if read:
-            descriptor = descriptor.read()
-        return requests.post(upload_file_api, data=payload, files={'file': descriptor})
+    def post_file_to_slack(self, descriptor, filename='file', channel_id=None, channel=None, filetype='png', read=True,
+                           compress=False):
+        """
+        :param descriptor: readable object, bytes or an iterable of chunks, streamed (`read` is kept for compatibility)
+        :param compress: gzip the file while uploading it
+        """
+        channel_id = channel_id or (channel and self.channel_id(channel)) or self.default_channel_id
+        fields = {'channels': channel_id, 'filename': filename, 'filetype': 'gzip' if compress else filetype}
+        return stream_upload(self.token, 'file', descriptor, fields, filename=filename, compress=compress)
 
     def post_snippet_to_slack(self, content, channel_id=None, channel=None, title=None):
-        channel_id = channel_id or channel or self.default_channel_id
-        return self.files.post('files.upload', data={'content': content, 'channels': channel_id, 'title': title})
+        """:param content: text, or an iterable of text chunks streamed to slack"""
+        if not channel_id and channel:
+            channel_id = channel if channel[0] == '@' else self.channel_id(channel) or channel
+        channel_id = channel_id or self.default_channel_id
+        return stream_upload(self.token, 'content', content, {'channels': channel_id, 'title': title})
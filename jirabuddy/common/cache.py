@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    Thread safe LRU mapping whose entries also expire `ttl` seconds after they were set.
+
+    :param max_size: maximal number of entries, least recently used are evicted first (0 for unbounded)
+    :param ttl: seconds an entry is valid for (None never expires)
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size: int = max_size
+        self.ttl: Optional[float] = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, set_time: float, now: float) -> bool:
+        return self.ttl is not None and now - set_time > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            set_time, value = entry
+            if self._expired(set_time, time.monotonic()):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while self.max_size and len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        if entry is _MISSING or self._expired(entry[0], time.monotonic()):
+            return default
+        return entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [key for key, (set_time, _) in self._data.items() if not self._expired(set_time, now)]
+
+    def __getstate__(self):
+        # monotonic times are meaningless in another process, keep the entries' wall clock set time instead
+        now, wall_now = time.monotonic(), time.time()
+        with self._lock:
+            entries = [(key, wall_now - (now - set_time), value) for key, (set_time, value) in self._data.items()]
+        return {"max_size": self.max_size, "ttl": self.ttl, "entries": entries}
+
+    def __setstate__(self, state):
+        self.__init__(max_size=state["max_size"], ttl=state["ttl"])
+        now, wall_now = time.monotonic(), time.time()
+        for key, wall_set_time, value in state["entries"]:
+            self._data[key] = (now - (wall_now - wall_set_time), value)
@@ -4,13 +4,17 @@ import operator
 
 from collections import OrderedDict
 from functools import reduce
-from typing import Any, Dict, Tuple, List
+from typing import Any, Dict, Tuple, List, Iterable, Iterator, Optional
 
 
 def get_path_from_dict(dct: dict, path: str, delimiter: str = ".") -> Any:
     return reduce(operator.getitem, path.split(delimiter), dct)
 
 
+_INVALID_CHARS = re.compile('[^0-9a-zA-Z_]')
+_INVALID_START = re.compile('^([^a-zA-Z_]+)')
+
+
 def to_valid_name(s: str):
     """
     :param s: any string
@@ -19,7 +23,10 @@ def to_valid_name(s: str):
     # Remove leading characters until we find a letter or underscore
     http://stackoverflow.com/questions/3303312/how-do-i-convert-a-string-to-a-valid-variable-name-in-python
     """
-    return re.sub('^([^a-zA-Z_]+)', '_\\1', re.sub('[^0-9a-zA-Z_]', '_', s.strip()))
+    # str.isascii is python 3.7+
+    if s.isidentifier() and all(ord(c) < 128 for c in s):
+        return s
+    return _INVALID_START.sub('_\\1', _INVALID_CHARS.sub('_', s.strip()))
 
 
 class TypeWrapper(type):
@@ -40,6 +47,99 @@ class TypeWrapper(type):
         return self.__name__
 
 
+_MISSING = object()
+
+
+class FrozenEnum(object):
+    """
+    Immutable name -> value mapping with the interface of `enum` classes (`enum_names`, `get`, `[]`, attributes).
+
+    Names are cleaned with `to_valid_name`. Lookups fall back to the cleaned, case folded form of the requested name,
+    and `reverse(value)` finds the name of a (hashable) value. Built in one pass, without copying the values.
+    """
+    __slots__ = ("__name__", "_values", "_folded", "_reverse")
+
+    def __init__(self, name: str, items: Iterable[Tuple[str, Any]]):
+        values = {}
+        folded = {}
+        for key, value in items:
+            key = to_valid_name(key)
+            values[key] = value
+            folded.setdefault(key.casefold(), value)
+        object.__setattr__(self, "__name__", name)
+        object.__setattr__(self, "_values", values)
+        object.__setattr__(self, "_folded", folded)
+        object.__setattr__(self, "_reverse", None)
+
+    @property
+    def enum_names(self) -> Tuple[str, ...]:
+        return tuple(self._values)
+
+    @property
+    def enum_values(self) -> Tuple[Any, ...]:
+        return tuple(self._values.values())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._values.get(key, _MISSING)
+        if value is _MISSING and isinstance(key, str):
+            value = self._folded.get(to_valid_name(key).casefold(), _MISSING)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __getattr__(self, key: str) -> Any:
+        # slots that aren't set yet (copy/pickle build instances without __init__) and dunders copy/pickle probe for
+        # must not fall through to `_values`, which would recurse
+        if key in FrozenEnum.__slots__ or (key.startswith("__") and key.endswith("__")):
+            raise AttributeError(key)
+        try:
+            return self._values[key]
+        except KeyError:
+            raise AttributeError("%s has no member %s" % (self.__name__, key))
+
+    def __setattr__(self, key: str, value: Any):
+        raise AttributeError("%s is immutable" % self.__name__)
+
+    def __reduce__(self):
+        return type(self), (self.__name__, list(self._values.items()))
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def items(self):
+        return self._values.items()
+
+    def reverse(self, value: Any) -> Optional[str]:
+        if self._reverse is None:
+            reverse = {}
+            for key, val in self._values.items():
+                try:
+                    reverse.setdefault(val, key)
+                except TypeError:
+                    pass
+            object.__setattr__(self, "_reverse", reverse)
+        try:
+            return self._reverse.get(value)
+        except TypeError:
+            return None
+
+    def __str__(self):
+        return self.__name__
+
+    def __repr__(self):
+        return "<%s %s (%d members)>" % (type(self).__name__, self.__name__, len(self._values))
+
+
 def enum(enum_type: str, reverse_mapping: bool = False, nest: bool = False,
          clean_variables: bool = False, save_original: bool = True,
          *sequential, **named):
@@ -70,15 +170,21 @@ def enum(enum_type: str, reverse_mapping: bool = False, nest: bool = False,
 
 
 def to_enumable(name: str, key: str, value: Any, iterable: (List, Tuple, Dict, OrderedDict), clean_values: bool = False,
-                reverse_mapping: bool = False, nest: bool = False):
-    iterable_dict = [item.__dict__ if not isinstance(item, (dict, OrderedDict)) else item for item in iterable]
-    tuples = []
-    for idx, i in enumerate(iterable_dict):
-        k = get_path_from_dict(i, key)
-        if value is None:
-            v = iterable[idx]
-        else:
-            v = get_path_from_dict(i, value)
-            v = to_valid_name(v) if clean_values else v
-        tuples.append((k, v))
-    return enum(name, clean_variables=True, reverse_mapping=reverse_mapping, nest=nest, **dict(tuples))
+                reverse_mapping: bool = False, nest: bool = False) -> FrozenEnum:
+    """
+    Index `iterable` by the `key` path of its items, mapping to their `value` path (the items themselves if None).
+    Reverse lookups are always available through `FrozenEnum.reverse`, `reverse_mapping` is kept for compatibility.
+    """
+    def pairs():
+        for item in iterable:
+            item_dict = item if isinstance(item, (dict, OrderedDict)) else item.__dict__
+            if value is None:
+                v = item
+            else:
+                v = get_path_from_dict(item_dict, value)
+                v = to_valid_name(v) if clean_values else v
+            if nest and isinstance(v, (dict, OrderedDict)):
+                v = FrozenEnum(str(get_path_from_dict(item_dict, key)), v.items())
+            yield get_path_from_dict(item_dict, key), v
+
+    return FrozenEnum(name, pairs())
@@ -1,14 +1,28 @@
+import threading
 from shlex import shlex
-from typing import List, Dict, Any, Optional, Callable, Tuple
+from typing import List, Dict, Any, Optional, Callable, Tuple, Set, Union
 
-from jirabuddy.common.enum import TypeWrapper
+from jirabuddy.common.cache import TTLCache
+from jirabuddy.common.enum import FrozenEnum, TypeWrapper
+
+# markers for a resolver call that raised LookupError (a miss, cached like None) or another error (not cached)
+_MISSED = object()
+_FAILED = object()
 
 
 class FreeTextParser(object):
-    def __init__(self, case_sensitive=False):
+    def __init__(self, case_sensitive=False, cache_size: int = 4096, cache_ttl: Optional[float] = 300):
         self.case_sensitive = case_sensitive
         self._store: Dict[str, Callable] = {}
+        self._batch_store: Dict[str, Callable[[List[str]], Dict[str, Any]]] = {}
+        # enum resolver name -> (function returning the enum, (enum, its case folded index))
+        self._enums: Dict[str, Tuple[Callable, Optional[Tuple[Any, Dict[str, Any]]]]] = {}
         self._ignored_terms: List[str] = []
+        self._ignored: Set[str] = set()
+        self._cache: TTLCache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        # (resolver name, phrase) -> set once the lookup running on another thread is over
+        self._inflight: Dict[Tuple[str, str], threading.Event] = {}
+        self._inflight_lock = threading.Lock()
         self.priorities: List[str] = []
 
     @staticmethod
@@ -32,49 +46,162 @@ class FreeTextParser(object):
 
         return _cases
 
-    def register(self, name: str, func: Callable, priority: Optional[int] = None):
+    def _fold(self, text: str) -> str:
+        return text if self.case_sensitive else text.casefold()
+
+    def _register(self, name: str, func: Callable, priority: Optional[int]):
         self._store[name] = func
+        self._batch_store.pop(name, None)
+        self._enums.pop(name, None)
+        self._cache.clear()
+        if name in self.priorities:
+            self.priorities.remove(name)
         if priority is None:
             self.priorities.append(name)
         else:
             self.priorities.insert(priority, name)
 
-    def register_enum(self, enum: TypeWrapper, priority: Optional[int] = None) -> None:
-        self.register(enum.__name__, enum.__getitem__, priority)
+    def register(self, name: str, func: Callable, priority: Optional[int] = None):
+        self._register(name, func, priority)
+
+    def register_batch(self, name: str, func: Callable[[List[str]], Dict[str, Any]],
+                       priority: Optional[int] = None) -> None:
+        """
+        Register a resolver taking all of a message's phrases at once, returning {phrase: result} for the found ones
+        """
+        self._register(name, lambda phrase: func([phrase]).get(phrase), priority)
+        self._batch_store[name] = func
+
+    def register_enum(self, enum: Union[FrozenEnum, TypeWrapper, Callable], priority: Optional[int] = None,
+                      name: Optional[str] = None) -> None:
+        """
+        Resolve phrases by a case folded index of the enum's names. `enum` may be a function returning the current
+        enum (e.g. a JiraClient's metadata, replaced when refreshed), the index is rebuilt whenever it changes.
+        """
+        source = enum if callable(enum) and not isinstance(enum, (FrozenEnum, TypeWrapper)) else lambda: enum
+        name = name or enum.__name__
+        self._register(name, lambda phrase: source()[phrase], priority)
+        self._enums[name] = (source, None)
+
+    def _index(self, name: str) -> Optional[Dict[str, Any]]:
+        """Case folded index of an enum resolver, None for other resolvers"""
+        if name not in self._enums:
+            return None
+        source, indexed = self._enums[name]
+        enum = source()
+        if enum is None:
+            return {}
+        if indexed is None or indexed[0] is not enum:
+            index = {}
+            for key in enum.enum_names:
+                if isinstance(key, str) and not key.startswith("__"):
+                    index.setdefault(self._fold(key), enum[key])
+            indexed = (enum, index)
+            self._enums[name] = (source, indexed)
+        return indexed[1]
 
     def ignore(self, *terms) -> None:
         self._ignored_terms += terms
+        self._ignored.update(self.to_cases(list(terms), not self.case_sensitive))
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def _variants(self, phrase: str) -> List[str]:
+        # keep the cases order, each distinct variant is resolved once
+        return list(dict.fromkeys(self.to_cases(phrase, not self.case_sensitive)))
+
+    def _call(self, name: str, phrase: str) -> Any:
+        try:
+            index = self._index(name)
+            if index is not None:
+                return index.get(self._fold(phrase), _MISSED)
+            return self._store[name](phrase)
+        except LookupError:
+            return _MISSED
+        except Exception:
+            return _FAILED
+
+    def _phrase_results(self, phrase: str) -> Dict[str, Any]:
+        # resolver name -> first truthy result over the phrase's cases (None if there's none)
+        results = self._cache.get(phrase)
+        if results is None:
+            results = {}
+            self._cache[phrase] = results
+        return results
+
+    def _lookup(self, name: str, phrase: str, results: Dict[str, Any]) -> Any:
+        if name in self._enums:
+            res = self._call(name, phrase)
+            return None if res is _FAILED or res is _MISSED else res
+
+        if name in results:
+            return results[name]
+        with self._inflight_lock:
+            running = self._inflight.get((name, phrase))
+            if running is None:
+                done = self._inflight[(name, phrase)] = threading.Event()
+        if running is not None:
+            # the same phrase is being resolved for another message, its result is shared
+            running.wait()
+            return results.get(name)
+
+        try:
+            failed = False
+            for cased_phrase in self._variants(phrase):
+                res = self._call(name, cased_phrase)
+                if res is _FAILED:
+                    failed = True
+                elif res and res is not _MISSED:
+                    results[name] = res
+                    return res
+            # a transient error (e.g. a timeout) is retried on the next lookup
+            if not failed:
+                results[name] = None
+            return None
+        finally:
+            with self._inflight_lock:
+                del self._inflight[(name, phrase)]
+            done.set()
+
+    def _resolve_batches(self, phrases: List[str]) -> None:
+        for name, func in self._batch_store.items():
+            pending = [phrase for phrase in phrases if name not in self._phrase_results(phrase)]
+            if not pending:
+                continue
+            try:
+                found = func(list(dict.fromkeys(v for phrase in pending for v in self._variants(phrase))))
+            except Exception:
+                # left uncached, the phrases are looked up one by one
+                continue
+            for phrase in pending:
+                results = self._phrase_results(phrase)
+                results[name] = next((found[v] for v in self._variants(phrase) if found.get(v)), None)
 
     def parse(self, text: str) -> Tuple[Dict[str, Any], List[str]]:
         results = {}
         could_not_found = []
 
-        for phrase in self.shlexit(text):
-
-            # ignore phrase
-            if phrase in self.to_cases(self._ignored_terms, not self.case_sensitive):
-                continue
+        phrases = [phrase for phrase in self.shlexit(text) if phrase not in self._ignored]
+        self._resolve_batches([phrase for phrase in phrases if len(phrase.split("=")) != 2])
 
+        for phrase in phrases:
             # phrase is key=value, don't search by priorities
             if len(phrase.split("=")) == 2:
                 key, value = phrase.split("=")
-                try:
-                    results[key] = self._store[key](value)
-                except Exception:
-                    results[key] = value
+                # the raw value unless the resolver found something
+                result = self._call(key, value)
+                results[key] = value if result is None or result is _FAILED or result is _MISSED else result
                 continue
 
             phrase_not_found = True
+            phrase_results = self._phrase_results(phrase)
             for p in self.priorities:
-                for cased_phrase in self.to_cases(phrase, not self.case_sensitive):
-                    if results.get(p) is None:
-                        try:
-                            res = self._store[p](cased_phrase)
-                            if res:
-                                results[p] = (res, phrase)
-                                phrase_not_found = False
-                        except Exception:
-                            continue
+                if results.get(p) is None:
+                    res = self._lookup(p, phrase, phrase_results)
+                    if res:
+                        results[p] = (res, phrase)
+                        phrase_not_found = False
 
             if phrase_not_found:
                 could_not_found.append(phrase)
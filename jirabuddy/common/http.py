@@ -0,0 +1,98 @@
+import threading
+import weakref
+from functools import partial
+from typing import Callable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+_lock = threading.Lock()
+_pool_options = {"pool_connections": DEFAULT_POOL_CONNECTIONS,
+                 "pool_maxsize": DEFAULT_POOL_MAXSIZE,
+                 "pool_block": False}
+_adapter: Optional[HTTPAdapter] = None
+_session: Optional[requests.Session] = None
+# callbacks given (client name, response) for every response of a mounted session
+_observers: List[Callable[[str, requests.Response], None]] = []
+# every shared adapter handed out, their pools are replaced in forked processes
+_adapters: "weakref.WeakSet[HTTPAdapter]" = weakref.WeakSet()
+
+
+def configure(pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+              pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+              pool_block: bool = False) -> None:
+    """
+    Size the connection pool shared by all clients, call before creating them.
+
+    :param pool_connections: number of hosts connections are kept alive for
+    :param pool_maxsize: connections kept alive per host
+    :param pool_block: wait for a free connection instead of opening more than `pool_maxsize` per host
+    """
+    global _adapter, _session
+    with _lock:
+        _pool_options.update(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        _adapter = None
+        _session = None
+
+
+def shared_adapter() -> HTTPAdapter:
+    global _adapter
+    with _lock:
+        if _adapter is None:
+            _adapter = HTTPAdapter(**_pool_options)
+            _adapters.add(_adapter)
+        return _adapter
+
+
+def after_fork() -> None:
+    """Give a forked process pools of its own, call first thing in the child: the inherited connections are the
+    parent's sockets"""
+    global _lock
+    _lock = threading.Lock()
+    for adapter in list(_adapters):
+        adapter.init_poolmanager(adapter._pool_connections, adapter._pool_maxsize, block=adapter._pool_block)
+
+
+def observe(observer: Callable[[str, requests.Response], None]) -> None:
+    """Call `observer(client, response)` for every response received by a mounted session"""
+    _observers.append(observer)
+
+
+def unobserve(observer: Callable[[str, requests.Response], None]) -> None:
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+def _notify(client: str, response: requests.Response, *args, **kwargs) -> None:
+    for observer in list(_observers):
+        observer(client, response)
+
+
+def mount(session: requests.Session, client: str = "http") -> requests.Session:
+    """
+    Route `session`'s requests through the shared keep-alive pool, keeping its own auth, headers and cookies.
+    Its responses are reported to the observers as made by `client`.
+    """
+    adapter = shared_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(partial(_notify, client))
+    return session
+
+
+def new_session(client: str = "http") -> requests.Session:
+    """A session of its own (auth, headers, cookies) on the shared connection pool"""
+    return mount(requests.Session(), client=client)
+
+
+def shared_session() -> requests.Session:
+    """Session for plain requests without client state (e.g. uploads authenticated by form fields)"""
+    global _session
+    if _session is None:
+        session = new_session()
+        with _lock:
+            _session = _session or session
+    return _session
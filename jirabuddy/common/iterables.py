@@ -1,17 +1,52 @@
-from typing import Callable, Iterable, Any, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Any, Iterator, Optional
 
 
 class IterUntil(Iterable):
-    def __init__(self, action: Callable[[int], Iterable], until: Callable[[int, Any], bool]):
+    """
+    Streams the items of consecutive pages, `action(loop)` returning the items of page number `loop`.
+
+    Iteration ends when `until(loop, item)` is true for an item, when a page is empty, or after the last page:
+    the one `last_page(page)` is true for, by default a page holding fewer than `page_size` items. With `prefetch`,
+    the next page is fetched in the background while the current one is consumed, unless it is the last.
+    """
+
+    def __init__(self,
+                 action: Callable[[int], Iterable],
+                 until: Optional[Callable[[int, Any], bool]] = None,
+                 page_size: Optional[int] = None,
+                 prefetch: bool = False,
+                 last_page: Optional[Callable[[list], bool]] = None):
         self.action = action
-        self.until = until
+        self.until = until or (lambda loop, item: False)
+        self.page_size = page_size
+        self.last_page = last_page or (lambda page: self.page_size is not None and len(page) < self.page_size)
+        self.prefetch = prefetch
         self.loop = 0
 
+    def _fetch(self, loop: int) -> list:
+        return list(self.action(loop))
+
     def __iter__(self) -> Iterator:
-        while True:
-            for item in self.action(self.loop):
-                if self.until(self.loop, item):
+        executor = ThreadPoolExecutor(max_workers=1) if self.prefetch else None
+        try:
+            next_page = executor.submit(self._fetch, self.loop) if executor else None
+            while True:
+                page = next_page.result() if executor else self._fetch(self.loop)
+                if not page:
                     return
-                yield item
-            self.loop += 1
+                last_page = self.last_page(page)
+                if executor and not last_page:
+                    next_page = executor.submit(self._fetch, self.loop + 1)
 
+                for item in page:
+                    if self.until(self.loop, item):
+                        return
+                    yield item
+
+                if last_page:
+                    return
+                self.loop += 1
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
@@ -0,0 +1,137 @@
+import io
+import os
+import uuid
+import zlib
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+CHUNK_SIZE = 64 * 1024
+
+Source = Union[str, bytes, Iterable, io.IOBase]
+
+
+def iter_source(source: Source, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Bytes chunks of a readable object, bytes/str or an iterable of bytes/str chunks"""
+    if isinstance(source, (str, bytes)):
+        chunks = (source,)
+    elif hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        chunks = source
+    for chunk in chunks:
+        yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+def source_size(source: Source) -> Optional[int]:
+    """Remaining size of `source` in bytes, None when it can't be known without reading it"""
+    if isinstance(source, bytes):
+        return len(source)
+    if isinstance(source, str):
+        return len(source.encode("utf-8"))
+    if hasattr(source, "read") and hasattr(source, "fileno") and hasattr(source, "tell") and "b" in getattr(
+            source, "mode", ""):
+        try:
+            return os.fstat(source.fileno()).st_size - source.tell()
+        except (OSError, ValueError):
+            return None
+    return None
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class MultipartStream(object):
+    """
+    multipart/form-data body produced while it is sent, holding at most about one chunk of the streamed part.
+
+    `fields` are sent first, then the streamed part named `name` (a file part when `filename` is given).
+    Pass `body()` as the request data and `content_type` as its Content-Type header: when the size is known it's
+    a sized file like object (requests reads it and sets Content-Length), otherwise a generator sent chunked.
+    """
+
+    def __init__(self, fields: Dict[str, str], name: str, source: Source, filename: Optional[str] = None,
+                 content_type: str = "application/octet-stream", compress: bool = False,
+                 chunk_size: int = CHUNK_SIZE):
+        self.boundary: str = uuid.uuid4().hex
+        self.content_type: str = "multipart/form-data; boundary=%s" % self.boundary
+        self.chunk_size: int = chunk_size
+        self.compress: bool = compress
+
+        head = []
+        for key, value in fields.items():
+            if value is not None:
+                head.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                            % (self.boundary, key, value))
+        disposition = 'form-data; name="%s"' % name
+        if filename is not None:
+            disposition += '; filename="%s"' % (filename + ".gz" if compress else filename).replace('"', "'")
+        head.append("--%s\r\nContent-Disposition: %s\r\nContent-Type: %s\r\n\r\n"
+                    % (self.boundary, disposition, "application/gzip" if compress else content_type))
+        self._head: bytes = "".join(head).encode("utf-8")
+        self._tail: bytes = ("\r\n--%s--\r\n" % self.boundary).encode("utf-8")
+
+        size = None if compress else source_size(source)
+        self._length: Optional[int] = None if size is None else len(self._head) + size + len(self._tail)
+        self._source = source
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._buffer: bytes = b""
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        yield self._head
+        chunks = iter_source(self._source, self.chunk_size)
+        yield from gzip_chunks(chunks) if self.compress else chunks
+        yield self._tail
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._chunks is None:
+            self._chunks = self._iter_chunks()
+        if self._buffer:
+            buffered, self._buffer = self._buffer, b""
+            yield buffered
+        yield from self._chunks
+
+    def read(self, size: int = -1) -> bytes:
+        if self._chunks is None:
+            self._chunks = self._iter_chunks()
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = b"".join(parts)
+        if size < 0:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    @property
+    def length(self) -> Optional[int]:
+        return self._length
+
+    def body(self):
+        return _SizedMultipartStream(self) if self._length is not None else iter(self)
+
+
+class _SizedMultipartStream(object):
+    """A MultipartStream of known size, as requests expects file like bodies to be"""
+
+    def __init__(self, stream: MultipartStream):
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self._stream)
+
+    def __len__(self) -> int:
+        return self._stream.length
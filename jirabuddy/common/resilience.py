@@ -0,0 +1,183 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+# statuses meaning the server didn't handle the request (safe to retry anything)
+REJECTED_STATUSES = (429, 503)
+# statuses worth retrying idempotent requests on
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__("%s is failing, not calling it for another %.1f seconds" % (endpoint, retry_in))
+        self.endpoint: str = endpoint
+        self.retry_in: float = retry_in
+
+
+def error_status(ex: Exception) -> Optional[int]:
+    """HTTP status of a JIRAError, GitlabError or requests HTTPError"""
+    for attribute in ("status_code", "response_code"):
+        status = getattr(ex, attribute, None)
+        if isinstance(status, int):
+            return status
+    return getattr(getattr(ex, "response", None), "status_code", None)
+
+
+def is_transient(ex: Exception) -> bool:
+    if isinstance(ex, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return error_status(ex) in TRANSIENT_STATUSES
+
+
+def is_connect_error(ex: Exception) -> bool:
+    """The connection couldn't be made (refused, unresolved host, connect timeout), the request wasn't sent"""
+    if isinstance(ex, (requests.ConnectTimeout, ConnectionRefusedError)):
+        return True
+    if not isinstance(ex, requests.ConnectionError):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the actual failure. Errors once connected (e.g.
+    # "Connection aborted", RemoteDisconnected) are ProtocolErrors: the server may have handled the request
+    reason = ex.args[0] if ex.args else None
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError, ConnectionRefusedError))
+
+
+def is_rejected(ex: Exception) -> bool:
+    if is_connect_error(ex):
+        return True
+    return error_status(ex) in REJECTED_STATUSES
+
+
+class RetryPolicy(object):
+    """
+    Up to `attempts` calls, waiting an exponentially growing delay (base_delay * 2^n, capped at max_delay) between
+    them, with full jitter so concurrent callers don't retry in lockstep.
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8):
+        self.attempts: int = max(1, attempts)
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+
+    def delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def call(self, func: Callable, *args, retry_on: Callable[[Exception], bool] = is_transient, **kwargs) -> Any:
+        for attempt in range(self.attempts):
+            try:
+                return func(*args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except Exception as ex:
+                if attempt + 1 >= self.attempts or not retry_on(ex):
+                    raise
+                delay = self.delay(attempt)
+                logger.warning("%s failed (%s), retrying in %.2f seconds", getattr(func, "__name__", func),
+                               error_status(ex) or type(ex).__name__, delay)
+                time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """
+    Fails fast with CircuitOpenError after `failure_threshold` consecutive transient failures, for `reset_timeout`
+    seconds. Then a single trial call is let through, closing the circuit if it succeeds.
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.endpoint: str = endpoint
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.failures: int = 0
+        self.opened_at: Optional[float] = None
+        self._trial: bool = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+            if retry_in > 0 or self._trial:
+                raise CircuitOpenError(self.endpoint, max(retry_in, 0))
+            self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("%s recovered, closing its circuit", self.endpoint)
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self, ex: Exception) -> None:
+        with self._lock:
+            if not is_transient(ex):
+                # the endpoint answered, the request was wrong
+                self._trial = False
+                if self.opened_at is not None:
+                    self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial:
+                    logger.error("%s failed %d times, opening its circuit for %.1f seconds",
+                                 self.endpoint, self.failures, self.reset_timeout)
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as ex:
+            self.record_failure(ex)
+            raise
+        self.record_success()
+        return result
+
+
+class Resilience(object):
+    """
+    A RetryPolicy wrapped around a CircuitBreaker per endpoint name.
+
+    Non idempotent calls (e.g. creating a ticket) are only retried when the server surely didn't handle them
+    (the connection couldn't be made, 429, 503).
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8,
+                 failure_threshold: int = 5, reset_timeout: float = 30):
+        self.retry: RetryPolicy = RetryPolicy(attempts=attempts, base_delay=base_delay, max_delay=max_delay)
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(endpoint, CircuitBreaker(endpoint,
+                                                                            failure_threshold=self.failure_threshold,
+                                                                            reset_timeout=self.reset_timeout))
+        return breaker
+
+    def call(self, endpoint: str, func: Callable, *args, idempotent: bool = True, **kwargs) -> Any:
+        breaker = self.breaker(endpoint)
+
+        def attempt():
+            return breaker.call(func, *args, **kwargs)
+
+        attempt.__name__ = endpoint
+        return self.retry.call(attempt, retry_on=is_transient if idempotent else is_rejected)
@@ -1,10 +1,13 @@
 import logging
 import os
+from functools import partial
 
 from jirabuddy.bot import SlackBot
+from jirabuddy.bot.shards import ShardedSlackBot
 from jirabuddy.clients import GitLabClient
 from jirabuddy.clients import JiraClient
-from jirabuddy.common import enum, FreeTextParser, Configuration
+from jirabuddy.common import enum, http, FreeTextParser, Configuration
+from jirabuddy.common.resilience import Resilience
 
 APP_NAME = "colo"
 
@@ -15,34 +18,102 @@ def init_slackbot_plugins(config):
     exec(open(config.bot.plugins_path).read())
 
 
+def flag(value) -> bool:
+    return bool(int(value))
+
+
+def path(value) -> str:
+    return value or None
+
+
+def settings(config, section: str, **casts) -> dict:
+    """
+    Keyword arguments for the keys of `casts` set in `section`, converted by their cast. Keys missing from older
+    configuration files are left out, so the defaults of the called constructor apply.
+    """
+    values = getattr(config, section, None)
+    found = {}
+    for key, cast in casts.items():
+        value = getattr(values, key, None)
+        if value is not None:
+            found[key] = cast(value)
+    return found
+
+
 def main():
     config = enum("config", nest=True, **Configuration(APP_NAME).parse())
+    http.configure(**settings(config, "http", pool_connections=int, pool_maxsize=int, pool_block=flag))
+    resilience_config = settings(config, "resilience",
+                                 attempts=int,
+                                 base_delay=float,
+                                 max_delay=float,
+                                 failure_threshold=int,
+                                 reset_timeout=float)
     ftxtp = FreeTextParser()
     ftxtp.ignore("on", "for", "to", "in")
 
-    slackbot = SlackBot(config.slack.token,
-                        debug=bool(int(os.environ.get("DEBUG", 0))),
-                        plugins_cache_path=config.bot.plugins_cache_path)
+    bot_config = settings(config, "bot",
+                          runtime=str,
+                          shards=int,
+                          state_flush_interval=float,
+                          workers=int,
+                          queue_size=int,
+                          plugin_concurrency=int,
+                          help_page_size=int,
+                          outbox_rate=float,
+                          outbox_burst=int,
+                          outbox_coalesce_window=float,
+                          errors_dedupe_window=float,
+                          metrics_port=int,
+                          profile_threshold=float,
+                          profile_mode=str,
+                          profile_keep=int,
+                          profile_path=path)
+    runtime = bot_config.pop("runtime", "threads")
+    shards = bot_config.pop("shards", 0)
+    if runtime == "asyncio":
+        if shards:
+            raise ValueError("bot.shards requires the threads runtime")
+        from jirabuddy.bot.aio import AsyncSlackBot as bot_class
+    elif runtime == "threads":
+        bot_class = partial(ShardedSlackBot, shards=shards) if shards else SlackBot
+    else:
+        raise ValueError('unknown bot.runtime "%s", expected "threads" or "asyncio"' % runtime)
+
+    slackbot = bot_class(config.slack.token,
+                         debug=bool(int(os.environ.get("DEBUG", 0))),
+                         plugins_cache_path=config.bot.plugins_cache_path,
+                         **bot_config)
 
     if "jira" in config.enum_names:
         jira_client = JiraClient(config.jira.server,
                                  config.jira.username,
                                  config.jira.password,
-                                 default_project=config.jira.default_project)
-        slackbot.register("jira", jira_client)
-        ftxtp.register("jira_project", jira_client.Projects.get)
-        ftxtp.register("jira_component", jira_client.Components.get)
-        ftxtp.register("jira_ticket_type", jira_client.TicketTypes.get)
-        ftxtp.register("jira_priority", jira_client.Priorities.get)
-        ftxtp.register("jira_fix_version", jira_client.FixVersions.get)
+                                 default_project=config.jira.default_project,
+                                 resilience=Resilience(**resilience_config),
+                                 **settings(config, "jira",
+                                            metadata_cache_path=path,
+                                            metadata_cache_ttl=float,
+                                            metadata_workers=int,
+                                            search_page_size=int,
+                                            reuse_session_cookies=flag))
+        slackbot.register("jira", jira_client, blocking=True)
+        # the metadata enums are replaced when refreshed (or when the project changes), the parser follows
+        ftxtp.register_enum(lambda: jira_client.Projects, name="jira_project")
+        ftxtp.register_enum(lambda: jira_client.Components, name="jira_component")
+        ftxtp.register_enum(lambda: jira_client.TicketTypes, name="jira_ticket_type")
+        ftxtp.register_enum(lambda: jira_client.Priorities, name="jira_priority")
+        ftxtp.register_enum(lambda: jira_client.FixVersions, name="jira_fix_version")
 
     if "gitlab" in config.enum_names and config.gitlab.server:
         gitlab_client = GitLabClient(config.gitlab.server,
-                                     config.gitlab.token)
-        slackbot.register("gitlab", gitlab_client)
+                                     config.gitlab.token,
+                                     resilience=Resilience(**resilience_config),
+                                     **settings(config, "gitlab", directory_refresh_interval=float))
+        slackbot.register("gitlab", gitlab_client, blocking=True)
 
-    ftxtp.register("slack_user", slackbot.find_user)
-    slackbot.register("text_parser", ftxtp)
+    ftxtp.register_batch("slack_user", slackbot.find_users)
+    slackbot.register("text_parser", ftxtp, blocking=True)
 
     init_slackbot_plugins(config)
     logging.info("Starting!")